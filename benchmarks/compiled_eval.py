@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""compiled_eval
+
+Compare running a Program by walking the ASG against running its compiled
+closures.
+
+Usage:
+  compiled_eval [--lines=LINES] [--runs=RUNS]
+  compiled_eval (-h | --help)
+
+Options:
+  --lines=LINES      Number of statements in the generated script [default: 1000]
+  --runs=RUNS        Number of times each evaluator runs the script [default: 20]
+  -h --help          Show this screen.
+"""
+
+import time
+
+from docopt import docopt
+
+from commands import cmdEcho, cmdSet
+from interpreter import Interpreter, Environment
+from interpreter.compiler import compileProgram
+
+
+def generateScript(lines):
+    templates = [
+        'set name{0} "user {0}"',
+        'echo "Hello ${{name{0}}}, this is line {0}" $(echo nested {0}) 1.5',
+        'echo a b c d e f',
+        '"${{name{0}}} at $(echo {0})"',
+    ]
+    # Each template refers to the variable set by the first one
+    return "\n".join(templates[i % len(templates)].format(i - i % len(templates)) for i in range(lines))
+
+
+def newContext():
+    return {
+        "vars": Environment({"echo": cmdEcho, "set": cmdSet}),
+        "exported_vars": {},
+        "options": {},
+    }
+
+
+def timeRuns(fn, runs):
+    context = newContext()
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn(context)
+    return time.perf_counter() - start
+
+
+def main(args):
+    lines = int(args['--lines'])
+    runs = int(args['--runs'])
+
+    program = Interpreter(backend="rd", diskCache=False).parse(generateScript(lines))
+
+    start = time.perf_counter()
+    compiled = compileProgram(program)
+    compileTime = time.perf_counter() - start
+
+    assert program(newContext()) == compiled(newContext())
+
+    treeTime = timeRuns(program, runs)
+    compiledTime = timeRuns(compiled, runs)
+
+    print("statements:   {}".format(lines))
+    print("runs:         {}".format(runs))
+    print("compile:      {:.3f}s".format(compileTime))
+    print("tree walking: {:.3f}s".format(treeTime))
+    print("compiled:     {:.3f}s".format(compiledTime))
+    print("speedup:      {:.1f}x".format(treeTime / compiledTime))
+
+
+if __name__ == '__main__':
+    main(docopt(__doc__))
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""parse_eval
+
+Time the phases of running a script separately on scripts generated by
+scriptgen: parsing the source, visiting the parse tree to build the ASG
+(including optimize, as Interpreter.parseUncached does), compiling the
+Program and evaluating it. The rd backend builds the ASG while parsing, it
+has no visit phase. The peak memory allocated by every phase is measured
+with tracemalloc on a separate run, so it does not slow down the timed ones.
+
+Results can be written as JSON and compared with the results of another
+commit, phase by phase.
+
+Usage:
+  parse_eval [--shapes=SHAPES] [--backends=BACKENDS] [--lines=LINES] [--depth=DEPTH] [--width=WIDTH]
+             [--runs=RUNS] [--output=FILE] [--compare=FILE]
+  parse_eval (-h | --help)
+
+Options:
+  --shapes=SHAPES      Comma separated script shapes, see scriptgen
+                       [default: nested,interpolation,commands,comments,mixed]
+  --backends=BACKENDS  Comma separated parser backends [default: peg,rd]
+  --lines=LINES        Number of statements in every script [default: 500]
+  --depth=DEPTH        Nesting depth of $(...) [default: 10]
+  --width=WIDTH        Interpolations per string, comment lines per command [default: 20]
+  --runs=RUNS          Number of timed runs of every phase [default: 5]
+  --output=FILE        Write the results to FILE as JSON
+  --compare=FILE       Compare the results with those in FILE (written with --output)
+  -h --help            Show this screen.
+"""
+
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from os import path
+
+from arpeggio import visit_parse_tree
+from docopt import docopt
+
+from benchmarks.scriptgen import generate
+from commands import cmdEcho, cmdSet
+from interpreter import Interpreter, Environment
+from interpreter import rdparser
+from interpreter.compiler import compileProgram
+from interpreter.optimizer import optimize
+
+gRoot = path.dirname(path.dirname(path.abspath(__file__)))
+gPhases = ["parse", "visit", "compile", "eval"]
+
+
+def newContext():
+    return {
+        "vars": Environment({"echo": cmdEcho, "set": cmdSet}),
+        "exported_vars": {},
+        "options": {},
+    }
+
+
+def phases(interpreter, source):
+    """
+    Return the (name, fn) of every phase of running source, each fn taking
+    the result of the one before.
+    """
+    if interpreter.backend == "rd":
+        steps = [("parse", lambda _: optimize(rdparser.parse(source)))]
+    else:
+        parser = interpreter.programParser
+        steps = [("parse", lambda _: parser.parse(source)),
+                 ("visit", lambda tree: optimize(visit_parse_tree(tree, interpreter.visitor)))]
+    return steps + [("compile", compileProgram),
+                    ("eval", lambda fn: fn(newContext()))]
+
+
+def measure(interpreter, source, runs):
+    """
+    Return the median and fastest time of runs of every phase and its peak
+    memory use, by phase.
+    """
+    results = {}
+    value = None
+    for name, fn in phases(interpreter, source):
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            result = fn(value)
+            times.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            fn(value)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        results[name] = {"median": statistics.median(times), "min": min(times), "peakBytes": peak}
+        value = result
+    return results
+
+
+def currentCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=gRoot, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(results, baseline):
+    """
+    Print results, with the ratio to the median time in baseline (results
+    loaded from --compare) where there is one.
+    """
+    old = {(r["shape"], r["backend"]): r["phases"] for r in baseline["results"]} if baseline else {}
+    print("{:<14} {:<7} {:<8} {:>10} {:>10} {:>10}{}".format("shape", "backend", "phase", "median ms", "min ms",
+                                                           "peak KiB", "  vs old" if baseline else ""))
+    for result in results:
+        oldPhases = old.get((result["shape"], result["backend"]), {})
+        for phase in gPhases:
+            stats = result["phases"].get(phase)
+            if stats is None:
+                continue
+            ratio = ""
+            if phase in oldPhases:
+                ratio = "  {:6.2f}x".format(stats["median"] / oldPhases[phase]["median"])
+            print("{:<14} {:<7} {:<8} {:10.2f} {:10.2f} {:10.1f}{}".format(
+                result["shape"], result["backend"], phase, stats["median"] * 1000, stats["min"] * 1000,
+                stats["peakBytes"] / 1024, ratio))
+
+
+def main(args):
+    lines = int(args['--lines'])
+    depth = int(args['--depth'])
+    width = int(args['--width'])
+    runs = int(args['--runs'])
+
+    results = []
+    for backend in args['--backends'].split(","):
+        interpreter = Interpreter(backend=backend, diskCache=False)
+        # Loading the parser is not part of any phase
+        if backend != "rd":
+            interpreter.programParser
+        for shape in args['--shapes'].split(","):
+            source = generate(shape, lines, depth, width)
+            results.append({
+                "shape": shape,
+                "backend": backend,
+                "bytes": len(source),
+                "phases": measure(interpreter, source, runs),
+            })
+
+    baseline = None
+    if args['--compare']:
+        with open(args['--compare'], "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print("Compared with {}".format(baseline.get("commit") or args['--compare']))
+
+    report(results, baseline)
+
+    if args['--output']:
+        document = {
+            "commit": currentCommit(),
+            "python": platform.python_version(),
+            "settings": {"lines": lines, "depth": depth, "width": width, "runs": runs},
+            "results": results,
+        }
+        with open(args['--output'], "w", encoding="utf-8") as f:
+            json.dump(document, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == '__main__':
+    main(docopt(__doc__))
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""pipe_throughput
+
+Compare the throughput of pipelines of external commands run by unishell
+with the same pipelines run by bash. Statements are run the way a user runs
+them, with "unishell -c", and the CPU time and peak memory of the unishell
+process itself are reported. Reading lines into the interpreter is timed in
+process, as it cannot be seen from outside.
+
+Usage:
+  pipe_throughput [--size=MB] [--dir=DIR]
+  pipe_throughput (-h | --help)
+
+Options:
+  --size=MB          Size of the generated input file in MiB [default: 256]
+  --dir=DIR          Write the input file here instead of a temporary directory
+  -h --help          Show this screen.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from os import path
+
+from docopt import docopt
+
+from interpreter import Interpreter, Environment
+from interpreter.compiler import compileExpr
+
+
+def makeInput(filePath, size):
+    line = "".join(chr(ord("a") + i % 26) for i in range(79)) + "\n"
+    block = "".join(line if i % 10 else line.replace("a", "x") for i in range(1000)).encode()
+    with open(filePath, "wb") as f:
+        for _ in range(size // len(block) + 1):
+            f.write(block)
+    return os.path.getsize(filePath)
+
+
+def newContext():
+    return {
+        "vars": Environment(),
+        "exported_vars": {},
+        "options": {},
+    }
+
+
+gUnishell = path.join(path.dirname(path.dirname(path.abspath(__file__))), "unishell.py")
+
+
+def timeCli(source):
+    """
+    Return (wall seconds, CPU seconds, peak RSS in MiB) of the unishell
+    process running the statement source with its output going nowhere.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, gUnishell, "--no-cache", "--parser=rd", "-c", source],
+                               stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, source)
+    return wall, usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024
+
+
+def timeUnishell(source, consume):
+    """
+    Return (wall, interpreter CPU) seconds for running the single statement
+    source and passing its result to consume.
+    """
+    expr = Interpreter(backend="rd", diskCache=False).parse(source).expressions[0]
+    fn = compileExpr(expr)
+    start = time.perf_counter()
+    cpuStart = time.process_time()
+    consume(fn(newContext()))
+    return time.perf_counter() - start, time.process_time() - cpuStart
+
+
+def timeBash(script):
+    start = time.perf_counter()
+    subprocess.run(["bash", "-c", script], stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def countLines(stream):
+    return sum(1 for _ in stream)
+
+
+def countTextLines(filePath):
+    # Lines read through a text mode pipe, one readline at a time
+    with subprocess.Popen(["cat", filePath], stdout=subprocess.PIPE, text=True) as p:
+        return sum(1 for _ in p.stdout)
+
+
+def main(args):
+    inputDir = args['--dir'] or tempfile.gettempdir()
+    fd, filePath = tempfile.mkstemp(prefix="pipe_throughput", dir=inputDir)
+    os.close(fd)
+
+    try:
+        size = makeInput(filePath, int(args['--size']) << 20)
+        mib = size / (1 << 20)
+        print("input:        {:.0f} MiB".format(mib))
+
+        def report(label, wall, cpu=None, rss=None):
+            line = "{:<40} {:7.3f}s {:8.0f} MiB/s".format(label, wall, mib / wall)
+            if cpu is not None:
+                line += "  (unishell CPU {:.3f}s".format(cpu)
+                line += ", peak RSS {:.0f} MiB)".format(rss) if rss is not None else ")"
+            print(line)
+
+        cases = [
+            ("!cat | !grep x | !wc -l", '!cat "{}" | !grep x | !wc -l', 'cat "{}" | grep x | wc -l'),
+            ("!cat | !sort | !uniq -c", '!cat "{}" | !sort | !uniq -c', 'cat "{}" | sort | uniq -c'),
+            ("!cat, printed", '!cat "{}"', 'cat "{}"'),
+        ]
+        for label, source, bashScript in cases:
+            report("unishell -c " + label, *timeCli(source.format(filePath)))
+            report("bash", timeBash(bashScript.format(filePath)))
+
+        wall, cpu = timeUnishell('!cat "{}"'.format(filePath), countLines)
+        report("!cat, lines into the interpreter", wall, cpu)
+        report("bash", timeBash('cat "{}" | wc -l'.format(filePath)))
+
+        start = time.perf_counter()
+        countTextLines(filePath)
+        report("text mode readline (before)", time.perf_counter() - start)
+    finally:
+        os.remove(filePath)
+
+
+if __name__ == '__main__':
+    main(docopt(__doc__))
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""scriptgen
+
+Generate synthetic UniShell scripts of a given size and shape, for the
+parser and evaluator benchmarks. Only echo and set are used, so the
+scripts run without touching the file system.
+
+Shapes:
+  nested         Statements nesting $(echo ...) DEPTH levels deep
+  interpolation  Long quoted strings interpolating WIDTH ${var}s each
+  commands       Many short commands with arguments and flags
+  comments       Mostly comment lines, with a command every WIDTH lines
+  mixed          All of the above, statement by statement
+
+Usage:
+  scriptgen [--shape=SHAPE] [--lines=LINES] [--depth=DEPTH] [--width=WIDTH]
+  scriptgen (-h | --help)
+
+Options:
+  --shape=SHAPE      Shape of the script [default: mixed]
+  --lines=LINES      Number of statements [default: 100]
+  --depth=DEPTH      Nesting depth of $(...) [default: 10]
+  --width=WIDTH      Interpolations per string, comment lines per command [default: 20]
+  -h --help          Show this screen.
+"""
+
+from docopt import docopt
+
+
+def nested(i, depth, width):
+    return "echo " + "".join("$(echo {} ".format(level) for level in range(depth)) + "x{}".format(i) + ")" * depth
+
+
+def interpolation(i, depth, width):
+    return 'echo "line {}: '.format(i) + " and ".join("${{v{}}}".format(n % 10) for n in range(width)) + ' done"'
+
+
+def command(i, depth, width):
+    return "echo -n --flag{0} word{0} {0} {0}.5 $v{1}".format(i, i % 10)
+
+
+def comment(i, depth, width):
+    lines = ["# comment {} line {}, some words to skip over".format(i, n) for n in range(width - 1)]
+    return "\n".join(lines + ["echo {}  # trailing comment".format(i)])
+
+
+gShapes = {
+    "nested": [nested],
+    "interpolation": [interpolation],
+    "commands": [command],
+    "comments": [comment],
+    "mixed": [nested, interpolation, command, comment],
+}
+
+
+def generate(shape, lines, depth=10, width=20):
+    """
+    Return a script of lines statements of the given shape (see gShapes).
+    The variables v0 to v9 it refers to are set at the top.
+    """
+    if shape not in gShapes:
+        raise ValueError("Unknown shape {!r}, expected one of {}".format(shape, ", ".join(sorted(gShapes))))
+    makers = gShapes[shape]
+    header = ['set v{0} "value {0}"'.format(n) for n in range(10)]
+    return "\n".join(header + [makers[i % len(makers)](i, depth, width) for i in range(lines)]) + "\n"
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    print(generate(args['--shape'], int(args['--lines']), int(args['--depth']), int(args['--width'])), end="")
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""startup_latency
+
+Compare how long a short command line takes with a cold start of unishell
+and when it is sent to a warm server with unishellc.
+
+Usage:
+  startup_latency [--runs=RUNS] [--parser=BACKEND] [--command=COMMAND]
+  startup_latency (-h | --help)
+
+Options:
+  --runs=RUNS        Number of times each way runs the command [default: 20]
+  --parser=BACKEND   Parser backend, peg or rd [default: peg]
+  --command=COMMAND  Command line to run [default: echo hello]
+  -h --help          Show this screen.
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from os import path
+
+from docopt import docopt
+
+gRoot = path.dirname(path.dirname(path.abspath(__file__)))
+
+
+def timeRuns(argv, runs, env):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(argv, stdout=subprocess.DEVNULL, env=env, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(label, times):
+    print("{:<24} median {:7.1f} ms  min {:7.1f} ms".format(label, statistics.median(times) * 1000,
+                                                             min(times) * 1000))
+
+
+def waitForSocket(socketPath, server):
+    while not path.exists(socketPath):
+        if server.poll() is not None:
+            raise RuntimeError("The server exited with status {}".format(server.returncode))
+        time.sleep(0.01)
+
+
+def main(args):
+    runs = int(args['--runs'])
+    parser = "--parser=" + args['--parser']
+    command = ["-c", args['--command']]
+
+    with tempfile.TemporaryDirectory(prefix="startup_latency") as tempDir:
+        env = dict(os.environ, UNISHELL_SOCKET=path.join(tempDir, "unishell.sock"))
+
+        report("cold (unishell)", timeRuns([sys.executable, path.join(gRoot, "unishell.py"), parser] + command,
+                                           runs, env))
+
+        server = subprocess.Popen([sys.executable, path.join(gRoot, "unishell.py"), "--server", parser],
+                                  stderr=subprocess.DEVNULL, env=env)
+        try:
+            waitForSocket(env["UNISHELL_SOCKET"], server)
+            report("warm (unishellc)", timeRuns([sys.executable, path.join(gRoot, "unishellc"), parser] + command,
+                                                runs, env))
+        finally:
+            server.terminate()
+            server.wait()
+
+        report("python -c pass", timeRuns([sys.executable, "-c", "pass"], runs, env))
+
+
+if __name__ == '__main__':
+    main(docopt(__doc__))
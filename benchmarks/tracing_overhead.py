@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""tracing_overhead
+
+Time parsing (with the PEG backend and UniShellVisitor) and evaluation of a
+generated script to measure what tracing costs, both when it is disabled
+and when it is enabled (trace output is discarded).
+
+Usage:
+  tracing_overhead [--lines=LINES] [--runs=RUNS] [--trace]
+  tracing_overhead (-h | --help)
+
+Options:
+  --lines=LINES      Number of statements in the generated script [default: 500]
+  --runs=RUNS        Number of times the script is evaluated [default: 20]
+  --trace            Enable tracing while timing
+  -h --help          Show this screen.
+"""
+
+import contextlib
+import os
+import time
+
+from docopt import docopt
+
+from benchmarks.compiled_eval import generateScript, newContext
+from interpreter import Interpreter
+from interpreter.compiler import compileProgram
+from lib.logger import setDebugLevel
+
+
+def measure(lines, runs):
+    source = generateScript(lines)
+    interpreter = Interpreter(backend="peg", diskCache=False)
+    interpreter.parseUncached("")  # Load the grammar outside of the timings
+
+    start = time.perf_counter()
+    program = interpreter.parseUncached(source)
+    parseTime = time.perf_counter() - start
+
+    compiled = compileProgram(program)
+
+    times = {"parse": parseTime}
+    for name, fn in (("tree walking eval", program), ("compiled eval", compiled)):
+        context = newContext()
+        start = time.perf_counter()
+        for _ in range(runs):
+            fn(context)
+        times[name] = time.perf_counter() - start
+    return times
+
+
+def main(args):
+    if args['--trace']:
+        setDebugLevel(1)
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        times = measure(int(args['--lines']), int(args['--runs']))
+
+    for name, seconds in times.items():
+        print("{:<18} {:.3f}s".format(name + ":", seconds))
+
+
+if __name__ == '__main__':
+    main(docopt(__doc__))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""walk_tree
+
+Time walking a synthetic directory tree with one thread and with a thread
+pool, as find and du do.
+
+Usage:
+  walk_tree [--depth=DEPTH] [--fanout=FANOUT] [--files=FILES] [--workers=WORKERS] [--dir=DIR]
+  walk_tree (-h | --help)
+
+Options:
+  --depth=DEPTH      Levels of directories in the tree [default: 4]
+  --fanout=FANOUT    Subdirectories in every directory [default: 6]
+  --files=FILES      Files in every directory [default: 20]
+  --workers=WORKERS  Threads used by the parallel walk (0 picks a default) [default: 0]
+  --dir=DIR          Build the tree here instead of a temporary directory,
+                     e.g. on the network file system to be measured
+  -h --help          Show this screen.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from os import path
+
+from docopt import docopt
+
+from pipeline.walk import walk, defaultWorkers
+
+
+def makeTree(root, depth, fanout, files):
+    count = 0
+    for i in range(files):
+        with open(path.join(root, "file{}.txt".format(i)), "w") as f:
+            f.write("x" * i)
+        count += 1
+    if depth > 1:
+        for i in range(fanout):
+            subdir = path.join(root, "dir{}".format(i))
+            os.mkdir(subdir)
+            count += 1 + makeTree(subdir, depth - 1, fanout, files)
+    return count
+
+
+def statSize(entry):
+    return entry.stat(follow_symlinks=False).st_size
+
+
+def timeWalk(root, workers, visit):
+    start = time.perf_counter()
+    count = sum(1 for _ in walk(root, workers=workers, visit=visit))
+    return count, time.perf_counter() - start
+
+
+def timeOsWalk(root):
+    start = time.perf_counter()
+    count = 0
+    for dirPath, dirNames, fileNames in os.walk(root):
+        for name in fileNames:
+            os.lstat(path.join(dirPath, name))
+        count += len(dirNames) + len(fileNames)
+    return count, time.perf_counter() - start
+
+
+def main(args):
+    workers = int(args['--workers']) or defaultWorkers()
+    base = args['--dir'] or tempfile.gettempdir()
+    root = tempfile.mkdtemp(prefix="walk_tree", dir=base)
+
+    try:
+        entries = makeTree(root, int(args['--depth']), int(args['--fanout']), int(args['--files']))
+        print("entries:      {}".format(entries))
+        print("cpus:         {}".format(os.cpu_count()))
+
+        for label, visit in (("find", lambda entry: entry), ("du", statSize)):
+            count, serial = timeWalk(root, 1, visit)
+            assert count == entries
+            count, parallel = timeWalk(root, workers, visit)
+            assert count == entries
+            print("{}, 1 thread:   {:.3f}s".format(label, serial))
+            print("{}, {} threads: {:.3f}s ({:.1f}x)".format(label, workers, parallel, serial / parallel))
+
+        count, osWalk = timeOsWalk(root)
+        print("os.walk + lstat: {:.3f}s".format(osWalk))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main(docopt(__doc__))
@@ -1,8 +1,21 @@
+import fnmatch
+import itertools
 import os
+import re
 import sys
+import threading
 
-from pipeline.objects import FileInfo
+from pipeline import asStream
+from pipeline.objects.FileInfo import FileInfo, scanDir
+from pipeline.objects.Table import Table
+from pipeline.walk import walk
+from pipeline.parallel import parallel
 from lib.exceptions import ArgumentError
+from interpreter.ASG import Command, Pipeline
+from lib.pathhash import gPathHash
+from lib.registry import summaryOf
+from pipeline.jobs import gJobs, checkForeground
+from pipeline.process import childEnv, findExternal
 
 # TODO: Remove calls to String object once the string interpolation regex
 # is incorporated in the main grammar
@@ -34,6 +47,9 @@ def cmdCd(args, flags, context):
         raise ArgumentError("The argument supplied is of incorrect type.")
 
     try:
+        if args:
+            # The directory belongs to the whole shell
+            checkForeground(context, "cd")
         os.chdir(args[0])
         # TODO: Revert hack
         return None  # Do not print the current dir when changing the directory
@@ -49,6 +65,7 @@ def cmdExit(args, flags, context):
     """
     if args and not type(args[0]) is int:
         raise ArgumentError("The argument supplied is of incorrect type.")
+    checkForeground(context, "exit")
 
     try:
         sys.exit(args[0])
@@ -187,18 +204,251 @@ def cmdOptions(args, flags, context):
 def cmdLs(args, flags, context):
     """
     List contents of target directory. If no directory is specified use
-    current directory as target.
+    current directory as target. Produces a ListedFile for every entry, the
+    entries are only stat'ed when their details are needed.
 
     Syntax: -
-        ls [target_dir]
+        ls [-p] [target_dir]
+
+        -p    Stat the entries in parallel ahead of time (for slow network
+              file systems)
     """
     target = (args[0] if args else None) or '.'
 
     if not type(target) is str:
         raise ArgumentError("The argument needs to be a string.")
 
-    for x in os.listdir(target):
-        print(x)
+    parallel = any(flag.name == "p" for flag in flags)
+
+    return scanDir(target, 0 if parallel else None)
+
+
+def cmdHead(args, flags, context):
+    """
+    Pass on the first n items piped in (10 by default).
+
+    Syntax: -
+        ... | head [n]
+    """
+    count = args[0] if args else 10
+
+    if not type(count) is int or count < 0:
+        raise ArgumentError("The argument needs to be a non negative integer.")
+
+    return itertools.islice(asStream(context.get("input")), count)
+
+
+def cmdFilter(args, flags, context):
+    """
+    Pass on the items piped in whose text matches a wildcard pattern. Quote
+    the pattern (filter "*.py"), unquoted wildcards are expanded to file
+    names before filter sees them.
+
+    Syntax: -
+        ... | filter [-v] pattern
+
+        -v    Pass on the items which do not match instead
+    """
+    if len(args) > 1 and all(type(arg) is str for arg in args):
+        raise ArgumentError("Expected a single wildcard pattern, quote it so it is not expanded.")
+    if len(args) != 1 or not type(args[0]) is str:
+        raise ArgumentError("Expected a single wildcard pattern.")
+
+    match = re.compile(fnmatch.translate(args[0])).match
+    invert = any(flag.name == "v" for flag in flags)
+
+    return (item for item in asStream(context.get("input")) if (match(str(item)) is None) == invert)
+
+
+def inputTable(context):
+    return Table.fromStream(asStream(context.get("input")))
+
+
+def cmdTable(args, flags, context):
+    """
+    Collect the items piped in into a Table with a column for every field.
+
+    Syntax: -
+        ... | table
+    """
+    if args:
+        raise ArgumentError("No arguments expected")
+
+    return inputTable(context)
+
+
+def cmdWhere(args, flags, context):
+    """
+    Keep the rows of the table (or items) piped in whose field compares to a
+    value. op is one of eq, ne, lt, le, gt, ge or like (wildcard match).
+
+    Syntax: -
+        ... | where field op value
+    """
+    if len(args) != 3 or not type(args[0]) is str or not type(args[1]) is str:
+        raise ArgumentError("Expected a field, a comparison and a value.")
+
+    return inputTable(context).filter(*args)
+
+
+def cmdSort(args, flags, context):
+    """
+    Sort the rows of the table (or items) piped in by a field.
+
+    Syntax: -
+        ... | sort [-r] [field]
+
+        -r    Sort in descending order
+    """
+    table = inputTable(context)
+    if not table.columns:
+        return table
+
+    field = args[0] if args else table.columns[0].name
+    if not type(field) is str:
+        raise ArgumentError("The argument needs to be a string.")
+
+    return table.sort(field, reverse=any(flag.name == "r" for flag in flags))
+
+
+def cmdSelect(args, flags, context):
+    """
+    Keep only the given fields of the table (or items) piped in.
+
+    Syntax: -
+        ... | select field [field ...]
+    """
+    if not args or not all(type(arg) is str for arg in args):
+        raise ArgumentError("Expected one or more field names.")
+
+    return inputTable(context).project(args)
+
+
+def cmdAggregate(args, flags, context):
+    """
+    Summarise a field of the table (or items) piped in. fn is one of sum,
+    min, max, mean or count.
+
+    Syntax: -
+        ... | aggregate fn field
+    """
+    if len(args) != 2 or not all(type(arg) is str for arg in args):
+        raise ArgumentError("Expected a function and a field name.")
+
+    return inputTable(context).aggregate(*args)
+
+
+def parseWalkArgs(args):
+    """
+    Split the arguments of find and du into the path (a string), the depth
+    limit (an integer) and the remaining strings, which are names to prune.
+    """
+    paths = [arg for arg in args if type(arg) is str]
+    depths = [arg for arg in args if type(arg) is int]
+
+    if len(paths) + len(depths) != len(args) or len(depths) > 1:
+        raise ArgumentError("Expected a path, a depth and names to prune.")
+    if depths and depths[0] < 1:
+        raise ArgumentError("The depth needs to be a positive integer.")
+
+    root = paths[0] if paths else "."
+    maxDepth = depths[0] if depths else None
+    prune = None
+    if len(paths) > 1:
+        match = re.compile("|".join(fnmatch.translate(name) for name in paths[1:])).match
+
+        def prune(entry):
+            return match(entry.name) is not None
+
+    return root, maxDepth, prune
+
+
+def cmdFind(args, flags, context):
+    """
+    Produce a FileInfo for every file and directory below a directory (the
+    current directory by default). Directories are read in parallel.
+
+    Syntax: -
+        find [-L] [path] [depth] [prune ...]
+
+        depth   Do not go deeper than this many levels below path
+        prune   Names (wildcards allowed) of directories not to descend into
+        -L      Follow symbolic links to directories
+    """
+    root, maxDepth, prune = parseWalkArgs(args)
+    followLinks = any(flag.name == "L" for flag in flags)
+
+    return walk(root, maxDepth, prune, followLinks)
+
+
+def cmdDu(args, flags, context):
+    """
+    Show the disk space used by the files below a directory (the current
+    directory by default). Files with several hard links are counted once.
+    Directories are read and the files stat'ed in parallel.
+
+    Syntax: -
+        du [-b] [path] [depth] [prune ...]
+
+        -b      Count the apparent size in bytes instead of the disk usage
+    """
+    root, maxDepth, prune = parseWalkArgs(args)
+    apparent = any(flag.name == "b" for flag in flags)
+    inodes = set()
+    inodesLock = threading.Lock()
+
+    def usage(entry):
+        if entry.is_dir(follow_symlinks=False):
+            return 0
+        st = entry.stat(follow_symlinks=False)
+        if st.st_nlink > 1:
+            with inodesLock:
+                if (st.st_dev, st.st_ino) in inodes:
+                    return 0
+                inodes.add((st.st_dev, st.st_ino))
+        return st.st_size if apparent else st.st_blocks * 512
+
+    return {root: sum(walk(root, maxDepth, prune, visit=usage))}
+
+
+def cmdParallel(args, flags, context):
+    """
+    Run a command (or pipeline) for every item piped in, several items at a
+    time. Every {} in the template is replaced by the item, a template
+    without {} gets the item as its last argument. Produces a result with
+    the output (or the error) of every item.
+
+    Syntax: -
+        ... | parallel [-p] [-u] [jobs] template
+
+        jobs  How many items to run at a time
+        -p    Run the items in worker processes instead of threads (for
+              internal commands which keep the CPU busy)
+        -u    Pass on the results as soon as they are ready instead of in
+              the order of the items
+    """
+    from interpreter import rdparser
+    from interpreter.optimizer import optimize
+
+    templates = [arg for arg in args if type(arg) is str]
+    jobs = [arg for arg in args if type(arg) is int]
+
+    if len(templates) != 1 or len(templates) + len(jobs) != len(args) or len(jobs) > 1:
+        raise ArgumentError("Expected a number of jobs and a template.")
+    if jobs and jobs[0] < 1:
+        raise ArgumentError("The number of jobs needs to be a positive integer.")
+
+    expressions = optimize(rdparser.parse(templates[0])).expressions
+    if len(expressions) != 1 or not isinstance(expressions[0], (Command, Pipeline)):
+        raise ArgumentError("The template needs to be a single command or pipeline.")
+
+    # The template does not get the items piped into parallel
+    items = asStream(context.get("input"))
+    context = {key: value for key, value in context.items() if key != "input"}
+
+    return parallel(expressions[0], items, context, jobs[0] if jobs else None,
+                    ordered=not any(flag.name == "u" for flag in flags),
+                    processes=any(flag.name == "p" for flag in flags))
 
 
 def cmdEnv(args, flags, context):
@@ -215,11 +465,152 @@ def cmdEnv(args, flags, context):
 
 def cmdHelp(args, flags, context):
     """
-    Show commands
+    Show commands. Commands which have not been used yet are listed from
+    their manifest, without importing them.
     """
     print("Commands")
     print("========")
     for varName in sorted(context["vars"].keys()):
         value = context["vars"][varName]
         if callable(value):
-            print("{}{}={}".format("(exported) " if varName in context["exported_vars"] else "", varName, value))
+            print("{}{:<10} {}".format("(exported) " if varName in context["exported_vars"] else "", varName,
+                                       summaryOf(value)).rstrip())
+
+
+def cmdHash(args, flags, context):
+    """
+    Show or reset the locations remembered for external commands.
+
+    Syntax:-
+        hash [-r] [name ...]
+
+        -r    Forget all remembered locations
+        name  Look name up in PATH and remember where it was found
+    """
+    if any(flag.name == "r" for flag in flags):
+        gPathHash.clear()
+
+    env = childEnv(context)
+    for name in args:
+        if findExternal(str(name), env) is None:
+            raise ArgumentError("{} not found".format(name))
+
+    return gPathHash.entries() or None
+
+
+def jobArgs(args):
+    for jobId in args:
+        if type(jobId) is not int:
+            raise ArgumentError("Job numbers must be integers.")
+    return [gJobs.get(jobId) for jobId in args]
+
+
+def cmdJobs(args, flags, context):
+    """
+    List background jobs (started with statement &)
+    """
+    return [job.status() for job in gJobs.list()] or None
+
+
+def cmdFg(args, flags, context):
+    """
+    Wait for a background job and return its output.
+
+    Syntax:-
+        fg [job]
+
+        job   Job number, the most recent job by default
+    """
+    job = jobArgs(args)[0] if args else gJobs.get()
+    return gJobs.collect(job)
+
+
+def cmdWait(args, flags, context):
+    """
+    Wait for background jobs and return their output, in job order.
+
+    Syntax:-
+        wait [job ...]
+
+        job   Job number, all jobs by default
+    """
+    jobs = jobArgs(args) if args else gJobs.list()
+    output = []
+    for job in jobs:
+        result = gJobs.collect(job)
+        if isinstance(result, list):
+            output.extend(result)
+        elif result is not None:
+            output.append(result)
+    return output or None
+
+
+def cmdCache(args, flags, context):
+    """
+    Show or reset interpreter caches.
+
+    Syntax:-
+        cache [stats|clear]
+    """
+    action = args[0] if args else "stats"
+
+    if action == "stats":
+        stats = {}
+        for cacheName, cache in context["caches"].items():
+            for statName, value in cache.stats().items():
+                stats["{}.{}".format(cacheName, statName)] = value
+        return stats
+    elif action == "clear":
+        for cache in context["caches"].values():
+            cache.clear()
+    else:
+        raise ArgumentError("Unknown cache action {}".format(action))
+
+
+def cmdProfile(args, flags, context):
+    """
+    Run UniShell source and profile its statements and commands. Returns
+    how long each took, how often it ran and how much memory it allocated,
+    the results of the statements themselves are discarded.
+
+    Syntax:-
+        profile [-f] [--json | --collapsed] source [file]
+
+        -f           source is the path of a script to run
+        --json       Produce the profile as JSON
+        --collapsed  Produce collapsed stacks (for flame graphs)
+        file         Write the profile to file instead of returning it
+    """
+    from interpreter import rdparser
+    from interpreter.compiler import compileProgram
+    from interpreter.optimizer import optimize
+    from lib.logger import isTracing
+    from lib.profiler import Profiler
+
+    if not 1 <= len(args) <= 2 or not all(type(arg) is str for arg in args):
+        raise ArgumentError("Expected the source to profile and optionally a file.")
+
+    flagNames = {flag.name for flag in flags}
+    fmt = "json" if "json" in flagNames else "collapsed" if "collapsed" in flagNames else "report"
+
+    if "f" in flagNames:
+        name = args[0]
+        with open(name, "r") as f:
+            source = f.read()
+    else:
+        name = "profile"
+        source = args[0]
+
+    program = optimize(rdparser.parse(source))
+    profiler = Profiler()
+    profiler.addSource(program, source, name)
+    profiler.start()
+    try:
+        compileProgram(program, isTracing("eval"), profiler)(context)
+    finally:
+        profiler.stop()
+
+    if len(args) == 1:
+        return profiler.format(fmt).rstrip("\n")
+    with open(args[1], "w") as f:
+        f.write(profiler.format(fmt))
@@ -1,5 +1,8 @@
 from .program import Program
 from .flag import Flag
+from .glob import Glob
 from .command import Command
 from .varlookup import VarLookup
-from .string import String
\ No newline at end of file
+from .string import String
+from .pipeline import Pipeline
+from .background import Background
\ No newline at end of file
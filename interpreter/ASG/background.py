@@ -0,0 +1,34 @@
+from . import Command, Pipeline
+from pipeline.jobs import gJobs
+
+
+class Background:
+    """
+    A statement run as a background job (statement &). Evaluates to the Job.
+    """
+
+    def __init__(self, expr, source):
+        self.expr = expr
+        # The statement as written, shown by jobs
+        self.source = source
+
+    def isExternal(self):
+        """
+        True if the statement ends in an external command, so its result is
+        a Process which the job table can wait on without a thread.
+        """
+        expr = self.expr
+        if isinstance(expr, Pipeline):
+            expr = expr.commands[-1]
+        return isinstance(expr, Command) and expr.external
+
+    def __call__(self, context):
+        expr = self.expr
+        if not callable(expr):
+            fn = lambda context: expr  # A literal
+        else:
+            fn = expr
+        return gJobs.submit(fn, context, self.source, self.isExternal())
+
+    def __repr__(self):
+        return "Background({!r}, source={!r})".format(self.expr, self.source)
@@ -1,39 +1,90 @@
 import sys
 import traceback
-from . import Flag
+from . import Flag, Glob
 from lib import partition
-from lib.logger import dbg
+from pipeline import isStream, materialize, guardStream
+from pipeline.process import Process, childEnv, findExternal, toArgv
+from lib.logger import trace, isTracing
 
 
 class Command:
-    def __init__(self, cmdName, allArgs):
+    def __init__(self, cmdName, allArgs, external=False):
         if not cmdName or type(cmdName) is not str:
             raise Exception("Bad command name:{}".format(repr(cmdName)))
 
         self.cmdName = cmdName
+        # An external command (!cmd) runs a program found in PATH
+        self.external = external
 
-        if allArgs:
+        if external:
+            # Flags are passed on to the program where they were written
+            self.args = list(allArgs)
+            self.flags = []
+        elif allArgs:
             self.args, self.flags = partition(lambda x: isinstance(x, Flag), allArgs)
         else:
             self.args = self.flags = []
 
-        dbg("args:{} flags:{}".format(self.args, self.flags))
+        trace("parse", "args:{} flags:{}", self.args, self.flags)
+
+    def __call__(self, context, input=None):
+        """
+        Run the command. input is the stream piped in from the previous
+        stage of a pipeline, the command finds it in context["input"].
+        """
+        if self.external:
+            return self.runExternal(context, input)
 
-    def __call__(self, context):
         result = ""
 
         try:
             cmd = context["vars"][self.cmdName]
             try:
-                self.args = list(map(lambda x: x(context) if callable(x) else x, self.args))
-                result = cmd(self.args, self.flags, context)
+                # Evaluate into a local list; the node itself must stay
+                # unchanged so that cached programs can be run again.
+                args = self.evalArgs(context)
+                if input is not None:
+                    context = dict(context, input=input)
+                result = cmd(args, self.flags, context)
+                if isStream(result):
+                    result = guardStream(result)
             except Exception as e:
                 print("ERROR: ({}) {}".format(type(e).__name__, e), file=sys.stderr)
-                dbg(traceback.format_exc(), file=sys.stderr)
+                if isTracing("eval"):
+                    trace("eval", traceback.format_exc(), file=sys.stderr)
         except KeyError:
             print("ERROR: Unknown command: {}".format(self.cmdName), file=sys.stderr)
-        dbg("{} result:{}".format(repr(self), result))
+        trace("eval", "{!r} result:{}", self, result)
+        return result
+
+    def evalArgs(self, context):
+        args = []
+        for x in self.args:
+            if isinstance(x, Glob):
+                args.extend(x(context))
+            elif callable(x):
+                args.append(materialize(x(context)))
+            else:
+                args.append(x)
+        return args
+
+    def runExternal(self, context, input):
+        env = childEnv(context)
+        executable = findExternal(self.cmdName, env)
+        if executable is None:
+            print("ERROR: Unknown command: !{}".format(self.cmdName), file=sys.stderr)
+            return ""
+
+        try:
+            argv = [self.cmdName] + toArgv(self.evalArgs(context))
+        except Exception as e:
+            print("ERROR: ({}) {}".format(type(e).__name__, e), file=sys.stderr)
+            return ""
+
+        result = Process(argv, input, env, executable)
+        trace("eval", "{!r} result:{}", self, result)
         return result
 
     def __repr__(self):
-        return "Command({}, args={}, flags={})".format(self.cmdName, self.args, self.flags)
\ No newline at end of file
+        cmdName = "!" + self.cmdName if self.external else self.cmdName
+        return "Command({}, args={}, flags={})".format(cmdName, self.args, self.flags)
@@ -2,9 +2,16 @@ __author__ = 'sandeepd'
 
 
 class Flag:
-    def __init__(self, name, value=1):
+    def __init__(self, name, value=1, dashes="-"):
         self.name = name
         self.value = value
+        # "-" or "--" as written, needed to pass the flag on to external commands
+        self.dashes = dashes
+
+    def __str__(self):
+        return self.dashes + self.name
 
     def __repr__(self):
+        if self.dashes != "-":
+            return "Flag(name={}, value={}, dashes={})".format(self.name, self.value, self.dashes)
         return "Flag(name={}, value={})".format(self.name, self.value)
\ No newline at end of file
@@ -0,0 +1,20 @@
+from lib.logger import trace
+from lib.wildcards import expandWildcards
+
+
+class Glob:
+    """
+    An unquoted word with wildcards. Evaluates to the list of words it
+    expands to, a command gets each of them as a separate argument.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def __call__(self, context):
+        result = expandWildcards(self.pattern)
+        trace("eval", "{!r} returning:{!r}", self, result)
+        return result
+
+    def __repr__(self):
+        return "Glob({})".format(repr(self.pattern))
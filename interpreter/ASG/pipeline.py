@@ -0,0 +1,23 @@
+from lib.logger import trace
+from pipeline import asStream
+
+
+class Pipeline:
+    """
+    Commands connected with "|". Each command gets the output of the one
+    before it as a stream in context["input"], the result of the last command
+    is the result of the pipeline.
+    """
+
+    def __init__(self, commands):
+        self.commands = commands
+
+    def __call__(self, context):
+        result = self.commands[0](context)
+        for command in self.commands[1:]:
+            result = command(context, asStream(result))
+        trace("eval", "{!r} result:{}", self, result)
+        return result
+
+    def __repr__(self):
+        return "Pipeline({})".format(repr(self.commands))
@@ -1,4 +1,5 @@
-from lib.logger import dbg
+from lib.logger import trace
+from pipeline import materialize
 
 __author__ = 'sandeepd'
 
@@ -7,15 +8,23 @@ class Program:
     def __init__(self, expressions):
         self.expressions = expressions
 
-    def __call__(self, context):
+    def __call__(self, context, emit=None):
+        """
+        Run the statements and return their results. If emit is given every
+        result is passed to it as soon as its statement has run instead,
+        streams and all, and emit has to drain it.
+        """
         result = []
         for expr in self.expressions:
-            if callable(expr):
-                result.append(expr(context))
+            value = expr(context) if callable(expr) else expr  # Or a literal
+            if emit is not None:
+                emit(value)
             else:
-                result.append(expr)  # A literal
-        dbg("Program result:", result)
-        return result
+                # Streams are drained here so every statement has run
+                # before the next one starts.
+                result.append(materialize(value))
+        trace("eval", "Program result: {}", result)
+        return None if emit is not None else result
 
     def __repr__(self):
         return repr("Program({})".format(repr(self.expressions)))
\ No newline at end of file
@@ -1,21 +1,32 @@
-from lib.logger import dbg
+from lib.logger import trace
+from pipeline import interpolate
 
 
 class String:
     def __init__(self, parts):
-        dbg("String init:", parts)
+        trace("parse", "String init: {}", parts)
         self.parts = parts
 
-    def __call__(self, context):
-        result = ""
-
-        for part in self.parts:
+        # Precompute a format template with a {} field for every part which
+        # has to be evaluated, so evaluation builds the result in one go.
+        template = []
+        fields = []
+        for part in parts:
             if callable(part):
-                result += str(part(context))
+                template.append("{}")
+                fields.append(part)
             else:
-                result += str(part)
+                template.append(str(part).replace("{", "{{").replace("}", "}}"))
+        self.template = "".join(template)
+        self.fields = tuple(fields)
+
+    def isConstant(self):
+        return not self.fields
+
+    def __call__(self, context):
+        result = self.template.format(*[interpolate(field(context)) for field in self.fields])
 
-        dbg("String({}) returning:{}".format(repr(self.parts), repr(result)))
+        trace("eval", "String({!r}) returning:{!r}", self.parts, result)
 
         return result
 
@@ -1,4 +1,4 @@
-from lib.logger import dbg
+from lib.logger import trace
 
 class VarLookup:
     def __init__(self, varName):
@@ -8,7 +8,7 @@ class VarLookup:
 
     def __call__(self, context):
         result = context["vars"][self.varName]
-        dbg("VarLookup({}) returning:{}".format(repr(self.varName), repr(result)))
+        trace("eval", "VarLookup({!r}) returning:{!r}", self.varName, result)
         return result
 
     def __repr__(self):
@@ -1,10 +1,31 @@
 import codecs
-
+import hashlib
+import os
+import pickle
+import sys
+import time
+import weakref
+from os import path
+
+import arpeggio
 from arpeggio import PTNodeVisitor, visit_parse_tree
 from arpeggio.cleanpeg import ParserPEG
 
-from .ASG import Flag, Program, Command, VarLookup, String
-from lib.logger import dbg, getDebugLevel
+from .ASG import Flag, Program, Command, VarLookup, String, Pipeline, Background
+from .cache import ProgramCache
+from .environment import Environment
+from .compiler import compileProgram, compileExpr, drainedStatement
+from .optimizer import optimize
+from . import rdparser
+from lib import getCacheDir
+from lib.exceptions import ArgumentError
+from lib.logger import trace, isTracing
+
+version = "0.0.1"
+
+# Bump whenever the ASG classes change shape so that pickled programs from
+# older versions are not used.
+gAsgVersion = 6
 
 gGrammar = """
     WS               = r'[ \t]+'
@@ -15,20 +36,26 @@ gGrammar = """
     identifier       = r'[a-zA-Z_](\w|_)*'
     escape           = r'\\\\.'
     quoted_str       = '"' (escape / eval_expr_cmd / eval_var / r'[^"]')* '"'
-    bare_str         = r'[a-zA-Z_.:*?/@~{}](\w|[.:*?/@~{}])*'
+    bare_str         = r'[a-zA-Z_.:*?/@~{}](\w|[.:*?/@~{},])*'
     string           = quoted_str / bare_str
     literal          = string / number
-    expr_cmd         = cmd / expr
+    pipe             = WS? "|" WS?
+    command          = ext_cmd / cmd
+    pipeline         = command (pipe command)*
+    expr_cmd         = pipeline / expr
     expr             = eval_var / eval_expr_cmd / literal
     flag             = ("-" identifier / "--" identifier)
     comment          = "#" r'.*'
     cmd              = identifier (WS (flag / expr))*
+    ext_name         = r'[\w.+/-]+'
+    ext_cmd          = "!" ext_name (WS (flag / expr))*
     eval_bare_var    = "$" identifier
     eval_quoted_var  = "${" identifier "}"
     eval_var         = eval_bare_var / eval_quoted_var
     eval_expr_cmd    = "$(" WS? expr_cmd WS? ")"
     eval             = eval_var / eval_expr_cmd
-    statement        = WS? expr_cmd? WS? comment? WS?
+    background       = expr_cmd WS? "&"
+    statement        = WS? (background / expr_cmd)? WS? comment? WS?
     program          = (statement EOL)* statement? EOF
 """
 
@@ -44,172 +71,291 @@ class UniShellVisitor(PTNodeVisitor):
     def visit_EOL(self, node, children):
         return None
 
+    def visit_pipe(self, node, children):
+        return None
+
     def visit_escape(self, node, children):
-        dbg("ESCAPE NODE VALUE:", repr(node.value))
-        dbg("ESCAPE CHILDREN:", repr(children))
-        result = codecs.decode(node.value, 'unicode_escape')
-        dbg("ESCAPE RETURNING:{}".format(repr(result)))
-        return result
+        return codecs.decode(node.value, 'unicode_escape')
 
     def visit_statement(self, node, children):
-        dbg("STATEMENT NODE VALUE:", repr(node.value))
-        dbg("STATEMENT CHILDREN:", repr(children))
-        result = children[0] if children else None
-        dbg("STATEMENT RETURNING:{}".format(repr(result)))
-        return result
+        return children[0] if children else None
 
     def visit_integer(self, node, children):
-        dbg("INTEGER NODE VALUE:", repr(node.value))
-        dbg("INTEGER CHILDREN:", repr(children))
-
-        result = int(node.value)
-        dbg("INTEGER RETURNING:{}".format(repr(result)))
-        return result
+        return int(node.value)
 
     def visit_float(self, node, children):
-        dbg("FLOAT NODE VALUE:", repr(node.value))
-        dbg("FLOAT CHILDREN:", repr(children))
-
-        result = float(node.value)
-        dbg("FLOAT RETURNING:{}".format(repr(result)))
-        return result
+        return float(node.value)
 
     def visit_number(self, node, children):
-        dbg("NUMBER NODE VALUE:", repr(node.value))
-        dbg("NUMBER CHILDREN:", repr(children))
-        result = children[0]
-        dbg("NUMBER RETURNING:{}".format(repr(result)))
-        return result
+        return children[0]
 
     def visit_comment(self, node, children):
         return None
 
     def visit_flag(self, node, children):
-        dbg("FLAG NODE VALUE:", repr(node.value))
-        dbg("FLAG CHILDREN:", repr(children))
-        result = Flag(children[0])
-        dbg("FLAG RETURNING:{}".format(repr(result)))
-        return result
+        return Flag(children[0], dashes=node[0].value)
 
     def eval_bare_var(self, node, children):
-        dbg("EVAL_BARE_VAR NODE VALUE:", repr(node.value))
-        dbg("EVAL_BARE_VAR CHILDREN:", repr(children))
-        result = children[0]
-        dbg("EVAL_BARE_VAR RETURNING:{}".format(repr(result)))
-        return result
+        return children[0]
 
     def visit_eval_quoted_var(self, node, children):
-        dbg("EVAL_QUOTED_VAR NODE VALUE:", repr(node.value))
-        dbg("EVAL_QUOTED_VAR CHILDREN:", repr(children))
-        result = children[0]
-        dbg("EVAL_QUOTED_VAR RETURNING:{}".format(repr(result)))
-        return result
+        return children[0]
 
     def visit_eval_var(self, node, children):
-        dbg("EVAL_VAR NODE VALUE:", repr(node.value))
-        dbg("EVAL_VAR CHILDREN:", repr(children))
-        result = VarLookup(children[0])
-        dbg("EVAL_VAR RETURNING:{}".format(repr(result)))
-        return result
+        return VarLookup(children[0])
 
     def visit_eval(self, node, children):
-        dbg("EVAL NODE VALUE:", repr(node.value))
-        dbg("EVAL CHILDREN:", repr(children))
-        result = children[0]
-        dbg("EVAL RETURNING:{}".format(repr(result)))
-        return result
+        return children[0]
 
     def visit_quoted_str(self, node, children):
-        dbg("QUOTED STRING NODE VALUE:", repr(node.value))
-        dbg("QUOTED STRING CHILDREN:", repr(children))
-        result = children
-        dbg("QUOTED STRING RETURNING:{}".format(repr(result)))
-        return result
+        return list(children)
 
     def visit_bare_str(self, node, children):
-        dbg("BARE STRING NODE VALUE:", repr(node.value))
-        dbg("BARE STRING CHILDREN:", repr(children))
-        result = node.value
-        dbg("BARE STRING RETURNING:{}".format(repr(result)))
-        return result
+        return node.value
 
     def visit_identifier(self, node, children):
-        dbg("IDENTIFIER NODE VALUE:", repr(node.value))
-        dbg("IDENTIFIER CHILDREN:", repr(children))
-        result = node.value
-        dbg("IDENTIFIER RETURNING:{}".format(repr(result)))
-        return result
+        return node.value
 
     def visit_string(self, node, children):
-        dbg("STRING NODE VALUE:", repr(node.value))
-        dbg("STRING CHILDREN:", repr(children))
-
-        result = String(children[0])
-
-        dbg("STRING RETURNING:{}".format(result))
-        return result
+        return String(children[0])
 
     def visit_expr(self, node, children):
-        dbg("EXPR NODE VALUE:", repr(node.value))
-        dbg("EXPR CHILDREN:", repr(children))
-        result = children[0]
-        dbg("EXPR RETURNING:{}".format(repr(result)))
-        return result
+        return children[0]
 
     def visit_program(self, node, children):
-        dbg("PROGRAM NODE VALUE:", repr(node.value))
-        dbg("PROGRAM CHILDREN:", repr(children))
         # A program is a list of commands or literals
-        result = Program(children)
-        dbg("PROGRAM RETURNING:{}".format(repr(result)))
-        return result
+        return Program(list(children))
 
     def visit_cmd_interp(self, node, children):
-        dbg("CMD_INTERP NODE VALUE:", repr(node.value))
-        dbg("CMD_INTERP CHILDREN:", repr(children))
-
         result = children[0]
         # result.echo = False
-
-        dbg("CMD_INTERP RETURNING:{}".format(repr(result)))
         return result
 
     def visit_cmd(self, node, children):
-        dbg("CMD NODE VALUE:", repr(node.value))
-        dbg("CMD CHILDREN:", repr(children))
-
         # TODO: return a (stdin, stderr) tuple instead? Throw a BadExit
         # exception on a bad exit code.
         # args = children[1] if len(children) > 1 else []
         cmdName = children[0]
         args = children[1:]
-        result = Command(cmdName, args)
+        return Command(cmdName, args)
+
+    def visit_ext_name(self, node, children):
+        return node.value
+
+    def visit_ext_cmd(self, node, children):
+        return Command(children[0], children[1:], external=True)
 
-        dbg("CMD RETURNING:{}".format(repr(result)))
+    def visit_background(self, node, children):
+        return Background(children[0], node[0].flat_str())
+
+    def visit_pipeline(self, node, children):
+        if len(children) == 1:
+            return children[0]
+        return Pipeline(list(children))
+
+
+def _traceVisit(name, visit):
+    label = name[len("visit_"):].upper()
+
+    def tracedVisit(self, node, children):
+        trace("parse", "{} NODE VALUE: {!r}", label, node.value)
+        trace("parse", "{} CHILDREN: {!r}", label, children)
+        result = visit(self, node, children)
+        trace("parse", "{} RETURNING: {!r}", label, result)
         return result
 
+    tracedVisit.__name__ = name
+    return tracedVisit
+
+
+class TracingUniShellVisitor(UniShellVisitor):
+    """
+    UniShellVisitor which traces every node it visits. Interpreter only uses
+    it when parse tracing is enabled so the plain visitor has no tracing
+    code at all.
+    """
+    pass
+
+
+for _name, _visit in list(vars(UniShellVisitor).items()):
+    if _name.startswith("visit_"):
+        setattr(TracingUniShellVisitor, _name, _traceVisit(_name, _visit))
+
+
+def loadParser(grammar, rootRule, debug=False):
+    """
+    Return a ParserPEG for grammar starting at rootRule.
+
+    Building the parser model from the grammar text is slow compared to
+    loading it, so compiled parsers are pickled in the user cache directory
+    keyed by the grammar, the root rule and the Arpeggio version.
+    """
+    if debug:
+        # Debug parsers write out the parser model while being built
+        return ParserPEG(grammar, rootRule, skipws=False, debug=debug)
+
+    key = hashlib.sha1("{}\0{}\0{}".format(getattr(arpeggio, "__version__", ""), rootRule, grammar)
+                       .encode("utf-8")).hexdigest()
+
+    try:
+        parserPath = path.join(getCacheDir(), "grammar-{}.pickle".format(key))
+    except OSError as e:
+        trace("cache", "No cache directory: {}", e)
+        return ParserPEG(grammar, rootRule, skipws=False)
+
+    try:
+        with open(parserPath, "rb") as f:
+            parser = pickle.load(f)
+            parser.file = sys.stdout
+            return parser
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        trace("cache", "Ignoring unreadable parser cache {}: {}", parserPath, e)
+
+    parser = ParserPEG(grammar, rootRule, skipws=False)
+
+    # The debug output stream cannot be pickled
+    parser.file = None
+    tmpPath = "{}.{}.tmp".format(parserPath, os.getpid())
+    try:
+        with open(tmpPath, "wb") as f:
+            pickle.dump(parser, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, parserPath)
+    except (OSError, pickle.PicklingError) as e:
+        trace("cache", "Could not write parser cache {}: {}", parserPath, e)
+    finally:
+        parser.file = sys.stdout
+
+    return parser
+
+
+gBackends = ("peg", "rd")
+
 
 class Interpreter:
-    def __init__(self, grammar=gGrammar):
-        self.debug = getDebugLevel() > 0
-        self.programParser = ParserPEG(grammar, "program", skipws=False, debug=self.debug)
-        self.evalParser = ParserPEG(grammar, "eval", skipws=False, debug=self.debug)
-        self.visitor = UniShellVisitor(debug=self.debug)
-
-    def parse(self, source):
-        dbg("parse({}) called".format(repr(source)))
-        parse_tree = self.programParser.parse(source)
-        program = visit_parse_tree(parse_tree, self.visitor)
-        return program
+    """
+    Parses and runs UniShell source.
+
+    Two parser backends are available. "peg" (the default) runs the Arpeggio
+    parser generated from the grammar, "rd" uses the hand written parser in
+    rdparser which is much faster but only understands gGrammar.
+    """
+
+    def __init__(self, grammar=gGrammar, cacheSize=128, diskCache=True, backend="peg", compiled=True):
+        if backend not in gBackends:
+            raise ArgumentError("Unknown parser backend {}".format(repr(backend)))
+        if backend == "rd" and grammar is not gGrammar:
+            raise ArgumentError("The rd backend does not support custom grammars")
+
+        self.debug = isTracing("parse")
+        self.backend = backend
+        self.grammar = grammar
+        visitorClass = TracingUniShellVisitor if self.debug else UniShellVisitor
+        self.visitor = visitorClass(debug=self.debug)
+
+        # PEG parsers are loaded on first use, a script whose parse is
+        # cached never needs one.
+        self._programParser = None
+        self._evalParser = None
+        self.parserLoadTime = 0.0
+
+        # Programs are compiled to closures before running unless compiled is
+        # False, in which case the ASG is walked directly.
+        self.compiled = compiled
+        self.compiledPrograms = weakref.WeakKeyDictionary()
+
+        # Cached programs are only valid for the interpreter version and
+        # grammar that produced them.
+        grammarHash = hashlib.sha1(grammar.encode("utf-8")).hexdigest()[:12]
+        cacheTag = "ush-{}-{}-{}".format(version, gAsgVersion, grammarHash)
+        self.cache = ProgramCache(cacheTag, maxSize=cacheSize, useDisk=diskCache)
+
+    def _loadParser(self, rootRule):
+        start = time.perf_counter()
+        parser = loadParser(self.grammar, rootRule, self.debug)
+        self.parserLoadTime += time.perf_counter() - start
+        return parser
+
+    @property
+    def programParser(self):
+        if self._programParser is None:
+            self._programParser = self._loadParser("program")
+        return self._programParser
+
+    @property
+    def evalParser(self):
+        if self._evalParser is None:
+            self._evalParser = self._loadParser("eval")
+        return self._evalParser
+
+    def parse(self, source, scriptPath=None):
+        """
+        Parse source into a Program, reusing a cached Program if the same
+        source has been parsed before. If scriptPath is given the program is
+        also looked up in (and saved to) the on-disk cache for that script.
+        """
+        return self.cache.get(source, self.parseUncached, scriptPath)
+
+    def parseUncached(self, source):
+        trace("parse", "parse({!r}) called", source)
+        if self.backend == "rd":
+            program = rdparser.parse(source)
+        else:
+            parse_tree = self.programParser.parse(source)
+            program = visit_parse_tree(parse_tree, self.visitor)
+        return optimize(program)
 
     def parseEvalExpr(self, source):
-        dbg("parseEvalExpr({}) called".format(repr(source)))
-        parse_tree = self.evalParser.parse(source)
-        program = visit_parse_tree(parse_tree, self.visitor)
-        return program
+        trace("parse", "parseEvalExpr({!r}) called", source)
+        if self.backend == "rd":
+            program = rdparser.parseEval(source)
+        else:
+            parse_tree = self.evalParser.parse(source)
+            program = visit_parse_tree(parse_tree, self.visitor)
+        return optimize(program)
+
+    def iterStatements(self, lines):
+        """
+        Parse lines (e.g. an open file) one statement at a time, yielding each
+        statement's ASG as soon as it has been read. This always uses the rd
+        parser and does not use the program cache.
+        """
+        for expr in rdparser.iterStatements(lines):
+            yield optimize(expr)
+
+    def compileStatement(self, expr, profiler=None, label=None):
+        """
+        Return a function which evaluates a single statement from
+        iterStatements. If profiler is given the statement is profiled as
+        label and so are its commands.
+        """
+        if profiler is not None:
+            fn = compileExpr(expr, isTracing("eval"), profiler)
+            return profiler.statement(drainedStatement(fn), label)
+        if not self.compiled:
+            return lambda context: expr(context) if callable(expr) else expr
+        return compileExpr(expr, isTracing("eval"))
+
+    def compile(self, program, profiler=None):
+        """
+        Return a function which runs program. Compiled functions are kept for
+        as long as the program itself is alive (e.g. in the program cache).
+        Programs compiled with a profiler (see lib.profiler) are always
+        compiled and never kept.
+        """
+        if profiler is not None:
+            return compileProgram(program, isTracing("eval"), profiler)
+        if not self.compiled:
+            return program
+
+        fn = self.compiledPrograms.get(program)
+        if fn is None:
+            fn = self.compiledPrograms[program] = compileProgram(program, isTracing("eval"))
+        return fn
 
     def evaluate(self, source, context):
-        dbg("----------PARSING---------")
+        trace("parse", "----------PARSING---------")
         program = self.parse(source)
-        dbg("----------RUNNING---------")
-        return program(context)
+        trace("eval", "----------RUNNING---------")
+        return self.compile(program)(context)
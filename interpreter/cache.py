@@ -0,0 +1,119 @@
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+from os import path
+
+from lib.logger import trace
+
+gCacheDirName = "__ushcache__"
+
+
+def sourceHash(source):
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+
+class ProgramCache:
+    """
+    Cache of parsed Program objects.
+
+    Programs are kept in an in-memory LRU keyed by the hash of their source.
+    Scripts can additionally be cached on disk in a __ushcache__ folder next
+    to the script. Disk entries are tagged with the interpreter version and
+    the hash of the source they were parsed from so stale entries are never
+    used.
+    """
+
+    def __init__(self, tag, maxSize=128, useDisk=True):
+        self.tag = tag
+        self.maxSize = maxSize
+        self.useDisk = useDisk
+        self.programs = OrderedDict()
+        self.clear()
+
+    def clear(self):
+        self.programs.clear()
+        self.hits = 0
+        self.misses = 0
+        self.diskHits = 0
+        self.diskMisses = 0
+
+    def stats(self):
+        return {
+            "size": len(self.programs),
+            "max_size": self.maxSize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.diskHits,
+            "disk_misses": self.diskMisses,
+        }
+
+    def get(self, source, parse, scriptPath=None):
+        """
+        Return the Program for source, calling parse(source) only if the
+        program is neither in memory nor (for scripts) on disk.
+        """
+        key = sourceHash(source)
+
+        program = self.programs.get(key)
+        if program is not None:
+            self.hits += 1
+            self.programs.move_to_end(key)
+            return program
+
+        self.misses += 1
+
+        diskPath = self.diskPath(scriptPath) if scriptPath and self.useDisk else None
+
+        if diskPath:
+            program = self.load(diskPath, key)
+            if program is not None:
+                self.diskHits += 1
+            else:
+                self.diskMisses += 1
+
+        if program is None:
+            program = parse(source)
+            if diskPath:
+                self.store(diskPath, key, program)
+
+        self.programs[key] = program
+        if len(self.programs) > self.maxSize:
+            self.programs.popitem(last=False)
+
+        return program
+
+    def diskPath(self, scriptPath):
+        scriptDir, scriptName = path.split(path.abspath(scriptPath))
+        return path.join(scriptDir, gCacheDirName, "{}.{}.pickle".format(scriptName, self.tag))
+
+    def load(self, diskPath, key):
+        try:
+            with open(diskPath, "rb") as f:
+                tag, srcHash, program = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            trace("cache", "Ignoring unreadable cache file {}: {}", diskPath, e)
+            return None
+
+        if tag != self.tag or srcHash != key:
+            trace("cache", "Cache file {} is stale", diskPath)
+            return None
+
+        trace("cache", "Loaded program from {}", diskPath)
+        return program
+
+    def store(self, diskPath, key, program):
+        tmpPath = "{}.{}.tmp".format(diskPath, os.getpid())
+        try:
+            os.makedirs(path.dirname(diskPath), exist_ok=True)
+            with open(tmpPath, "wb") as f:
+                pickle.dump((self.tag, key, program), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpPath, diskPath)
+        except (OSError, pickle.PicklingError) as e:
+            trace("cache", "Could not write cache file {}: {}", diskPath, e)
+            try:
+                os.remove(tmpPath)
+            except OSError:
+                pass
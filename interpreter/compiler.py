@@ -0,0 +1,246 @@
+"""
+Compiles an ASG into nested Python closures.
+
+The ASG nodes are callables which walk the tree every time they are run.
+compileProgram() does that walk once and returns a single function which
+behaves exactly like calling the Program, with command names, argument
+evaluation and string templates all laid out ahead of time.
+"""
+import sys
+import traceback
+
+from .ASG import Program, Command, String, VarLookup, Pipeline, Glob, Background
+from .environment import InlineCache
+from pipeline import isStream, asStream, materialize, guardStream, interpolate
+from pipeline.jobs import gJobs
+from pipeline.process import Process, childEnv, findExternal, toArgv
+from lib.logger import trace
+
+
+def compileProgram(program, tracing=False, profiler=None):
+    """
+    Compile program into a function of the context. If tracing is True the
+    compiled code traces every evaluated node, otherwise it contains no
+    tracing code at all. Likewise the statements and commands are only
+    profiled if a profiler (see lib.profiler) is given.
+    """
+    exprs = [compileExpr(expr, tracing, profiler) for expr in program.expressions]
+
+    labels = profiler.statementLabels(program) if profiler is not None else None
+    if labels is not None:
+        exprs = [profiler.statement(drainedStatement(expr), label) for expr, label in zip(exprs, labels)]
+
+    def runProgram(context, emit=None):
+        # See Program.__call__ for emit
+        if emit is None:
+            return [materialize(expr(context)) for expr in exprs]
+        for expr in exprs:
+            emit(expr(context))
+
+    if tracing:
+        return traced(runProgram, program)
+    return runProgram
+
+
+def compileExpr(node, tracing=False, profiler=None):
+    if isinstance(node, Command):
+        fn = compileCommand(node, tracing, profiler)
+        if profiler is not None:
+            fn = profiler.command(fn, "!" + node.cmdName if node.external else node.cmdName)
+    elif isinstance(node, Pipeline):
+        fn = compilePipeline(node, tracing, profiler)
+    elif isinstance(node, Background):
+        fn = compileBackground(node, tracing, profiler)
+    elif isinstance(node, String):
+        fn = compileString(node, tracing, profiler)
+    elif isinstance(node, VarLookup):
+        fn = compileVarLookup(node)
+    elif isinstance(node, Program):
+        return compileProgram(node, tracing, profiler)
+    elif callable(node):
+        return node
+    else:
+        return compileConstant(node)
+
+    if tracing:
+        return traced(fn, node)
+    return fn
+
+
+def compileDrained(node, tracing, profiler=None):
+    """
+    Compile a node whose value is used as an argument or inside a string,
+    where a stream returned by a command is drained into a list.
+    """
+    fn = compileExpr(node, tracing, profiler)
+    if not isinstance(node, (Command, Pipeline)):
+        return fn
+
+    def drained(context):
+        return materialize(fn(context))
+
+    return drained
+
+
+def drainedStatement(fn):
+    # A profiled statement includes draining its stream
+    def statement(context):
+        return materialize(fn(context))
+
+    return statement
+
+
+def traced(fn, node):
+    def tracedFn(context, *args, **kwargs):
+        result = fn(context, *args, **kwargs)
+        trace("eval", "{!r} returning:{!r}", node, result)
+        return result
+
+    return tracedFn
+
+
+def compileConstant(value):
+    def constant(context):
+        return value
+
+    return constant
+
+
+def compileVarLookup(node):
+    # Variables are read with a plain dict lookup, checking an inline cache
+    # would cost more than the lookup itself.
+    varName = node.varName
+
+    def varLookup(context):
+        return context["vars"][varName]
+
+    return varLookup
+
+
+def compileString(node, tracing, profiler=None):
+    if node.isConstant():
+        return compileConstant(node.template.format())
+
+    template = node.template
+    fields = [compileDrained(field, tracing, profiler) for field in node.fields]
+
+    if template == "{}":
+        field = fields[0]
+
+        def singleField(context):
+            return interpolate(field(context))
+
+        return singleField
+
+    def string(context):
+        return template.format(*[interpolate(field(context)) for field in fields])
+
+    return string
+
+
+def compileArgs(node, tracing=False, profiler=None):
+    """
+    Compile the arguments of the Command node into a function of the
+    context returning their values as a list.
+    """
+    if any(isinstance(arg, Glob) for arg in node.args):
+        # Wildcards expand to any number of arguments
+        argFns = [(compileDrained(arg, tracing, profiler), isinstance(arg, Glob)) for arg in node.args]
+
+        def evalArgs(context):
+            args = []
+            for arg, isGlob in argFns:
+                if isGlob:
+                    args.extend(arg(context))
+                else:
+                    args.append(arg(context))
+            return args
+    elif any(callable(arg) for arg in node.args):
+        argFns = [compileDrained(arg, tracing, profiler) for arg in node.args]
+
+        def evalArgs(context):
+            return [arg(context) for arg in argFns]
+    else:
+        constArgs = tuple(node.args)
+
+        def evalArgs(context):
+            return list(constArgs)
+
+    return evalArgs
+
+
+def compileCommand(node, tracing, profiler=None):
+    cmdName = node.cmdName
+    flags = node.flags
+    # The cache belongs to the compiled code, the node itself is not changed
+    cmdCache = InlineCache(cmdName)
+    evalArgs = compileArgs(node, tracing, profiler)
+
+    if node.external:
+        return compileExternal(cmdName, evalArgs)
+
+    def command(context, input=None):
+        result = ""
+        try:
+            env = context["vars"]
+            if env is cmdCache.env and env.version == cmdCache.version:
+                cmd = cmdCache.value
+            else:
+                cmd = cmdCache.resolve(env)
+            try:
+                args = evalArgs(context)
+                if input is not None:
+                    context = dict(context, input=input)
+                result = cmd(args, flags, context)
+                if isStream(result):
+                    result = guardStream(result)
+            except Exception as e:
+                print("ERROR: ({}) {}".format(type(e).__name__, e), file=sys.stderr)
+                if tracing:
+                    trace("eval", traceback.format_exc(), file=sys.stderr)
+        except KeyError:
+            print("ERROR: Unknown command: {}".format(cmdName), file=sys.stderr)
+        return result
+
+    return command
+
+
+def compileExternal(cmdName, evalArgs):
+    def external(context, input=None):
+        env = childEnv(context)
+        executable = findExternal(cmdName, env)
+        if executable is None:
+            print("ERROR: Unknown command: !{}".format(cmdName), file=sys.stderr)
+            return ""
+        try:
+            argv = [cmdName] + toArgv(evalArgs(context))
+        except Exception as e:
+            print("ERROR: ({}) {}".format(type(e).__name__, e), file=sys.stderr)
+            return ""
+        return Process(argv, input, env, executable)
+
+    return external
+
+
+def compilePipeline(node, tracing, profiler=None):
+    first = compileExpr(node.commands[0], tracing, profiler)
+    rest = [compileExpr(command, tracing, profiler) for command in node.commands[1:]]
+
+    def pipeline(context):
+        result = first(context)
+        for command in rest:
+            result = command(context, asStream(result))
+        return result
+
+    return pipeline
+
+
+def compileBackground(node, tracing, profiler=None):
+    expr = compileExpr(node.expr, tracing, profiler)
+    source = node.source
+    external = node.isExternal()
+
+    def background(context):
+        return gJobs.submit(expr, context, source, external)
+
+    return background
@@ -0,0 +1,86 @@
+class Environment(dict):
+    """
+    The namespace holding variables and commands (context["vars"]).
+
+    It is a dict so that reading a variable stays a plain dict lookup, but
+    every change to a binding (set, command registration, deletion) goes
+    through the methods below and increments version. Inline caches in
+    compiled code use version to tell whether what they resolved earlier is
+    still current.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+
+    def register(self, name, value):
+        """
+        Bind a command (or any other value) to name.
+        """
+        self[name] = value
+
+    def __setitem__(self, name, value):
+        super().__setitem__(name, value)
+        self.version += 1
+
+    def __delitem__(self, name):
+        super().__delitem__(name)
+        self.version += 1
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.version += 1
+
+    def setdefault(self, name, default=None):
+        if name not in self:
+            self[name] = default
+        return self[name]
+
+    def pop(self, *args):
+        self.version += 1
+        return super().pop(*args)
+
+    def popitem(self):
+        self.version += 1
+        return super().popitem()
+
+    def clear(self):
+        super().clear()
+        self.version += 1
+
+    def copy(self):
+        return Environment(self)
+
+    def __reduce__(self):
+        # Pickle's default for dict subclasses sets the items on an instance
+        # made without calling __init__, i.e. before it has a version
+        return Environment, (dict(self),)
+
+    def __repr__(self):
+        return "Environment({})".format(super().__repr__())
+
+
+class InlineCache:
+    """
+    Remembers what a name resolved to in an Environment. The cached value is
+    used as long as it is the same environment and its version has not
+    changed.
+
+    Compiled code checks for a hit itself (env is cache.env and env.version
+    == cache.version) and only calls resolve() on a miss.
+    """
+    __slots__ = ("name", "env", "version", "value")
+
+    def __init__(self, name):
+        self.name = name
+        self.env = None
+        self.version = None
+        self.value = None
+
+    def resolve(self, env):
+        value = env[self.name]
+        if isinstance(env, Environment):
+            self.env = env
+            self.version = env.version
+            self.value = value
+        return value
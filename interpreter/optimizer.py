@@ -0,0 +1,38 @@
+"""
+Parse time optimisations of the ASG.
+
+optimize() returns an equivalent ASG in which every String made up only of
+literal parts (including escapes, which the parser has already decoded) is
+folded into a plain str constant. Unquoted words with wildcards become Glob
+nodes which are expanded when they are evaluated.
+"""
+from .ASG import Program, Command, String, Pipeline, Glob, Background
+from lib.wildcards import hasWildcards
+
+
+def optimize(node):
+    if isinstance(node, Program):
+        return Program([optimize(expr) for expr in node.expressions])
+
+    if isinstance(node, Command):
+        return Command(node.cmdName, [optimize(arg) for arg in node.args] + node.flags, node.external)
+
+    if isinstance(node, Background):
+        return Background(optimize(node.expr), node.source)
+
+    if isinstance(node, Pipeline):
+        return Pipeline([optimize(command) for command in node.commands])
+
+    if isinstance(node, String):
+        if isinstance(node.parts, str):
+            # An unquoted word
+            if hasWildcards(node.parts):
+                return Glob(node.parts)
+            return node.parts
+
+        string = String([optimize(part) for part in node.parts])
+        if string.isConstant():
+            return string.template.format()
+        return string
+
+    return node
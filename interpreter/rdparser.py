@@ -0,0 +1,456 @@
+"""
+Hand written tokenizer and recursive descent parser for UniShell.
+
+This is a fast alternative to the Arpeggio parser generated from gGrammar.
+It accepts the same language and builds exactly the same ASG as
+UniShellVisitor, so the two backends can be used interchangeably. Use
+lib/compare_parsers.py to check that they agree.
+
+Outside of quoted strings the source is split into tokens by a single
+master regex. Quoted strings are scanned character by character since
+command substitutions inside them fall back to literal text when they do
+not parse (just like the PEG grammar).
+"""
+import codecs
+import re
+
+from .ASG import Flag, Program, Command, VarLookup, String, Pipeline, Background
+from lib.exceptions import BadSyntax
+
+gTokenRegex = re.compile(r"""
+      (?P<WS>[ \t]+)
+    | (?P<EOL>[\n;])
+    | (?P<COMMENT>\#.*)
+    | (?P<QUOTE>")
+    | (?P<EVAL>\$\()
+    | (?P<VAR>\$(?:(?P<bareVar>[a-zA-Z_]\w*)|\{(?P<quotedVar>[a-zA-Z_]\w*)\}))
+    | (?P<RPAREN>\))
+    | (?P<PIPE>\|)
+    | (?P<AMP>&)
+    | (?P<EXTERNAL>!(?P<extName>[\w.+/-]+))
+    | (?P<FLAG>(?P<dashes>--?)(?P<flagName>[a-zA-Z_]\w*))
+    | (?P<FLOAT>[+-]?\d+\.\d+(?:[eE][+-]?\d+)?)
+    | (?P<INTEGER>[+-]?\d+)
+    | (?P<WORD>[a-zA-Z_.:*?/@~{}][\w.:*?/@~{},]*)
+""", re.VERBOSE)
+
+gIdentifierRegex = re.compile(r"[a-zA-Z_]\w*")
+gVarRegex = re.compile(r"\$(?:([a-zA-Z_]\w*)|\{([a-zA-Z_]\w*)\})")
+gStrCharsRegex = re.compile(r'[^"\\$]+')
+# What decides whether a line ends inside a quoted string, see iterStatements
+gQuoteStateRegex = re.compile(r'\\.|["#]')
+
+# Tokens which can start an expression (the expr rule in gGrammar)
+gExprStart = frozenset(("VAR", "EVAL", "QUOTE", "WORD", "FLOAT", "INTEGER"))
+# Tokens which can start an expr_cmd, external commands are not expressions
+gExprCmdStart = gExprStart | {"EXTERNAL"}
+
+
+class _Fail(Exception):
+    """
+    Raised internally when a rule does not match. Quoted strings catch it to
+    treat a bad substitution as literal text, everything else lets it
+    propagate and turns it into a BadSyntax.
+    """
+    pass
+
+
+class Lexer:
+    def __init__(self, source):
+        self.source = source
+        self.pos = 0
+        self.end = len(source)
+        self.farthest = 0
+        # Escape decoding errors are only reported once the whole source has
+        # parsed, the PEG backend decodes escapes after parsing too.
+        self.badEscapes = []
+
+    def peek(self):
+        """
+        Return the (kind, match) of the token at the current position without
+        consuming it. kind is None at the end of input or on a bad character.
+        """
+        m = gTokenRegex.match(self.source, self.pos)
+        if m is None:
+            return None, None
+        return m.lastgroup, m
+
+    def advance(self, m):
+        self.pos = m.end()
+
+    def skipWS(self):
+        source = self.source
+        pos = self.pos
+        while pos < self.end and source[pos] in " \t":
+            pos += 1
+        self.pos = pos
+
+    def fail(self, pos=None):
+        pos = self.pos if pos is None else pos
+        if pos > self.farthest:
+            self.farthest = pos
+        raise _Fail()
+
+
+class Parser:
+    def __init__(self, source):
+        self.lexer = Lexer(source)
+
+    def syntaxError(self, lineOffset=0, pos=None, problem="Unexpected input"):
+        lexer = self.lexer
+        if pos is None:
+            pos = max(lexer.farthest, lexer.pos)
+        source = lexer.source
+        line = lineOffset + source.count("\n", 0, pos) + 1
+        column = pos - (source.rfind("\n", 0, pos) + 1) + 1
+        context = source[max(0, pos - 10):pos] + "*" + source[pos:pos + 10]
+        return BadSyntax("{} at position ({}, {}) => '{}'.".format(problem, line, column, context),
+                         line, column)
+
+    def parseProgram(self, spans=None):
+        """
+        Parse the whole source into a Program. If spans is a list the (start,
+        end) offsets of every statement in the Program are appended to it.
+        """
+        lexer = self.lexer
+        expressions = []
+        try:
+            while True:
+                start = lexer.pos
+                expr = self.parseStatement()
+                if expr is not None:
+                    expressions.append(expr)
+                    if spans is not None:
+                        spans.append((start, lexer.pos))
+
+                kind, m = lexer.peek()
+                if kind == "EOL":
+                    lexer.advance(m)
+                elif lexer.pos == lexer.end:
+                    break
+                else:
+                    lexer.fail()
+        except _Fail:
+            raise self.syntaxError() from None
+
+        if lexer.badEscapes:
+            raise lexer.badEscapes[0]
+
+        return Program(expressions)
+
+    def parseEval(self):
+        """
+        Parse an eval rule (a variable or command substitution) at the start of
+        the source. Like the PEG parser any trailing input is ignored.
+        """
+        lexer = self.lexer
+        try:
+            kind, m = lexer.peek()
+            if kind == "VAR":
+                lexer.advance(m)
+                return VarLookup(m.group("bareVar") or m.group("quotedVar"))
+            if kind == "EVAL":
+                result = self.parseEvalExprCmd()
+            else:
+                lexer.fail()
+        except _Fail:
+            raise self.syntaxError() from None
+
+        if lexer.badEscapes:
+            raise lexer.badEscapes[0]
+
+        return result
+
+    def parseStatement(self):
+        lexer = self.lexer
+        result = None
+
+        lexer.skipWS()
+        kind, m = lexer.peek()
+        if kind in gExprCmdStart:
+            start = lexer.pos
+            result = self.parseExprCmd()
+            end = lexer.pos
+            lexer.skipWS()
+            kind, m = lexer.peek()
+            if kind == "AMP":
+                lexer.advance(m)
+                result = Background(result, lexer.source[start:end])
+                lexer.skipWS()
+                kind, m = lexer.peek()
+
+        if kind == "COMMENT":
+            lexer.advance(m)
+
+        return result
+
+    def parseExprCmd(self):
+        lexer = self.lexer
+        kind, m = lexer.peek()
+
+        if kind == "WORD" and gIdentifierRegex.fullmatch(m.group()) is None:
+            ident = gIdentifierRegex.match(m.group())
+            if ident is not None:
+                # The PEG grammar matches the identifier prefix as a command
+                # and then fails on the rest of the word.
+                lexer.fail(lexer.pos + ident.end())
+        elif kind == "WORD":
+            lexer.advance(m)
+            return self.parsePipeline(self.parseCmd(m.group()))
+        elif kind == "EXTERNAL":
+            lexer.advance(m)
+            return self.parsePipeline(self.parseCmd(m.group("extName"), external=True))
+
+        return self.parseExpr()
+
+    def parsePipeline(self, command):
+        lexer = self.lexer
+        commands = [command]
+
+        while True:
+            start = lexer.pos
+            lexer.skipWS()
+            kind, m = lexer.peek()
+            if kind != "PIPE":
+                lexer.pos = start
+                break
+            lexer.advance(m)
+            lexer.skipWS()
+
+            kind, m = lexer.peek()
+            if kind == "EXTERNAL":
+                lexer.advance(m)
+                commands.append(self.parseCmd(m.group("extName"), external=True))
+                continue
+            if kind != "WORD" or gIdentifierRegex.match(m.group()) is None:
+                lexer.fail()
+            ident = gIdentifierRegex.match(m.group())
+            if ident.end() != len(m.group()):
+                lexer.fail(lexer.pos + ident.end())
+            lexer.advance(m)
+            commands.append(self.parseCmd(m.group()))
+
+        if len(commands) == 1:
+            return command
+        return Pipeline(commands)
+
+    def parseCmd(self, cmdName, external=False):
+        lexer = self.lexer
+        args = []
+
+        while True:
+            start = lexer.pos
+            kind, m = lexer.peek()
+            if kind != "WS":
+                break
+            lexer.advance(m)
+
+            kind, m = lexer.peek()
+            if kind == "FLAG":
+                lexer.advance(m)
+                args.append(Flag(m.group("flagName"), dashes=m.group("dashes")))
+            elif kind in gExprStart:
+                args.append(self.parseExpr())
+            else:
+                lexer.pos = start
+                break
+
+        return Command(cmdName, args, external)
+
+    def parseExpr(self):
+        lexer = self.lexer
+        kind, m = lexer.peek()
+
+        if kind == "VAR":
+            lexer.advance(m)
+            return VarLookup(m.group("bareVar") or m.group("quotedVar"))
+        if kind == "EVAL":
+            return self.parseEvalExprCmd()
+        if kind == "QUOTE":
+            lexer.advance(m)
+            return String(self.parseQuotedStr())
+        if kind == "WORD":
+            lexer.advance(m)
+            return String(m.group())
+        if kind == "FLOAT":
+            lexer.advance(m)
+            return float(m.group())
+        if kind == "INTEGER":
+            lexer.advance(m)
+            return int(m.group())
+
+        lexer.fail()
+
+    def parseEvalExprCmd(self):
+        lexer = self.lexer
+        lexer.pos += 2  # $(
+        lexer.skipWS()
+
+        kind, m = lexer.peek()
+        if kind not in gExprCmdStart:
+            lexer.fail()
+        result = self.parseExprCmd()
+
+        lexer.skipWS()
+        kind, m = lexer.peek()
+        if kind != "RPAREN":
+            lexer.fail()
+        lexer.advance(m)
+
+        return result
+
+    def parseQuotedStr(self):
+        """
+        Parse the body of a quoted string, the opening quote has already been
+        consumed. Literal characters are kept as separate parts to match the
+        ASG produced by the PEG grammar.
+        """
+        lexer = self.lexer
+        source = lexer.source
+        end = lexer.end
+        parts = []
+
+        while True:
+            pos = lexer.pos
+            if pos >= end:
+                lexer.fail()
+
+            c = source[pos]
+
+            if c == '"':
+                lexer.pos = pos + 1
+                return parts
+
+            if c == "\\":
+                if pos + 1 < end and source[pos + 1] != "\n":
+                    escape = source[pos:pos + 2]
+                    try:
+                        escape = codecs.decode(escape, 'unicode_escape')
+                    except UnicodeDecodeError as e:
+                        lexer.badEscapes.append(e)
+                    parts.append(escape)
+                    lexer.pos = pos + 2
+                    continue
+            elif c == "$":
+                if source.startswith("$(", pos):
+                    badEscapes = len(lexer.badEscapes)
+                    try:
+                        parts.append(self.parseEvalExprCmd())
+                        continue
+                    except _Fail:
+                        del lexer.badEscapes[badEscapes:]
+                        lexer.pos = pos
+
+                m = gVarRegex.match(source, pos)
+                if m:
+                    parts.append(VarLookup(m.group(1) or m.group(2)))
+                    lexer.pos = m.end()
+                    continue
+            else:
+                m = gStrCharsRegex.match(source, pos)
+                parts.extend(m.group())
+                lexer.pos = m.end()
+                continue
+
+            parts.append(c)
+            lexer.pos = pos + 1
+
+
+def parse(source):
+    return Parser(source).parseProgram()
+
+
+def iterStatements(lines):
+    """
+    Parse statements one at a time from an iterable of lines (e.g. an open
+    file), yielding the ASG of every non-empty statement as soon as it has
+    been read. Only the text of the statement being parsed is kept in memory.
+
+    A statement which runs into the end of the text read so far (a quoted
+    string spanning lines) is parsed again once more lines have been read.
+    Only a quoted string can span lines, so lines are not parsed again
+    while the text read ends inside one; a statement spanning n lines costs
+    O(n) rather than a parse per line. Which quotes are open is tracked
+    roughly (substitutions are not looked into), the parser decides. A
+    statement still unfinished at the end is reported where it starts.
+    """
+    lines = iter(lines)
+    buffer = ""
+    lineOffset = 0
+    atEnd = False
+    inString = False
+
+    while not atEnd:
+        line = next(lines, None)
+        if line is None:
+            atEnd = True
+        else:
+            buffer += line
+            for m in gQuoteStateRegex.finditer(line):
+                c = m.group()
+                if c == '"':
+                    inString = not inString
+                elif c == "#" and not inString:
+                    break
+            if inString:
+                continue
+
+        parser = Parser(buffer)
+        lexer = parser.lexer
+
+        while True:
+            start = lexer.pos
+            lexer.farthest = start
+            try:
+                expr = parser.parseStatement()
+
+                kind, m = lexer.peek()
+                if kind == "EOL":
+                    lexer.advance(m)
+                elif lexer.pos != lexer.end:
+                    lexer.fail()
+                elif not atEnd:
+                    lexer.pos = start
+                    break
+            except _Fail:
+                if lexer.farthest >= lexer.end:
+                    if atEnd:
+                        lexer.pos = start
+                        lexer.skipWS()
+                        raise parser.syntaxError(lineOffset, lexer.pos, "Unterminated statement") from None
+                    # Ran out of text, try again with the next line
+                    lexer.pos = start
+                    del lexer.badEscapes[:]
+                    break
+                raise parser.syntaxError(lineOffset) from None
+
+            if lexer.badEscapes:
+                raise lexer.badEscapes[0]
+
+            if expr is not None:
+                yield expr
+
+            if lexer.pos == lexer.end:
+                break
+
+        lineOffset += buffer.count("\n", 0, lexer.pos)
+        buffer = buffer[lexer.pos:]
+
+
+def statementLines(source):
+    """
+    Return the (line, text) of every statement of source, in the order of
+    the expressions of its Program. Comments are part of the text.
+    """
+    spans = []
+    Parser(source).parseProgram(spans)
+    lines = []
+    for start, end in spans:
+        text = source[start:end]
+        start += len(text) - len(text.lstrip())
+        lines.append((source.count("\n", 0, start) + 1, " ".join(text.split())))
+    return lines
+
+
+def parseEval(source):
+    return Parser(source).parseEval()
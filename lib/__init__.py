@@ -1,2 +1,16 @@
 def partition(predicate, _list):
     return [x for x in _list if not predicate(x)], [x for x in _list if predicate(x)]
+
+
+def getCacheDir():
+    """
+    Return the per user cache directory for unishell, creating it if needed.
+    Raises OSError if the directory cannot be created.
+    """
+    import os
+    from os import path
+
+    base = os.environ.get("XDG_CACHE_HOME") or path.join(path.expanduser("~"), ".cache")
+    cacheDir = path.join(base, "unishell")
+    os.makedirs(cacheDir, exist_ok=True)
+    return cacheDir
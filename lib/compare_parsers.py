@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""compare_parsers
+
+Check that the peg and rd parser backends build the same ASG.
+
+Usage:
+  compare_parsers [--fuzz=COUNT] [--seed=SEED] [FILE ...]
+  compare_parsers --bench=LINES
+  compare_parsers (-h | --help)
+
+Options:
+  --fuzz=COUNT       Also compare COUNT randomly generated inputs
+  --seed=SEED        Random seed used for fuzzing [default: 0]
+  --bench=LINES      Time both backends on a generated script of LINES lines
+  -h --help          Show this screen.
+  FILE               UniShell Script file (usually *.ush)
+"""
+
+import random
+import sys
+import time
+from os import path
+
+from docopt import docopt
+from arpeggio import NoMatch
+
+from interpreter import Interpreter
+from lib.exceptions import BadSyntax
+
+gFuzzAlphabet = ['echo', 'set', 'a', 'b1', '_x', ' ', '  ', '\t', '\n', ';', '#', '"', '\\', '\\t',
+                 '\\"', '$', '$(', ')', '${', '}', '{', '-', '--', '+', '1', '2.5', '1e3', '.', '*',
+                 '/', '~', '@', ':', '?', 'x.y', '|', ' | ', ',', '{a,b}', '!', '!ls', '--', '&', ' &']
+
+
+def parseWith(interpreter, source):
+    try:
+        return repr(interpreter.parseUncached(source))
+    except (NoMatch, BadSyntax):
+        return "SYNTAX ERROR"
+    except Exception as e:
+        return "ERROR: {}".format(type(e).__name__)
+
+
+def compare(pegInterpreter, rdInterpreter, source):
+    pegResult = parseWith(pegInterpreter, source)
+    rdResult = parseWith(rdInterpreter, source)
+    return pegResult == rdResult, pegResult, rdResult
+
+
+def fuzzSource(rnd):
+    return "".join(rnd.choice(gFuzzAlphabet) for _ in range(rnd.randint(1, 12)))
+
+
+def generateScript(lines):
+    templates = [
+        'echo "Hello ${{name}} number {0}" $(echo {0}) -x',
+        'set var{0} "value $(echo nested $(echo {0}))"',
+        '# comment line {0}',
+        'echo a{0} b{0} c{0} 1.5 -2 --flag{0}; echo $var{0}',
+        '"\\tindented $user at {0}"',
+    ]
+    return "\n".join(templates[i % len(templates)].format(i) for i in range(lines))
+
+
+def bench(lines):
+    source = generateScript(lines)
+    results = {}
+    for backend in ("peg", "rd"):
+        interpreter = Interpreter(backend=backend, diskCache=False)
+        start = time.perf_counter()
+        interpreter.parseUncached(source)
+        results[backend] = time.perf_counter() - start
+        print("{}: {:.3f}s".format(backend, results[backend]))
+    print("speedup: {:.1f}x".format(results["peg"] / results["rd"]))
+
+
+def main(args):
+    if args['--bench']:
+        bench(int(args['--bench']))
+        return 0
+
+    pegInterpreter = Interpreter(backend="peg", diskCache=False)
+    rdInterpreter = Interpreter(backend="rd", diskCache=False)
+    failures = 0
+
+    for fileName in args['FILE']:
+        with open(fileName, "r") as f:
+            same, pegResult, rdResult = compare(pegInterpreter, rdInterpreter, f.read())
+        if same:
+            print("SAME: {}".format(path.basename(fileName)))
+        else:
+            failures += 1
+            print("DIFFERENT: {}\n  peg: {}\n  rd:  {}".format(path.basename(fileName), pegResult, rdResult))
+
+    if args['--fuzz']:
+        count = int(args['--fuzz'])
+        rnd = random.Random(int(args['--seed']))
+        differences = 0
+        for _ in range(count):
+            source = fuzzSource(rnd)
+            same, pegResult, rdResult = compare(pegInterpreter, rdInterpreter, source)
+            if not same:
+                differences += 1
+                print("DIFFERENT: {}\n  peg: {}\n  rd:  {}".format(repr(source), pegResult, rdResult))
+        print("FUZZ: {} inputs, {} differences".format(count, differences))
+        failures += differences
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(docopt(__doc__)))
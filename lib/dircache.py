@@ -0,0 +1,401 @@
+"""
+Process wide cache of directory listings and stat results.
+
+ls, stat and FileInfo read the same directories over and over in an
+interactive session. DirCache keeps their listings (the os.DirEntry
+objects, which also hold the stat data read through them) and stat results
+in size bounded LRUs keyed by absolute path.
+
+On Linux every directory with something cached is watched with inotify and
+dropped from the cache as soon as anything in it changes. The stat result
+of a directory is also dropped when something inside it changes (which
+updates its times), so the directory itself is watched too. Directories on
+network file systems (where inotify does not see changes made by other
+machines), on platforms without inotify or beyond the watch limit are
+cached for ttl seconds instead.
+
+Other caches which depend on the contents of a directory can be told when
+it changes through addListener(), which keeps it watched (see PathHash).
+"""
+import os
+import re
+import stat
+import struct
+import sys
+import time
+from collections import OrderedDict
+from os import path
+
+from lib.logger import trace
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+gWatchMask = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+gEventHeader = struct.Struct("iIII")
+
+gRemoteFileSystems = frozenset(("nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "ceph", "glusterfs", "afs",
+                                "lustre", "gpfs"))
+
+
+class Inotify:
+    """
+    Minimal non-blocking inotify instance (through ctypes, Linux only).
+    """
+
+    def __init__(self):
+        import ctypes
+
+        self.ctypes = ctypes
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            self.raiseError()
+
+    def raiseError(self, fileName=None):
+        errno = self.ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno), fileName)
+
+    def addWatch(self, dirPath, mask=gWatchMask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirPath), mask)
+        if wd < 0:
+            self.raiseError(dirPath)
+        return wd
+
+    def removeWatch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def readEvents(self):
+        """
+        Return the (wd, mask) of all pending events without blocking.
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, nameLen = gEventHeader.unpack_from(data, offset)
+                events.append((wd, mask))
+                offset += gEventHeader.size + nameLen
+
+
+def unescapeMountPath(mountPath):
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), mountPath)
+
+
+def readMounts():
+    """
+    Return (mount point, file system type) for every mount, deepest first.
+    """
+    try:
+        with open("/proc/self/mounts") as f:
+            mounts = [line.split()[1:3] for line in f]
+    except OSError:
+        return []
+    mounts = [(unescapeMountPath(mountPoint), fsType) for mountPoint, fsType in mounts]
+    return sorted(mounts, key=lambda mount: len(mount[0]), reverse=True)
+
+
+class DirCache:
+    def __init__(self, maxSize=256, maxStats=4096, ttl=2.0, useInotify=True):
+        self.maxSize = maxSize
+        self.maxStats = maxStats
+        self.ttl = ttl
+        self.useInotify = useInotify and sys.platform.startswith("linux")
+        self.inotify = None
+        self.mounts = None
+        # dirPath -> (entries, expiry), expiry is None for watched directories
+        self.listings = OrderedDict()
+        # filePath -> (stat result, expiry)
+        self.statResults = OrderedDict()
+        # dirPath -> paths in statResults of files in the directory
+        self.statsByDir = {}
+        self.watches = {}
+        self.watchedDirs = {}
+        # dirPath -> callbacks called when it changes
+        self.listeners = {}
+        self.clear()
+
+    def clear(self):
+        self.listings.clear()
+        self.statResults.clear()
+        self.statsByDir.clear()
+        for dirPath in list(self.watches):
+            self.unwatch(dirPath)
+        self.dropListeners()
+        self.hits = 0
+        self.misses = 0
+        self.statHits = 0
+        self.statMisses = 0
+        self.invalidations = 0
+
+    def forget(self):
+        """
+        Drop everything, in a process forked from the one which owns the
+        cache. The inotify instance (and its queue of events) is shared with
+        that process, so its watches are left alone and only our descriptor
+        is closed: reading events here would take them away from it.
+        """
+        if self.inotify is not None:
+            os.close(self.inotify.fd)
+            self.inotify = None
+        self.watches.clear()
+        self.watchedDirs.clear()
+        self.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.statHits + self.statMisses
+        return {
+            "size": len(self.listings),
+            "max_size": self.maxSize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stat_size": len(self.statResults),
+            "stat_hits": self.statHits,
+            "stat_misses": self.statMisses,
+            "hit_rate": round((self.hits + self.statHits) / lookups, 3) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "watches": len(self.watches),
+        }
+
+    def isRemote(self, dirPath):
+        if self.mounts is None:
+            self.mounts = readMounts()
+        realPath = path.realpath(dirPath)
+        for mountPoint, fsType in self.mounts:
+            if realPath == mountPoint or realPath.startswith(mountPoint.rstrip("/") + "/"):
+                return fsType in gRemoteFileSystems or fsType.startswith("fuse")
+        return False
+
+    def watch(self, dirPath):
+        """
+        Watch dirPath for changes, returning the expiry time for entries
+        cached from it (None if the watch will invalidate them).
+        """
+        if dirPath in self.watches:
+            return None
+
+        if self.useInotify and not self.isRemote(dirPath):
+            try:
+                if self.inotify is None:
+                    self.inotify = Inotify()
+                wd = self.inotify.addWatch(dirPath)
+                self.watches[dirPath] = wd
+                self.watchedDirs[wd] = dirPath
+                return None
+            except (OSError, AttributeError) as e:
+                # AttributeError: libc without inotify
+                trace("cache", "Not watching {}: {}", dirPath, e)
+                if self.inotify is None:
+                    self.useInotify = False
+
+        return time.monotonic() + self.ttl
+
+    def unwatch(self, dirPath):
+        wd = self.watches.pop(dirPath, None)
+        if wd is not None:
+            self.watchedDirs.pop(wd, None)
+            self.inotify.removeWatch(wd)
+
+    def release(self, dirPath):
+        """
+        Stop watching dirPath once nothing from it is cached.
+        """
+        if dirPath not in self.listings and dirPath not in self.statsByDir and dirPath not in self.listeners:
+            self.unwatch(dirPath)
+
+    def addListener(self, dirPath, callback):
+        """
+        Call callback(dirPath, watched) whenever the directory dirPath
+        (absolute) changes, until removeListener(). watched is False when
+        the directory is no longer watched (it was removed or the cache was
+        cleared), the listener is then removed. Returns False, adding no
+        listener, when dirPath cannot be watched with inotify.
+        """
+        if self.watch(dirPath) is not None:
+            return False
+        self.listeners.setdefault(dirPath, []).append(callback)
+        return True
+
+    def removeListener(self, dirPath, callback):
+        callbacks = self.listeners.get(dirPath)
+        if callbacks and callback in callbacks:
+            callbacks.remove(callback)
+            if not callbacks:
+                del self.listeners[dirPath]
+                self.release(dirPath)
+
+    def notify(self, dirPath, watched=True):
+        callbacks = self.listeners.get(dirPath) if watched else self.listeners.pop(dirPath, None)
+        for callback in list(callbacks or ()):
+            callback(dirPath, watched)
+
+    def dropListeners(self):
+        for dirPath in list(self.listeners):
+            self.notify(dirPath, watched=False)
+
+    def poll(self):
+        """
+        Drop everything cached from directories which have changed.
+        """
+        if not self.watches:
+            return
+
+        for wd, mask in self.inotify.readEvents():
+            if mask & IN_Q_OVERFLOW:
+                trace("cache", "inotify queue overflow, dropping all cached directories")
+                self.invalidations += 1
+                self.listings.clear()
+                self.statResults.clear()
+                self.statsByDir.clear()
+                for dirPath in list(self.listeners):
+                    self.notify(dirPath)
+                continue
+
+            dirPath = self.watchedDirs.get(wd)
+            if dirPath is None:
+                continue
+            self.invalidate(dirPath)
+            if mask & IN_IGNORED:
+                # The kernel removed the watch (directory deleted)
+                self.watches.pop(dirPath, None)
+                self.watchedDirs.pop(wd, None)
+                self.notify(dirPath, watched=False)
+            else:
+                self.notify(dirPath)
+
+    def invalidate(self, dirPath):
+        self.invalidations += 1
+        self.listings.pop(dirPath, None)
+        for filePath in self.statsByDir.pop(dirPath, ()):
+            if filePath in self.statResults:
+                self.dropStat(filePath)
+        trace("cache", "Invalidated {}", dirPath)
+
+    def listDir(self, dirPath):
+        """
+        Return the cached os.DirEntry list for dirPath (absolute) or None.
+        """
+        self.poll()
+        cached = self.listings.get(dirPath)
+        if cached is not None:
+            entries, expiry = cached
+            if expiry is None or time.monotonic() < expiry:
+                self.hits += 1
+                self.listings.move_to_end(dirPath)
+                return entries
+            del self.listings[dirPath]
+            self.release(dirPath)
+        self.misses += 1
+        return None
+
+    def scanDir(self, target):
+        """
+        Yield the os.DirEntry objects of the directory target, from the cache
+        if possible. Otherwise the directory is read lazily and only cached
+        if it was read to the end.
+        """
+        dirPath = path.abspath(target)
+        entries = self.listDir(dirPath)
+        if entries is not None:
+            yield from entries
+            return
+
+        # Watch before reading so no change made while reading is missed
+        expiry = self.watch(dirPath)
+        entries = []
+        try:
+            with os.scandir(dirPath) as it:
+                for entry in it:
+                    entries.append(entry)
+                    yield entry
+        except BaseException as e:
+            # Failed or stopped early (e.g. by head), cache nothing
+            self.release(dirPath)
+            if isinstance(e, OSError) and e.filename == dirPath:
+                e.filename = target  # Report the path as it was given
+            raise
+
+        self.listings[dirPath] = (entries, expiry)
+        if len(self.listings) > self.maxSize:
+            evicted, _ = self.listings.popitem(last=False)
+            self.release(evicted)
+
+    def stat(self, filePath):
+        """
+        os.stat(filePath) through the cache.
+        """
+        filePath = path.abspath(filePath)
+        self.poll()
+        cached = self.statResults.get(filePath)
+        if cached is not None:
+            result, expiry = cached
+            if expiry is None or time.monotonic() < expiry:
+                self.statHits += 1
+                self.statResults.move_to_end(filePath)
+                return result
+            self.dropStat(filePath)
+
+        self.statMisses += 1
+        dirPath = path.dirname(filePath)
+        expiry = self.watch(dirPath)
+        try:
+            result = os.stat(filePath)
+        except OSError:
+            self.release(dirPath)
+            raise
+
+        owners = statOwners(filePath, result)
+        if len(owners) > 1:
+            ownExpiry = self.watch(filePath)
+            if ownExpiry is not None:
+                expiry = ownExpiry if expiry is None else min(expiry, ownExpiry)
+
+        self.statResults[filePath] = (result, expiry)
+        for owner in owners:
+            self.statsByDir.setdefault(owner, set()).add(filePath)
+        if len(self.statResults) > self.maxStats:
+            self.dropStat(next(iter(self.statResults)))
+        return result
+
+    def dropStat(self, filePath):
+        result, _ = self.statResults.pop(filePath)
+        for owner in statOwners(filePath, result):
+            dirStats = self.statsByDir.get(owner)
+            if dirStats is not None:
+                dirStats.discard(filePath)
+                if not dirStats:
+                    del self.statsByDir[owner]
+                    self.release(owner)
+
+
+def statOwners(filePath, result):
+    """
+    Return the directories whose changes invalidate the stat result of
+    filePath: its parent and, for a directory, the directory itself.
+    """
+    dirPath = path.dirname(filePath)
+    if stat.S_ISDIR(result.st_mode) and filePath != dirPath:
+        return (dirPath, filePath)
+    return (dirPath,)
+
+
+gDirCache = DirCache()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=gDirCache.forget)
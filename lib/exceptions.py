@@ -17,3 +17,11 @@ class BadExit(Exception):
     def __init__(self, exitCode, msg=""):
         super().__init__(self, msg)
         self.exitCode = exitCode
+        self.msg = msg
+
+
+class BadSyntax(Exception):
+    def __init__(self, msg, line, column):
+        super().__init__(msg)
+        self.line = line
+        self.column = column
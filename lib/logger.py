@@ -1,20 +1,53 @@
+"""
+Levelled, per category tracing.
+
+Messages are format strings whose arguments are only formatted when the
+category is enabled, so a disabled trace() costs a dict lookup. Code on hot
+paths should go further and pick traced or untraced implementations once,
+using isTracing(), so that nothing is checked when tracing is off.
+
+Categories:
+    init     Shell start up
+    parse    Parsing and ASG construction
+    eval     Program evaluation
+    cache    Parse and parser caches
+"""
 import sys
 
-debugLevel = 0
+gCategories = ("init", "parse", "eval", "cache")
 
+# Trace level of every category, 0 disables the category
+gLevels = dict.fromkeys(gCategories, 0)
 
-def dbg(*s, **kwargs):
-    if debugLevel:
-        print(*s, **kwargs)
 
+def trace(category, msg, *args, file=None):
+    """
+    Print msg.format(*args) if category is enabled. The message is not
+    formatted at all otherwise.
+    """
+    if gLevels[category]:
+        print(msg.format(*args) if args else msg, file=file or sys.stdout)
+
+
+def isTracing(category, level=1):
+    return gLevels[category] >= level
+
+
+def setDebugLevel(level, categories=gCategories):
+    """
+    Set the trace level of the given categories (all by default). Categories
+    which are not listed are disabled.
+    """
+    for category in categories:
+        if category not in gLevels:
+            raise ValueError("Unknown trace category {}".format(repr(category)))
 
-def setDebugLevel(level):
-    global debugLevel
-    debugLevel = level
+    for category in gLevels:
+        gLevels[category] = level if category in categories else 0
 
 
 def getDebugLevel():
-    return debugLevel
+    return max(gLevels.values())
 
 
 def format_arg_value(arg_val):
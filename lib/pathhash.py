@@ -0,0 +1,148 @@
+"""
+bash style hash table of external command names to executables.
+
+Searching PATH means trying every directory in it until the command is
+found. PathHash remembers where each command was found together with the
+modification times of the directories searched to find it. A hit is used
+as long as PATH is the same and none of those directories has changed (a
+new executable in one of them could shadow the one found, or the one found
+could have been removed).
+
+The directories searched are watched through gDirCache, which tells the
+table when one of them changes, so a hit makes no system calls other than
+reading the (usually empty) inotify queue. Directories which cannot be
+watched (relative ones, those on network file systems or without inotify)
+have their modification times compared on every hit instead.
+"""
+import os
+from os import path
+
+from lib.dircache import gDirCache
+
+
+def isExecutable(filePath):
+    return os.access(filePath, os.X_OK) and path.isfile(filePath)
+
+
+class PathHash:
+    def __init__(self, dirCache=gDirCache):
+        self.dirCache = dirCache
+        self.searchPath = None
+        self.dirs = ()
+        self.table = {}
+        # dirPath -> True if dirCache tells us when it changes
+        self.watched = {}
+        self.clear()
+
+    def clear(self):
+        self.table.clear()
+        self.unwatchDirs()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def stats(self):
+        return {
+            "size": len(self.table),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+    def watchDir(self, dirPath):
+        watched = self.watched.get(dirPath)
+        if watched is None:
+            watched = path.isabs(dirPath) and self.dirCache.addListener(dirPath, self.dirChanged)
+            self.watched[dirPath] = watched
+        return watched
+
+    def unwatchDirs(self):
+        for dirPath, watched in self.watched.items():
+            if watched:
+                self.dirCache.removeListener(dirPath, self.dirChanged)
+        self.watched.clear()
+
+    def dirChanged(self, dirPath, watched):
+        """
+        Drop the entries found by searching dirPath (called by dirCache).
+        """
+        if not watched:
+            self.watched.pop(dirPath, None)
+        if dirPath not in self.dirs:
+            return
+        index = self.dirs.index(dirPath)
+        for name in [name for name, (_, times) in self.table.items() if len(times) > index]:
+            self.invalidations += 1
+            del self.table[name]
+
+    def dirTimes(self, count):
+        """
+        Return the modification times of the first count directories of
+        PATH, None for those which are watched.
+        """
+        times = []
+        for dirPath in self.dirs[:count]:
+            if self.watchDir(dirPath):
+                times.append(None)
+                continue
+            try:
+                times.append(os.stat(dirPath).st_mtime_ns)
+            except OSError:
+                times.append(-1)
+        return tuple(times)
+
+    def isCurrent(self, times):
+        for dirPath, mtime in zip(self.dirs, times):
+            if mtime is None:
+                continue
+            try:
+                if os.stat(dirPath).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                if mtime != -1:
+                    return False
+        return True
+
+    def lookup(self, name, searchPath):
+        """
+        Return the executable run for the command name with PATH set to
+        searchPath, or None if there is none. Names containing a slash are
+        not looked up in PATH.
+        """
+        if "/" in name:
+            return name if isExecutable(name) else None
+
+        if searchPath != self.searchPath:
+            if self.table:
+                self.invalidations += 1
+            self.table.clear()
+            self.unwatchDirs()
+            self.searchPath = searchPath
+            self.dirs = tuple(dirPath or "." for dirPath in searchPath.split(os.pathsep))
+
+        # Drops the entries of directories which have changed
+        self.dirCache.poll()
+        entry = self.table.get(name)
+        if entry is not None:
+            executable, times = entry
+            if self.isCurrent(times):
+                self.hits += 1
+                return executable
+            self.invalidations += 1
+            del self.table[name]
+
+        self.misses += 1
+        for i, dirPath in enumerate(self.dirs):
+            # Watch before searching so no change made meanwhile is missed
+            self.watchDir(dirPath)
+            candidate = path.join(dirPath, name)
+            if isExecutable(candidate):
+                self.table[name] = (candidate, self.dirTimes(i + 1))
+                return candidate
+        return None
+
+    def entries(self):
+        return {name: entry[0] for name, entry in self.table.items()}
+
+
+gPathHash = PathHash()
@@ -0,0 +1,167 @@
+"""
+Per statement and per command profiles (the profile command and unishell
+--profile).
+
+A Profiler is given to the compiler, which then wraps every top level
+statement of a Program and every command it calls; without one the
+compiled code contains no profiling code at all. For each statement and
+each command name it records the number of calls, the wall time and the
+change in memory allocated through tracemalloc, which is started for as
+long as the profiler is.
+
+Times include the commands called by a statement or a command, so a
+command nested in an argument of another one is counted in both. Streams
+are mostly produced after the command returns, their cost belongs to the
+statement which drains them. The time of every stack of statement and
+commands less that of the commands called from it is also recorded, for
+flame graphs.
+
+Formats:
+    report      Statements and commands sorted by time
+    json        The same as a JSON document
+    collapsed   "statement;command;command microseconds" lines, the input
+                of flamegraph.pl and compatible tools
+"""
+import json
+import threading
+import time
+import tracemalloc
+import weakref
+
+gFormats = ("report", "json", "collapsed")
+
+
+class Stats:
+    __slots__ = ("calls", "seconds", "allocated")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.allocated = 0
+
+    def add(self, seconds, allocated):
+        self.calls += 1
+        self.seconds += seconds
+        self.allocated += allocated
+
+
+class Profiler:
+    def __init__(self):
+        self.statements = {}
+        self.commands = {}
+        # Self time by tuple of statement and command names
+        self.stacks = {}
+        self.labels = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+        # Background jobs run on threads of their own
+        self.local = threading.local()
+        self.startedTracing = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.startedTracing = True
+
+    def stop(self):
+        if self.startedTracing:
+            tracemalloc.stop()
+            self.startedTracing = False
+
+    def addSource(self, program, source, name):
+        """
+        Label the statements of program, parsed from source, with name and
+        their line and text. Programs without labels only have their
+        commands profiled.
+        """
+        from interpreter import rdparser
+        from lib.exceptions import BadSyntax
+
+        try:
+            lines = rdparser.statementLines(source)
+        except BadSyntax:
+            lines = []
+        if len(lines) == len(program.expressions):
+            labels = ["{}:{} {}".format(name, line, text) for line, text in lines]
+        else:
+            labels = ["{}:#{}".format(name, i + 1) for i in range(len(program.expressions))]
+        self.labels[program] = labels
+
+    def statementLabels(self, program):
+        return self.labels.get(program)
+
+    def profiled(self, fn, name, table):
+        """
+        Return fn recording its calls under name in table.
+        """
+        local = self.local
+        lock = self.lock
+        stacks = self.stacks
+
+        def profiledFn(context, *args):
+            stack = getattr(local, "stack", None)
+            if stack is None:
+                stack = local.stack = []
+            # [name, time spent in the profiled functions it called]
+            frame = [name, 0.0]
+            stack.append(frame)
+            allocated = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            try:
+                return fn(context, *args)
+            finally:
+                seconds = time.perf_counter() - start
+                allocated = tracemalloc.get_traced_memory()[0] - allocated
+                key = tuple(f[0] for f in stack)
+                stack.pop()
+                if stack:
+                    stack[-1][1] += seconds
+                with lock:
+                    stats = table.get(name)
+                    if stats is None:
+                        stats = table[name] = Stats()
+                    stats.add(seconds, allocated)
+                    stacks[key] = stacks.get(key, 0.0) + seconds - frame[1]
+
+        return profiledFn
+
+    def statement(self, fn, label):
+        return self.profiled(fn, label, self.statements)
+
+    def command(self, fn, cmdName):
+        return self.profiled(fn, cmdName, self.commands)
+
+    def toDict(self):
+        def rows(table):
+            return [{"name": name, "calls": stats.calls, "seconds": stats.seconds,
+                     "allocatedBytes": stats.allocated}
+                    for name, stats in sorted(table.items(), key=lambda item: -item[1].seconds)]
+
+        return {"statements": rows(self.statements), "commands": rows(self.commands)}
+
+    def report(self):
+        profile = self.toDict()
+        lines = []
+        for title, rows in (("Statement", profile["statements"]), ("Command", profile["commands"])):
+            lines.append("{:>10} {:>8} {:>12}  {}".format("ms", "calls", "alloc KiB", title))
+            for row in rows:
+                name = row["name"] if len(row["name"]) <= 60 else row["name"][:57] + "..."
+                lines.append("{:10.3f} {:8} {:12.1f}  {}".format(row["seconds"] * 1000, row["calls"],
+                                                               row["allocatedBytes"] / 1024, name))
+            lines.append("")
+        return "\n".join(lines)
+
+    def collapsed(self):
+        lines = []
+        for key, seconds in sorted(self.stacks.items()):
+            frames = ";".join(frame.replace(";", ",") for frame in key)
+            lines.append("{} {}".format(frames, max(0, round(seconds * 1e6))))
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def format(self, fmt="report"):
+        if fmt == "json":
+            return json.dumps(self.toDict(), indent=2) + "\n"
+        if fmt == "collapsed":
+            return self.collapsed()
+        if fmt == "report":
+            return self.report()
+        raise ValueError("Unknown profile format {!r}, expected one of {}".format(fmt, ", ".join(gFormats)))
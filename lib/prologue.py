@@ -1,2 +1,17 @@
+"""
+What the context is set up with before a script runs: the prologue, which
+is run on it, and the default prompt.
+
+Both end up in the context snapshot (see lib.snapshot), so they live here
+rather than in unishell.py: functions pickled from the script being run
+would be saved as __main__ attributes, which only the same entry point
+could load again.
+"""
+import os
+
 prologue = """\
 """
+
+
+def defaultPrompt(args, flags, context):
+    return os.getcwd() + "> "
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""registry
+
+Commands known by name, imported the first time they are called.
+
+Commands are declared in manifests, text files with a line per command:
+
+    name  module:function  summary
+
+commands/commands.manifest declares the built-in commands and is generated
+from the cmd* functions of the commands module by running this module.
+Site commands are declared in the manifests listed in $UNISHELL_COMMANDS
+(separated like PATH), a command declared again replaces the earlier one.
+
+Starting the shell only reads the manifests. Each command is bound to a
+LazyCommand which imports its module on the first call and then binds the
+function itself in its place, so neither the commands nor what they import
+cost anything until they are used and help can list them all from their
+summaries.
+
+Usage:
+  registry [--check]
+  registry (-h | --help)
+
+Options:
+  --check            Only report whether the built-in manifest is up to date
+  -h --help          Show this screen.
+"""
+import os
+from os import path
+
+gBuiltinManifest = path.join(path.dirname(path.dirname(path.abspath(__file__))), "commands", "commands.manifest")
+
+gManifestHeader = """\
+# Built-in commands: name  module:function  summary
+# Generated from the commands module by "python3 -m lib.registry", do not edit
+"""
+
+
+class LazyCommand:
+    """
+    A command declared in a manifest, imported the first time it is called.
+    """
+
+    def __init__(self, name, target, summary=""):
+        self.name = name
+        self.target = target
+        self.summary = summary
+        self.fn = None
+
+    def load(self):
+        if self.fn is None:
+            import importlib
+
+            moduleName, _, fnName = self.target.partition(":")
+            self.fn = getattr(importlib.import_module(moduleName), fnName)
+        return self.fn
+
+    def __call__(self, args, flags, context):
+        fn = self.load()
+        # Later lookups get the function without going through us
+        env = context["vars"]
+        if env.get(self.name) is self:
+            env[self.name] = fn
+        return fn(args, flags, context)
+
+    def __reduce__(self):
+        return LazyCommand, (self.name, self.target, self.summary)
+
+    def __repr__(self):
+        return "LazyCommand({!r}, {!r})".format(self.name, self.target)
+
+
+def manifestPaths():
+    sitePaths = os.environ.get("UNISHELL_COMMANDS", "")
+    return [gBuiltinManifest] + [manifest for manifest in sitePaths.split(os.pathsep) if manifest]
+
+
+def readManifest(manifest):
+    """
+    Yield (name, target, summary) for every command declared in manifest.
+    """
+    with open(manifest, "r", encoding="utf-8") as f:
+        for lineNo, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split(None, 2)
+            if len(fields) < 2 or ":" not in fields[1]:
+                raise ValueError("{}:{}: Expected a name and a module:function".format(manifest, lineNo))
+            yield fields[0], fields[1], fields[2] if len(fields) > 2 else ""
+
+
+def loadCommands():
+    """
+    Return a LazyCommand for every command in the manifests by name.
+    Manifests which cannot be read are reported and skipped.
+    """
+    import sys
+
+    commands = {}
+    for manifest in manifestPaths():
+        try:
+            for name, target, summary in readManifest(manifest):
+                commands[name] = LazyCommand(name, target, summary)
+        except (OSError, ValueError) as e:
+            print("ERROR: ({}) {}".format(type(e).__name__, e), file=sys.stderr)
+    return commands
+
+
+def modulePaths():
+    """
+    Return the source files of the modules the commands in the manifests
+    are imported from, found without importing them. Modules which cannot
+    be found are left out.
+    """
+    import importlib.util
+
+    modules = set()
+    for manifest in manifestPaths():
+        try:
+            modules.update(target.partition(":")[0] for _, target, _ in readManifest(manifest))
+        except (OSError, ValueError):
+            pass  # Reported by loadCommands
+
+    paths = []
+    for moduleName in sorted(modules):
+        try:
+            spec = importlib.util.find_spec(moduleName)
+        except (ImportError, ValueError):
+            continue
+        if spec is not None and spec.has_location:
+            paths.append(spec.origin)
+    return paths
+
+
+def summarize(fn):
+    """
+    Return the first sentence of fn's docstring.
+    """
+    doc = (fn.__doc__ or "").strip()
+    paragraph = " ".join(doc.split("\n\n")[0].split())
+    end = paragraph.find(". ")
+    return paragraph[:end + 1] if end >= 0 else paragraph
+
+
+def summaryOf(value):
+    return value.summary if isinstance(value, LazyCommand) else summarize(value)
+
+
+def builtinManifest():
+    """
+    Return the text of the manifest of the cmd* functions in commands.
+    """
+    import commands
+
+    lines = []
+    for attr, fn in sorted(vars(commands).items()):
+        if attr.startswith("cmd") and callable(fn):
+            name = attr[3:].lower()
+            lines.append("{:<10} {:<24} {}".format(name, "commands:" + attr, summarize(fn)).rstrip() + "\n")
+    return gManifestHeader + "".join(lines)
+
+
+def main(args):
+    text = builtinManifest()
+    try:
+        with open(gBuiltinManifest, "r", encoding="utf-8") as f:
+            current = f.read()
+    except FileNotFoundError:
+        current = None
+
+    if text == current:
+        print("{} is up to date".format(path.relpath(gBuiltinManifest)))
+        return 0
+    if args['--check']:
+        print("{} is out of date, run python3 -m lib.registry".format(path.relpath(gBuiltinManifest)))
+        return 1
+
+    with open(gBuiltinManifest, "w", encoding="utf-8") as f:
+        f.write(text)
+    print("Wrote {}".format(path.relpath(gBuiltinManifest)))
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+    from docopt import docopt
+
+    sys.exit(main(docopt(__doc__)))
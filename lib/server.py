@@ -0,0 +1,275 @@
+"""
+A warm interpreter serving command lines over a Unix socket (unishell
+--server), and the protocol spoken by its client, unishellc.
+
+Starting unishell means importing Python, docopt and arpeggio, building the
+grammar and running the prologue, which is most of the time taken by a
+short "unishell -c ...". The server does all of that once. The client sends
+it its arguments, working directory and environment along with its
+standard input, output and error (the descriptors themselves, passed with
+SCM_RIGHTS, so the server reads and writes them directly).
+
+For every request the server forks. The child starts from a copy of the
+initialised interpreter and context which nothing done by other requests
+can touch, moves into the client's directory and environment, runs the
+command line and reports its exit status:
+
+    client -> server    4 byte length, "cwd\0argc\0argv...\0NAME=value...",
+                        fds 0 1 2
+    server -> client    "pid <child pid>\\n" ... "exit <status>\\n"
+
+Both ends check with SO_PEERCRED that the other one runs as the same user
+before anything is sent, and the default socket is in a directory only the
+user can enter, so nobody else can listen in place of the server or send
+it requests.
+
+The client forwards SIGINT, SIGTERM and SIGQUIT to the child. This module
+is imported by the client, whose start up is what the server saves, so at
+the top it only imports modules written in C: the client uses _socket and
+_signal rather than socket and signal, which import enum (and json would
+import re).
+"""
+import _socket
+import os
+import struct
+import sys
+from array import array
+
+gLength = struct.Struct("!I")
+# struct ucred, returned by SO_PEERCRED
+gPeerCred = struct.Struct("3i")
+
+
+def privateDir(dirPath):
+    """
+    Create dirPath with mode 0700 if it does not exist and check that it is
+    a directory (not a link) owned by us which nobody else can use. Raises
+    PermissionError otherwise.
+    """
+    try:
+        os.mkdir(dirPath, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(dirPath)
+    if (st.st_mode & 0o170000) != 0o040000 or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError("{} is not a private directory of the current user".format(dirPath))
+    return dirPath
+
+
+def defaultSocketPath():
+    """
+    Return $UNISHELL_SOCKET, or a per user path for the server's socket:
+    in $XDG_RUNTIME_DIR or else in a private directory in /tmp, which is
+    created if needed. Raises PermissionError if that directory belongs to
+    someone else or is open to them.
+    """
+    socketPath = os.environ.get("UNISHELL_SOCKET")
+    if socketPath:
+        return socketPath
+    runtimeDir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtimeDir:
+        return os.path.join(runtimeDir, "unishell.sock")
+    return os.path.join(privateDir("/tmp/unishell-{}".format(os.getuid())), "unishell.sock")
+
+
+def checkPeer(conn):
+    """
+    Raise PermissionError unless the process at the other end of conn runs
+    as the current user. Where SO_PEERCRED is not available only the
+    permissions of the socket's directory protect it.
+    """
+    option = getattr(_socket, "SO_PEERCRED", None)
+    if option is None:
+        return
+    _, uid, _ = gPeerCred.unpack(conn.getsockopt(_socket.SOL_SOCKET, option, gPeerCred.size))
+    if uid != os.getuid():
+        raise PermissionError("The other end of the socket runs as user {}".format(uid))
+
+
+def recvExactly(conn, size, data=b""):
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise EOFError("Connection closed")
+        data += chunk
+    return data
+
+
+def sendRequest(conn, argv, fds=(0, 1, 2)):
+    fields = [os.getcwdb(), str(len(argv)).encode()] + [os.fsencode(arg) for arg in argv]
+    fields += [name + b"=" + value for name, value in os.environb.items()]
+    payload = b"\0".join(fields)
+    conn.sendmsg([gLength.pack(len(payload)) + payload],
+                 [(_socket.SOL_SOCKET, _socket.SCM_RIGHTS, array("i", fds))])
+
+
+def recvRequest(conn):
+    """
+    Return the request's (argv, cwd, env) and the file descriptors sent
+    with it.
+    """
+    import socket
+
+    checkPeer(conn)
+    data, fds, _, _ = socket.recv_fds(conn, 1 << 16, 3)
+    header = recvExactly(conn, gLength.size, data[:gLength.size])
+    size, = gLength.unpack(header)
+    fields = [os.fsdecode(field) for field in recvExactly(conn, size, data[gLength.size:]).split(b"\0")]
+    argc = int(fields[1])
+    env = dict(field.split("=", 1) for field in fields[argc + 2:])
+    return (fields[2:argc + 2], fields[0], env), fds
+
+
+def listen(socketPath):
+    """
+    Return a socket listening on socketPath, which only the current user
+    can connect to. A socket left behind by a server which is not running
+    is replaced, one which is in use raises OSError.
+    """
+    import socket
+
+    if os.path.exists(socketPath):
+        probe = socket.socket(socket.AF_UNIX)
+        try:
+            probe.connect(socketPath)
+        except OSError:
+            os.remove(socketPath)
+        else:
+            raise OSError("A server is already listening on {}".format(socketPath))
+        finally:
+            probe.close()
+
+    server = socket.socket(socket.AF_UNIX)
+    umask = os.umask(0o177)
+    try:
+        server.bind(socketPath)
+    finally:
+        os.umask(umask)
+    server.listen(64)
+    return server
+
+
+def redirectStdio(fds):
+    """
+    Make fds the standard input, output and error of the process, with new
+    sys.std* files (buffered the way Python would buffer them).
+    """
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    sys.stdin = open(0, "r", closefd=False)
+    sys.stdout = open(1, "w", buffering=1 if os.isatty(1) else -1, closefd=False)
+    sys.stderr = open(2, "w", buffering=1, closefd=False)
+
+
+def child(server, conn, handle):
+    """
+    Serve the request on conn in a forked child and exit with its status.
+    """
+    import signal
+
+    status = 1
+    try:
+        server.close()
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        (argv, cwd, env), fds = recvRequest(conn)
+        if len(fds) != 3:
+            raise ValueError("Expected 3 file descriptors, got {}".format(len(fds)))
+
+        redirectStdio(fds)
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(env)
+        conn.sendall("pid {}\n".format(os.getpid()).encode())
+
+        try:
+            status = handle(argv)
+        except SystemExit as e:
+            if isinstance(e.code, str):
+                print(e.code, file=sys.stderr)
+                status = 1
+            else:
+                status = e.code or 0
+        except KeyboardInterrupt:
+            status = 130
+    except Exception as e:
+        print("ERROR: ({}) {}".format(type(e).__name__, e), file=sys.stderr)
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            conn.sendall("exit {}\n".format(status).encode())
+        except (OSError, ValueError):
+            pass
+        # Do not run the server's exit handlers (or flush its buffers)
+        os._exit(status & 0xFF)
+
+
+def serve(socketPath, handle):
+    """
+    Accept requests on socketPath until interrupted, running each one with
+    handle(argv) (which returns the exit status) in a forked child.
+    """
+    import signal
+
+    server = listen(socketPath)
+    # Children are reaped by the kernel, nobody waits for them here
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    # Remove the socket when stopped by kill too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print("Listening on {}".format(socketPath), file=sys.stderr)
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    try:
+        while True:
+            conn, _ = server.accept()
+            try:
+                if os.fork() == 0:
+                    child(server, conn, handle)
+            finally:
+                conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(socketPath)
+
+
+def request(socketPath, argv):
+    """
+    Run argv on the server listening on socketPath with our standard input,
+    output and error, and return its exit status. Raises OSError if there
+    is no server and PermissionError if it is not run by the current user.
+    """
+    import _signal
+
+    conn = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    conn.connect(socketPath)
+    checkPeer(conn)
+    sendRequest(conn, argv)
+
+    pid = None
+
+    def forward(signum, frame):
+        if pid is not None:
+            os.kill(pid, signum)
+
+    for signum in (_signal.SIGINT, _signal.SIGTERM, _signal.SIGQUIT):
+        _signal.signal(signum, forward)
+
+    data = b""
+    while True:
+        chunk = conn.recv(4096)
+        if not chunk:
+            # The child died without reporting its status
+            return 1
+        data += chunk
+        while b"\n" in data:
+            line, data = data.split(b"\n", 1)
+            kind, value = line.decode().split()
+            if kind == "pid":
+                pid = int(value)
+            elif kind == "exit":
+                return int(value)
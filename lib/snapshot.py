@@ -0,0 +1,91 @@
+"""
+Snapshot of the shell's context as it is once initialised.
+
+Building the context means collecting the commands and running the
+prologue, which needs the grammar loaded and parses and runs every
+statement of it. The context it produces (variables, exported variables and
+option stacks) is pickled in the user cache directory instead, keyed by a
+hash of the prologue and of the modules which define the commands and the
+context. A later start restores it in one load as long as none of them has
+changed, otherwise the context is built again and a new snapshot written.
+
+The prologue is expected to only set up the context: anything else it does
+(e.g. printing) is not replayed when the snapshot is used.
+"""
+import hashlib
+import os
+import pickle
+from os import path
+
+from lib import getCacheDir
+from lib.logger import trace
+
+gSnapshotName = "context.pickle"
+
+
+def snapshotKey(tag, prologue, modulePaths):
+    """
+    Return the key of a snapshot made with the interpreter tagged tag (its
+    version), by running prologue with the commands in modulePaths. Paths
+    which cannot be read (e.g. a missing manifest, which lib.registry
+    skips) are part of the key as such.
+    """
+    h = hashlib.sha1()
+    h.update(tag.encode("utf-8") + b"\0")
+    h.update(prologue.encode("utf-8") + b"\0")
+    for modulePath in modulePaths:
+        try:
+            with open(modulePath, "rb") as f:
+                h.update(f.read() + b"\0")
+        except OSError:
+            h.update(b"unreadable\0" + os.fsencode(modulePath) + b"\0")
+    return h.hexdigest()
+
+
+def snapshotPath():
+    return path.join(getCacheDir(), gSnapshotName)
+
+
+def load(key):
+    """
+    Return the context saved with key, or None if there is no snapshot or it
+    was made from something else.
+    """
+    try:
+        snapshot = snapshotPath()
+        with open(snapshot, "rb") as f:
+            savedKey, context = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # Includes snapshots referring to commands which no longer exist
+        trace("cache", "Ignoring unreadable context snapshot: {}", e)
+        return None
+
+    if savedKey != key:
+        trace("cache", "Context snapshot {} is stale", snapshot)
+        return None
+
+    trace("cache", "Loaded context from {}", snapshot)
+    return context
+
+
+def save(key, context):
+    try:
+        snapshot = snapshotPath()
+    except OSError as e:
+        trace("cache", "No cache directory: {}", e)
+        return
+
+    tmpPath = "{}.{}.tmp".format(snapshot, os.getpid())
+    try:
+        with open(tmpPath, "wb") as f:
+            pickle.dump((key, context), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, snapshot)
+    except (OSError, pickle.PicklingError, AttributeError, TypeError) as e:
+        # Values which cannot be pickled (e.g. a lambda set by the prologue)
+        trace("cache", "Could not write context snapshot {}: {}", snapshot, e)
+        try:
+            os.remove(tmpPath)
+        except OSError:
+            pass
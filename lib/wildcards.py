@@ -0,0 +1,212 @@
+"""
+Wildcard (glob) expansion for unquoted words.
+
+Supports * and ? within a path component, ** for any number of
+directories and {a,b} alternatives. As in bash, braces are expanded first
+(whether or not any file matches), names starting with a dot are only
+matched by patterns starting with a dot, the matches are sorted and a
+pattern which matches nothing is left as it is.
+
+Patterns are compiled once into a list of per component matchers and kept
+in a cache. Expansion reads every directory it has to look into with a
+single os.scandir pass, ** followed by a last component is matched while
+walking the tree.
+"""
+import fnmatch
+import os
+import re
+from functools import lru_cache
+from os import path
+
+from lib.dircache import gDirCache
+
+gWildcardChars = re.compile(r"[*?]")
+# Stands for a ** component in compiled patterns
+gRecursive = object()
+
+
+def hasWildcards(word):
+    return gWildcardChars.search(word) is not None or ("{" in word and "," in word)
+
+
+def expandBraces(word):
+    """
+    Return the words made by expanding the first {a,b,...} group in word
+    (recursively). Groups without a comma at their top level are literal.
+    """
+    depth = 0
+    start = None
+    commas = []
+    for i, c in enumerate(word):
+        if c == "{":
+            if depth == 0:
+                start = i
+                commas = []
+            depth += 1
+        elif c == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                if commas:
+                    prefix, suffix = word[:start], word[i + 1:]
+                    bounds = [start] + commas + [i]
+                    result = []
+                    for j in range(len(bounds) - 1):
+                        alternative = word[bounds[j] + 1:bounds[j + 1]]
+                        result.extend(expandBraces(prefix + alternative + suffix))
+                    return result
+                # A literal group, look for one further on
+                tail = expandBraces(word[i + 1:])
+                return [word[:i + 1] + t for t in tail]
+        elif c == "," and depth == 1:
+            commas.append(i)
+    return [word]
+
+
+class Component:
+    """
+    A path component with wildcards, matching names with a regex.
+    """
+    __slots__ = ("match", "hidden")
+
+    def __init__(self, pattern):
+        self.match = re.compile(fnmatch.translate(pattern)).match
+        self.hidden = pattern.startswith(".")
+
+    def __call__(self, name):
+        return (self.hidden or not name.startswith(".")) and self.match(name) is not None
+
+
+@lru_cache(maxsize=256)
+def compilePattern(pattern):
+    """
+    Compile pattern into a tuple of alternatives (one per brace expansion),
+    each a (word, root, components) tuple. components holds plain strings
+    for literal components, gRecursive for ** and Components.
+    """
+    alternatives = []
+    for word in expandBraces(pattern):
+        root = "/" if word.startswith("/") else ""
+        components = []
+        for part in word.split("/"):
+            if not part:
+                continue
+            if part == "**":
+                if not components or components[-1] is not gRecursive:
+                    components.append(gRecursive)
+            elif gWildcardChars.search(part):
+                components.append(Component(part))
+            else:
+                components.append(part)
+        alternatives.append((word, root, tuple(components)))
+    return tuple(alternatives)
+
+
+def joinPath(base, name):
+    if not base:
+        return name
+    if base.endswith("/"):
+        return base + name
+    return base + "/" + name
+
+
+def listDir(base):
+    try:
+        return list(gDirCache.scanDir(base or "."))
+    except OSError:
+        return []
+
+
+def isDir(entry):
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+
+def walkDirs(base, match=None):
+    """
+    Return base and every directory below it (not following links or
+    entering hidden directories) and, if match is given, the paths of all
+    entries in them whose name it matches.
+    """
+    dirs = []
+    matches = []
+    stack = [base]
+    while stack:
+        current = stack.pop()
+        dirs.append(current)
+        try:
+            with os.scandir(current or ".") as it:
+                for entry in it:
+                    if match is not None and match(entry.name):
+                        matches.append(joinPath(current, entry.name))
+                    try:
+                        if not entry.name.startswith(".") and entry.is_dir(follow_symlinks=False):
+                            stack.append(joinPath(current, entry.name))
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+    return dirs, matches
+
+
+def expandComponents(root, components):
+    paths = [root]
+    literalOnly = True
+    last = len(components) - 1
+    i = 0
+
+    while i <= last and paths:
+        component = components[i]
+
+        if component is gRecursive:
+            literalOnly = False
+            if i == last:
+                # A trailing ** matches everything below
+                matches = []
+                for base in paths:
+                    matches.extend(walkDirs(base, lambda name: not name.startswith("."))[1])
+                return matches
+            if i + 1 == last and not isinstance(components[last], str):
+                # **/pattern, match while walking
+                matches = []
+                for base in paths:
+                    matches.extend(walkDirs(base, components[last])[1])
+                return matches
+            newPaths = []
+            for base in paths:
+                newPaths.extend(walkDirs(base)[0])
+            paths = newPaths
+
+        elif isinstance(component, str):
+            paths = [joinPath(base, component) for base in paths]
+            if not literalOnly:
+                paths = [p for p in paths if path.lexists(p)]
+
+        else:
+            literalOnly = False
+            newPaths = []
+            for base in paths:
+                for entry in listDir(base):
+                    if component(entry.name) and (i == last or isDir(entry)):
+                        newPaths.append(joinPath(base, entry.name))
+            paths = newPaths
+
+        i += 1
+
+    return paths
+
+
+def expandWildcards(pattern):
+    """
+    Return the list of words pattern expands to.
+    """
+    result = []
+    for word, root, components in compilePattern(pattern):
+        if all(isinstance(c, str) for c in components):
+            # Only braces, the word is used whether or not it exists
+            result.append(word)
+            continue
+        matches = expandComponents(root, components)
+        result.extend(sorted(matches) if matches else [word])
+    return result
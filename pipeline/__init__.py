@@ -0,0 +1,60 @@
+"""
+Helpers for passing results between the stages of a pipeline.
+
+A command in a pipeline receives the output of the previous stage as an
+iterator in context["input"] and may return an iterator (a stream) of its
+own, so items flow through ls | filter "*.py" | head 10 one at a time and
+stop being produced as soon as the last stage stops asking for them.
+"""
+import sys
+from collections.abc import Iterator
+
+
+def isStream(value):
+    return isinstance(value, Iterator)
+
+
+def asStream(value):
+    """
+    Return value as an iterator of items: streams are returned as they are,
+    lists and tuples are iterated, None is empty and anything else is a
+    single item.
+    """
+    if isStream(value):
+        return value
+    if value is None:
+        return iter(())
+    if isinstance(value, (list, tuple)):
+        return iter(value)
+    return iter((value,))
+
+
+def materialize(value):
+    """
+    Turn a stream into a list, any other value is returned unchanged.
+    """
+    if isStream(value):
+        return list(value)
+    return value
+
+
+def interpolate(value):
+    """
+    Return value as text to go inside a string: the items of a stream or a
+    list are put on a line each, anything else is converted with str().
+    """
+    value = materialize(value)
+    if isinstance(value, (list, tuple)):
+        return "\n".join(map(str, value))
+    return str(value)
+
+
+def guardStream(stream):
+    """
+    Wrap the stream returned by a command so an error raised while it is
+    being consumed is reported like an error raised by the command itself.
+    """
+    try:
+        yield from stream
+    except Exception as e:
+        print("ERROR: ({}) {}".format(type(e).__name__, e), file=sys.stderr)
@@ -0,0 +1,253 @@
+"""
+Background jobs ("statement &") and job control.
+
+Jobs run on a single asyncio event loop, started on a thread of its own
+when the first job is submitted, so the interpreter (and the REPL prompt)
+carry on while they run. Statements are evaluated on a small thread pool
+shared by all jobs, since internal commands are Python code which blocks.
+The programs of a statement ending in an external command are then waited
+on by the event loop without holding on to a thread.
+
+A job runs with its own copy of the context, so the variables and options
+it sets stay in the job and it sees them as they were when it started.
+Commands which change the whole process (cd, exit) refuse to run in a job,
+see checkForeground().
+
+As in jQuery's Deferred, done(), fail() and always() register callbacks
+which are called (on the event loop thread) when a job finishes, or at once
+if it already has.
+"""
+import sys
+import threading
+
+from pipeline import materialize
+from pipeline.process import Process
+from lib.exceptions import ArgumentError, BadExit
+
+
+class Job:
+    def __init__(self, jobId, source):
+        self.jobId = jobId
+        self.source = source
+        self.result = None
+        # The BadExits of failed programs or the exception which stopped an
+        # internal command
+        self.errors = []
+        self.finished = threading.Event()
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if not self.finished.is_set():
+            return "Running"
+        if not self.errors:
+            return "Done"
+        error = self.errors[-1]
+        if isinstance(error, BadExit):
+            return "Exit {}".format(error.exitCode)
+        return "Failed"
+
+    def complete(self, result, errors):
+        self.result = result
+        self.errors = errors
+        with self.lock:
+            self.finished.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for condition, fn in callbacks:
+            self.runCallback(condition, fn)
+
+    def runCallback(self, condition, fn):
+        if condition is None or condition == (not self.errors):
+            try:
+                fn(self)
+            except Exception as e:
+                print("ERROR: ({}) {}".format(type(e).__name__, e), file=sys.stderr)
+
+    def addCallback(self, condition, fn):
+        with self.lock:
+            if not self.finished.is_set():
+                self.callbacks.append((condition, fn))
+                return self
+        self.runCallback(condition, fn)
+        return self
+
+    def done(self, fn):
+        """
+        Call fn(job) when the job finishes without errors.
+        """
+        return self.addCallback(True, fn)
+
+    def fail(self, fn):
+        """
+        Call fn(job) when the job fails, job.errors says why.
+        """
+        return self.addCallback(False, fn)
+
+    def always(self, fn):
+        """
+        Call fn(job) when the job finishes.
+        """
+        return self.addCallback(None, fn)
+
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+    def reportErrors(self):
+        for e in self.errors:
+            if isinstance(e, BadExit):
+                print("ERROR: (BadExit) {}".format(e.msg), file=sys.stderr)
+            else:
+                print("ERROR: ({}) {}".format(type(e).__name__, e), file=sys.stderr)
+
+    def status(self):
+        return "[{}] {:<8} {}".format(self.jobId, self.state, self.source)
+
+    def __str__(self):
+        return "[{}] {}".format(self.jobId, self.source)
+
+    def __repr__(self):
+        return "Job({}, {!r}, {})".format(self.jobId, self.source, self.state)
+
+
+def jobContext(context, where="a background job"):
+    """
+    Return the copy of context a job runs with. where describes the job for
+    the errors of checkForeground().
+    """
+    copy = dict(context)
+    if "vars" in context:
+        copy["vars"] = context["vars"].copy()
+    if "exported_vars" in context:
+        copy["exported_vars"] = dict(context["exported_vars"])
+    if "options" in context:
+        copy["options"] = {name: list(stack) for name, stack in context["options"].items()}
+    copy["background"] = where
+    return copy
+
+
+def checkForeground(context, cmdName):
+    """
+    Raise ArgumentError if context is that of a background job (or an item
+    of parallel), for commands which change the state of the whole shell
+    process.
+    """
+    if context.get("background"):
+        raise ArgumentError("{} cannot be run in {}".format(cmdName, context["background"]))
+
+
+class JobTable:
+    def __init__(self, workers=4):
+        self.workers = workers
+        self.jobs = {}
+        # Finished jobs nobody has been told about yet
+        self.unreported = []
+        self.lock = threading.Lock()
+        self.loop = None
+        self.executor = None
+        self.tasks = set()
+
+    def startLoop(self):
+        # asyncio takes longer to import than the rest of the shell, it is
+        # only loaded once a job is started.
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+        threading.Thread(target=self.loop.run_forever, name="jobs", daemon=True).start()
+
+    def submit(self, fn, context, source, external=False):
+        """
+        Run fn on a copy of context (see jobContext) as a background job and
+        return the Job. If external is True fn returns a Process which has
+        not been started, which the event loop waits on.
+        """
+        import asyncio
+
+        context = jobContext(context)
+        with self.lock:
+            if self.loop is None:
+                self.startLoop()
+            jobId = max(self.jobs, default=0) + 1
+            job = self.jobs[jobId] = Job(jobId, source)
+
+        job.always(self.jobFinished)
+        asyncio.run_coroutine_threadsafe(self.run(job, fn, context, external), self.loop)
+        return job
+
+    async def run(self, job, fn, context, external):
+        import asyncio
+
+        # The event loop only keeps weak references to tasks and a task
+        # waiting on its own StreamReader is not referenced from anywhere
+        # else, so it has to be kept alive here.
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            # Even a statement ending in an external command may start with
+            # internal commands which take a while (du / | !cat)
+            evaluate = (lambda: fn(context)) if external else (lambda: materialize(fn(context)))
+            value = await self.loop.run_in_executor(self.executor, evaluate)
+            if isinstance(value, Process):
+                value, errors = await value.communicate()
+            else:
+                errors = []
+        except Exception as e:
+            value, errors = None, [e]
+        finally:
+            self.tasks.discard(task)
+        job.complete(value, errors)
+
+    def jobFinished(self, job):
+        with self.lock:
+            if job.jobId in self.jobs:
+                self.unreported.append(job)
+
+    def remove(self, job):
+        with self.lock:
+            self.jobs.pop(job.jobId, None)
+            if job in self.unreported:
+                self.unreported.remove(job)
+
+    def get(self, jobId=None):
+        """
+        Return the job jobId, the most recent one by default.
+        """
+        with self.lock:
+            if jobId is None:
+                if not self.jobs:
+                    raise ArgumentError("No current job")
+                jobId = max(self.jobs)
+            job = self.jobs.get(jobId)
+        if job is None:
+            raise ArgumentError("No such job {}".format(jobId))
+        return job
+
+    def collect(self, job):
+        """
+        Wait for job, take it off the table, report its errors and return
+        its result.
+        """
+        job.wait()
+        self.remove(job)
+        job.reportErrors()
+        return job.result
+
+    def list(self):
+        with self.lock:
+            return [self.jobs[jobId] for jobId in sorted(self.jobs)]
+
+    def takeFinished(self):
+        """
+        Return the jobs which finished since the last call and take them off
+        the table.
+        """
+        with self.lock:
+            jobs, self.unreported = self.unreported, []
+            for job in jobs:
+                self.jobs.pop(job.jobId, None)
+        return sorted(jobs, key=lambda job: job.jobId)
+
+
+gJobs = JobTable()
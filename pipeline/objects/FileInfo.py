@@ -1,9 +1,11 @@
 import os
+from collections import deque
 from os import path
 from datetime import datetime
 
 from .PipelineObject import PipelineObject
 from formatters.decorators import visible
+from lib.dircache import gDirCache
 
 
 def test():
@@ -12,10 +14,49 @@ def test():
 
 
 class FileInfo(PipelineObject):
-    def __init__(self, filePath):
+    """
+    Information about a file.
+
+    A FileInfo made from a path stats the file straight away. One made from
+    an os.DirEntry (see scanDir) only stats it the first time a field which
+    needs the stat data is read, and uses whatever the DirEntry has cached.
+    Both go through the directory cache in lib.dircache. The path is made
+    absolute when the FileInfo is created, so a later cd does not change the
+    file it refers to.
+
+    Printed on its own a FileInfo shows every field, see ListedFile for the
+    entries of a listing.
+    """
+    __slots__ = ("_filePath", "_dirEntry", "_stat")
+
+    def __init__(self, filePath, dirEntry=None):
         super().__init__()
         self._filePath = path.abspath(filePath)
-        self._statInfo = os.stat(self._filePath)
+        self._dirEntry = dirEntry
+        self._stat = None
+        if dirEntry is None:
+            self._stat = gDirCache.stat(filePath)
+
+    @classmethod
+    def fromDirEntry(cls, dirEntry, filePath=None):
+        return cls(filePath or dirEntry.path, dirEntry)
+
+    def loadStat(self):
+        if self._stat is None:
+            try:
+                self._stat = self._dirEntry.stat()
+            except FileNotFoundError:
+                # A dangling symlink, describe the link itself
+                self._stat = self._dirEntry.stat(follow_symlinks=False)
+        return self._stat
+
+    @property
+    def filePath(self):
+        return self._filePath
+
+    @property
+    def _statInfo(self):
+        return self._stat if self._stat is not None else self.loadStat()
 
     @visible()
     def creationTime(self):
@@ -48,10 +89,77 @@ class FileInfo(PipelineObject):
 
     @visible()
     def baseName(self):
+        if self._dirEntry is not None:
+            return self._dirEntry.name
         return path.basename(self._filePath)
 
     @visible()
     def dirName(self):
         return path.dirname(self._filePath)
-    
 
+    def __reduce__(self):
+        # DirEntries cannot be pickled (e.g. to send to another process),
+        # the copy stats the file again instead.
+        return type(self), (self._filePath,)
+
+
+class ListedFile(FileInfo):
+    """
+    A FileInfo produced by ls or find. Its text is the entry name, so
+    listings print and filter by name without any stat calls.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return self.baseName
+
+
+def _prefetchStat(info):
+    try:
+        info.loadStat()
+    except OSError:
+        pass  # Reported when the field is read
+
+
+def scanDir(target, statWorkers=None):
+    """
+    Yield a ListedFile for every entry in the directory target. Listings are
+    kept in the directory cache, so listing the same directory again does
+    not read it (or stat its entries) again until it has changed.
+
+    If statWorkers is given the entries are stat'ed ahead of the consumer by
+    a pool of that many threads (0 lets the pool pick a size), which hides
+    the latency of network file systems. The entries are still produced in
+    directory order and only a bounded number are read ahead.
+    """
+    entries = gDirCache.scanDir(target)
+    dirPath = path.abspath(target)
+    try:
+        infos = (ListedFile.fromDirEntry(entry, path.join(dirPath, entry.name)) for entry in entries)
+
+        if statWorkers is None:
+            yield from infos
+            return
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        workers = statWorkers or min(32, (os.cpu_count() or 1) + 4)
+        pool = ThreadPoolExecutor(workers)
+        readAhead = workers * 4
+        pending = deque()
+        try:
+            for info in infos:
+                pending.append((info, pool.submit(_prefetchStat, info)))
+                if len(pending) >= readAhead:
+                    info, future = pending.popleft()
+                    future.result()
+                    yield info
+
+            while pending:
+                info, future = pending.popleft()
+                future.result()
+                yield info
+        finally:
+            pool.shutdown(cancel_futures=True)
+    finally:
+        entries.close()
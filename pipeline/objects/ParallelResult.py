@@ -0,0 +1,41 @@
+from .PipelineObject import PipelineObject
+from formatters.decorators import visible
+
+
+class ParallelResult(PipelineObject):
+    """
+    What running the template of parallel for one item (its text, the path
+    of a file) produced: its output (the lines of an external command, the
+    result of an internal one) or why it failed.
+    """
+    __slots__ = ("_item", "_value", "_error")
+
+    def __init__(self, item, value=None, error=None):
+        super().__init__()
+        self._item = item
+        self._value = value
+        self._error = error
+
+    @property
+    def value(self):
+        return self._value
+
+    @visible()
+    def item(self):
+        return self._item
+
+    @visible()
+    def output(self):
+        value = self._value
+        if isinstance(value, list) and len(value) <= 1:
+            return value[0] if value else ""
+        return "" if value is None else value
+
+    @visible()
+    def error(self):
+        return self._error or ""
+
+    @visible()
+    def status(self):
+        return "failed" if self._error else "ok"
+
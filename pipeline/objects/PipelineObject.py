@@ -2,21 +2,40 @@ import re
 
 re1 = re.compile('([A-Z]+)')
 
+# Field schemas of PipelineObject subclasses, built on first use
+gSchemas = {}
+
+
+def fieldSchema(cls):
+    """
+    Return (template, getters) for rendering instances of cls. template has
+    a "Display name: <fmt>" line for every @visible property in name order
+    and getters are the matching property getters.
+    """
+    schema = gSchemas.get(cls)
+    if schema is not None:
+        return schema
+
+    lines = []
+    getters = []
+    for attrName in sorted(dir(cls)):
+        attr = getattr(cls, attrName)
+        if isinstance(attr, property) and getattr(attr.fget, "visible", False):
+            name = re1.sub(r' \1', attrName).lower().lstrip()
+            label = name[0].upper() + name[1:]
+            lines.append(label.replace("{", "{{").replace("}", "}}") + ": " + attr.fget.fmt + "\n")
+            getters.append(attr.fget)
+
+    schema = gSchemas[cls] = ("".join(lines), tuple(getters))
+    return schema
+
 
 class PipelineObject:
+    __slots__ = ()
+
     def __init__(self):
         pass
 
     def __repr__(self):
-        x = ""
-        for attrName in sorted(dir(type(self))):
-            attr = getattr(type(self), attrName)
-            try:
-                if attr.fget.visible:
-                    name = re1.sub(r' \1', attrName).lower().lstrip()
-                    x += ("{}{}: " + attr.fget.fmt + "\n").format(name[0].upper(),
-                                                                  name[1:],
-                                                                  getattr(self, attrName))
-            except AttributeError:
-                pass
-        return x
+        template, getters = fieldSchema(type(self))
+        return template.format(*[getter(self) for getter in getters])
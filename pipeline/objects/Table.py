@@ -0,0 +1,288 @@
+"""
+Columnar storage for pipeline results.
+
+A Table keeps every field of its rows in a column of its own. Integer,
+float and time (stored as a POSIX timestamp) columns are packed arrays,
+NumPy arrays if NumPy can be imported and array.array otherwise, so
+filtering, sorting and aggregating work on whole columns without creating
+an object per row.
+"""
+import fnmatch
+import operator
+import re
+from array import array
+from datetime import datetime
+
+from .PipelineObject import PipelineObject, fieldSchema
+from lib.exceptions import ArgumentError
+
+gTypeCodes = {"int": "q", "float": "d", "time": "d"}
+
+gCompareOps = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "lt": operator.lt,
+    "le": operator.le,
+    "gt": operator.gt,
+    "ge": operator.ge,
+}
+
+gAggregates = ("sum", "min", "max", "mean", "count")
+
+# The numpy module, False if it is not installed. Imported on first use,
+# importing it takes longer than starting the shell.
+gNumpy = None
+
+
+def getNumpy():
+    global gNumpy
+    if gNumpy is None:
+        try:
+            import numpy
+            gNumpy = numpy
+        except ImportError:
+            gNumpy = False
+    return gNumpy
+
+
+def columnKind(value):
+    if isinstance(value, bool):
+        return "object"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "float"
+    if isinstance(value, datetime):
+        return "time"
+    return "object"
+
+
+class Column:
+    """
+    The values of one field. kind is "int", "float", "time" or "object",
+    values is an array (or list for object columns) and fmt is the format
+    used to display a value.
+    """
+    __slots__ = ("name", "fmt", "kind", "values")
+
+    def __init__(self, name, fmt="{}", kind="object", values=None):
+        self.name = name
+        self.fmt = fmt
+        self.kind = kind
+        if values is None:
+            values = array(gTypeCodes[kind]) if kind in gTypeCodes else []
+        self.values = values
+
+    def append(self, value):
+        if self.kind == "time":
+            value = value.timestamp() if isinstance(value, datetime) else value
+        try:
+            self.values.append(value)
+        except (TypeError, OverflowError):
+            # Mixed types, keep the values as objects from now on
+            self.values = [self.toPython(v) for v in self.values]
+            self.kind = "object"
+            self.values.append(value)
+
+    def pack(self):
+        """
+        Switch a packed column over to NumPy when it is available.
+        """
+        numpy = getNumpy()
+        if numpy and isinstance(self.values, array):
+            self.values = numpy.frombuffer(self.values, dtype=self.values.typecode)
+        return self
+
+    def toPython(self, value):
+        if self.kind == "time":
+            return datetime.fromtimestamp(value)
+        if hasattr(value, "item"):
+            return value.item()  # A NumPy scalar
+        return value
+
+    def toValue(self, value):
+        """
+        Convert value (as typed in the shell) to what the column stores.
+        """
+        if self.kind == "time" and isinstance(value, str):
+            return datetime.fromisoformat(value).timestamp()
+        return value
+
+    def take(self, indices):
+        values = self.values
+        if getNumpy() and not isinstance(values, (list, array)):
+            return Column(self.name, self.fmt, self.kind, values[indices])
+        taken = [values[i] for i in indices]
+        if isinstance(values, array):
+            taken = array(values.typecode, taken)
+        return Column(self.name, self.fmt, self.kind, taken)
+
+    def format(self, value):
+        return self.fmt.format(self.toPython(value))
+
+    def __len__(self):
+        return len(self.values)
+
+
+class Table:
+    """
+    Rows of pipeline objects stored column by column.
+
+    A table built from no items has no columns, since there was no row to
+    read its fields from. It accepts any column name, as an empty column, so
+    queries on empty input (ls empty_dir | aggregate sum size) give an empty
+    result rather than an unknown column error.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    @classmethod
+    def fromObjects(cls, objects):
+        """
+        Build a table from an iterable of PipelineObjects of the same type,
+        with a column for every visible field. Anything else goes into a
+        single column named value.
+        """
+        objects = iter(objects)
+        first = next(objects, None)
+        if first is None:
+            return cls([])
+
+        rowType = type(first)
+        if isinstance(first, PipelineObject):
+            template, getters = fieldSchema(rowType)
+            names = [getter.__name__ for getter in getters]
+            formats = [getter.fmt for getter in getters]
+        else:
+            getters = (lambda x: x,)
+            names = ["value"]
+            formats = ["{}"]
+
+        values = [getter(first) for getter in getters]
+        columns = [Column(name, fmt, columnKind(value)) for name, fmt, value in zip(names, formats, values)]
+        appends = [column.append for column in columns]
+        for append, value in zip(appends, values):
+            append(value)
+
+        for obj in objects:
+            if type(obj) is not rowType:
+                raise ArgumentError("Cannot put {} and {} rows in one table".format(rowType.__name__,
+                                                                                  type(obj).__name__))
+            for append, getter in zip(appends, getters):
+                append(getter(obj))
+
+        return cls([column.pack() for column in columns])
+
+    @classmethod
+    def fromStream(cls, stream):
+        """
+        Return the table piped in as stream, or build one from its items.
+        """
+        items = iter(stream)
+        first = next(items, None)
+        if isinstance(first, Table):
+            return first
+        if first is None:
+            return cls([])
+
+        def rows():
+            yield first
+            yield from items
+
+        return cls.fromObjects(rows())
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def column(self, name):
+        for column in self.columns:
+            if column.name == name:
+                return column
+        if not self.columns:
+            return Column(name)
+        raise ArgumentError("Unknown column {}".format(repr(name)))
+
+    def take(self, indices):
+        return Table([column.take(indices) for column in self.columns])
+
+    def filter(self, name, op, value):
+        """
+        Keep the rows whose value in column name compares to value with op,
+        one of the keys of gCompareOps or "like" for a wildcard match.
+        """
+        column = self.column(name)
+        value = column.toValue(value)
+        values = column.values
+
+        if op == "like":
+            match = re.compile(fnmatch.translate(str(value))).match
+            indices = [i for i, v in enumerate(values) if match(str(column.toPython(v)))]
+            return self.take(indices)
+
+        compare = gCompareOps.get(op)
+        if compare is None:
+            raise ArgumentError("Unknown comparison {}".format(repr(op)))
+
+        numpy = getNumpy()
+        if numpy and not isinstance(values, (list, array)):
+            return self.take(numpy.nonzero(compare(values, value))[0])
+        return self.take([i for i, v in enumerate(values) if compare(v, value)])
+
+    def sort(self, name, reverse=False):
+        values = self.column(name).values
+        numpy = getNumpy()
+        if numpy and not isinstance(values, (list, array)):
+            indices = numpy.argsort(-values if reverse else values, kind="stable")
+        else:
+            indices = sorted(range(len(values)), key=values.__getitem__, reverse=reverse)
+        return self.take(indices)
+
+    def project(self, names):
+        if not self.columns:
+            return self
+        return Table([self.column(name) for name in names])
+
+    def aggregate(self, fn, name):
+        column = self.column(name)
+        values = column.values
+
+        if fn == "count":
+            return len(values)
+        if fn not in gAggregates:
+            raise ArgumentError("Unknown aggregate {}".format(repr(fn)))
+        if not len(values):
+            return None
+
+        if getNumpy() and not isinstance(values, (list, array)):
+            result = getattr(values, fn)()
+        elif fn == "mean":
+            result = sum(values) / len(values)
+        else:
+            result = {"sum": sum, "min": min, "max": max}[fn](values)
+
+        if fn in ("min", "max", "mean"):
+            return column.toPython(result)
+        return result.item() if hasattr(result, "item") else result
+
+    def rows(self):
+        """
+        Yield every row as a tuple of Python values.
+        """
+        columns = self.columns
+        for i in range(len(self)):
+            yield tuple(column.toPython(column.values[i]) for column in columns)
+
+    def __str__(self):
+        if not self.columns:
+            return ""
+
+        texts = [[column.name] + [column.format(v) for v in column.values] for column in self.columns]
+        widths = [max(map(len, text)) for text in texts]
+        lines = []
+        for row in zip(*texts):
+            lines.append("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return "Table(columns={}, rows={})".format([column.name for column in self.columns], len(self))
@@ -0,0 +1,269 @@
+"""
+Running a command template once for every item of a stream (parallel).
+
+The template is a command or a pipeline in which every {} is replaced by
+the item (or, if there is no {}, the item is passed as the last argument),
+e.g. "!gzip -k {}" or "!grep -c TODO {} | !head -1". It is parsed and
+compiled once, its placeholders read the item from the context.
+
+Every item runs with its own copy of the context (as background jobs do,
+see pipeline.jobs), so variables set by one item do not reach the shell or
+the other items, and commands changing the whole process (cd, exit) refuse
+to run.
+
+Items run on a pool of threads or, for templates of internal commands
+which keep the CPU busy, of processes forked from the shell. Only a bounded
+number of items are taken from the input ahead of the consumer, so the
+input may be endless and "| head 3" stops the work early. Every item gives
+a ParallelResult holding its output or, if it failed, the error, so one
+failing item does not stop the others.
+"""
+import os
+import sys
+from collections import deque
+
+from interpreter.ASG import Command, Pipeline, Glob, String
+from interpreter.compiler import compileArgs
+from lib.exceptions import BadCommand, BadExit
+from lib.logger import isTracing
+from lib.wildcards import expandWildcards
+from pipeline import asStream, materialize
+from pipeline.jobs import jobContext
+from pipeline.objects.FileInfo import FileInfo
+from pipeline.objects.ParallelResult import ParallelResult
+from pipeline.process import Process, childEnv, findExternal, toArgv
+from pipeline.walk import defaultWorkers
+
+# The template and context of a forked worker process
+gWorkerState = None
+
+
+def hasPlaceholder(node):
+    commands = node.commands if isinstance(node, Pipeline) else [node]
+    for command in commands:
+        for arg in command.args:
+            if isinstance(arg, str) and "{}" in arg:
+                return True
+            if isinstance(arg, Glob) and "{}" in arg.pattern:
+                return True
+            if isinstance(arg, String) and any(isinstance(part, str) and "{}" in part for part in arg.parts):
+                return True
+    return False
+
+
+class Item:
+    """
+    What a {} in the template stands for: the text of the item being run,
+    which every item finds in its own context.
+    """
+
+    def __call__(self, context):
+        return context["item"]
+
+    def __repr__(self):
+        return "Item()"
+
+
+gItem = Item()
+
+
+class ItemGlob(Glob):
+    """
+    An unquoted word with wildcards and a {}, expanded once the item is
+    known.
+    """
+
+    def __call__(self, context):
+        return expandWildcards(self.pattern.replace("{}", context["item"]))
+
+
+def splitText(text):
+    # "data/{}.txt" -> ["data/", gItem, ".txt"]
+    parts = []
+    for i, piece in enumerate(text.split("{}")):
+        if i:
+            parts.append(gItem)
+        if piece:
+            parts.append(piece)
+    return parts
+
+
+def bindString(node):
+    # Literal text is split into parts, join runs of it so a {} split
+    # across two parts is found
+    parts = []
+    for part in node.parts:
+        if isinstance(part, str) and parts and isinstance(parts[-1], str):
+            parts[-1] += part
+        else:
+            parts.append(part)
+    return String([piece for part in parts for piece in (splitText(part) if isinstance(part, str) else [part])])
+
+
+def bindArg(arg):
+    if isinstance(arg, str) and "{}" in arg:
+        parts = splitText(arg)
+        return parts[0] if parts == [gItem] else String(parts)
+    if isinstance(arg, Glob) and "{}" in arg.pattern:
+        return ItemGlob(arg.pattern)
+    if isinstance(arg, String):
+        return bindString(arg)
+    return arg
+
+
+def compileTemplate(template, append=False):
+    """
+    Compile template once for all the items. Every {} in its arguments
+    stands for the item or, if append is True, the item is added as the last
+    argument of the (last) command instead. Returns (Command, evalArgs) for
+    every command of the template, see interpreter.compiler.compileArgs.
+    """
+    commands = template.commands if isinstance(template, Pipeline) else [template]
+    compiled = []
+    for command in commands:
+        args = [bindArg(arg) for arg in command.args]
+        if append and command is commands[-1]:
+            args.append(gItem)
+        node = Command(command.cmdName, args + command.flags, command.external)
+        compiled.append((node, compileArgs(node, isTracing("eval"))))
+    return compiled
+
+
+def runCommand(command, evalArgs, context, input=None):
+    """
+    Run a compiled command of a template like the compiled code of a
+    statement does, except that errors are raised instead of being
+    reported.
+    """
+    args = evalArgs(context)
+    if command.external:
+        env = childEnv(context)
+        executable = findExternal(command.cmdName, env)
+        if executable is None:
+            raise BadCommand("!" + command.cmdName)
+        return Process([command.cmdName] + toArgv(args), input, env, executable)
+
+    try:
+        cmd = context["vars"][command.cmdName]
+    except KeyError:
+        raise BadCommand(command.cmdName) from None
+    if input is not None:
+        context = dict(context, input=input)
+    return cmd(args, command.flags, context)
+
+
+def errorText(e):
+    return "({}) {}".format(type(e).__name__, e.msg if isinstance(e, BadExit) else e)
+
+
+def itemText(item):
+    # Files stand for their path, which the template can open wherever it
+    # runs, rather than their name
+    return item.filePath if isinstance(item, FileInfo) else str(item)
+
+
+def runItem(compiled, context, item):
+    """
+    Run the compiled template for item, with a context of its own, and
+    return the ParallelResult.
+    """
+    item = itemText(item)
+    context = jobContext(context, "parallel")
+    context["item"] = item
+    try:
+        result = runCommand(*compiled[0], context)
+        for command, evalArgs in compiled[1:]:
+            result = runCommand(command, evalArgs, context, asStream(result))
+        if isinstance(result, Process):
+            value, errors = result.collect()
+            if errors:
+                raise errors[-1]
+        else:
+            value = materialize(result)
+    except Exception as e:
+        return ParallelResult(item, error=errorText(e))
+    return ParallelResult(item, value)
+
+
+def setWorkerState(state):
+    global gWorkerState
+    gWorkerState = state
+
+
+def runWorkerItem(item):
+    return runItem(*gWorkerState, item)
+
+
+def processPool(workers, state):
+    """
+    Return a pool of workers processes forked from the shell. Each one
+    inherits state (the compiled template and context, most of which
+    cannot be pickled) instead of being sent it.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Output still buffered would be written again by every worker
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return ProcessPoolExecutor(workers, multiprocessing.get_context("fork"),
+                               initializer=setWorkerState, initargs=(state,))
+
+
+def parallel(template, items, context, workers=None, ordered=True, processes=False):
+    """
+    Yield a ParallelResult for every item of the stream items, running
+    template for workers items at a time. Results come in the order of the
+    items if ordered is True, otherwise as soon as they are ready.
+    """
+    compiled = compileTemplate(template, append=not hasPlaceholder(template))
+
+    if processes:
+        workers = workers or os.cpu_count() or 1
+        pool = processPool(workers, (compiled, context))
+
+        def submit(item):
+            return pool.submit(runWorkerItem, item)
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+
+        workers = workers or defaultWorkers()
+        pool = ThreadPoolExecutor(workers, thread_name_prefix="parallel")
+
+        def submit(item):
+            return pool.submit(runItem, compiled, context, item)
+
+    def result(item, future):
+        try:
+            return future.result()
+        except Exception as e:
+            # The item or its result could not be sent between processes
+            return ParallelResult(itemText(item), error=errorText(e))
+
+    readAhead = workers * 2
+    try:
+        if ordered:
+            pending = deque()
+            for item in items:
+                pending.append((item, submit(item)))
+                if len(pending) >= readAhead:
+                    yield result(*pending.popleft())
+            while pending:
+                yield result(*pending.popleft())
+        else:
+            from concurrent.futures import wait, FIRST_COMPLETED
+
+            pending = {}
+            items = iter(items)
+            while True:
+                for item in items:
+                    pending[submit(item)] = item
+                    if len(pending) >= readAhead:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield result(pending.pop(future), future)
+    finally:
+        pool.shutdown(cancel_futures=True)
@@ -0,0 +1,345 @@
+"""
+External commands (!cmd) as pipeline stages.
+
+A Process is a stream of the lines an external program writes to its
+standard output. The program is started when the first line is asked for
+and stopped if the consumer stops reading early (e.g. "!yes | head 3").
+
+Adjacent external commands are connected directly: a Process whose input
+is another Process which has not started yet starts it with its standard
+output going into a pipe and passes the read end on as its own standard
+input, so "!cat big.log | !grep x | !sort" never copies a byte through
+the interpreter. Where the interpreter does sit in the middle the data is
+moved in blocks: output is read and decoded a block of lines at a time,
+items piped in are written in batches and output which is only printed is
+spliced straight to the output file descriptor.
+"""
+import itertools
+import os
+import sys
+import threading
+
+from lib.exceptions import BadExit
+from lib.pathhash import gPathHash
+
+# Size of the pipes external commands write to, and of the blocks copied
+# from them with splice
+gPipeSize = 1 << 20
+# Output split into lines is read and decoded in blocks of this size, larger
+# blocks fall out of the CPU caches before their lines are used
+gBlockSize = 1 << 16
+# Items piped into an external command are written this many at a time
+gWriteBatch = 4096
+
+
+def childEnv(context):
+    """
+    Return the environment for child processes, the shell's own environment
+    plus every exported variable.
+    """
+    env = dict(os.environ)
+    for name in context["exported_vars"]:
+        value = context["vars"].get(name)
+        if value is not None:
+            env[name] = str(value)
+    return env
+
+
+def toArgv(args):
+    """
+    Turn evaluated command arguments into strings. Lists (e.g. the lines of
+    a command substitution) become one argument per item.
+    """
+    argv = []
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            argv.extend(str(x) for x in arg)
+        else:
+            argv.append(str(arg))
+    return argv
+
+
+def findExternal(name, env):
+    """
+    Return the executable for the external command name (through the PATH
+    hash table) or None if there is none.
+    """
+    return gPathHash.lookup(name, env.get("PATH", os.defpath))
+
+
+def reportError(e):
+    print("ERROR: ({}) {}".format(type(e).__name__, e), file=sys.stderr)
+
+
+def growPipe(fd):
+    """
+    Make the pipe fd gPipeSize bytes long (where the platform allows), so
+    the programs on either end switch between reading and writing less
+    often than with the default 64 KiB.
+    """
+    try:
+        import fcntl
+        fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, gPipeSize)
+    except (ImportError, AttributeError, OSError):
+        pass
+
+
+def copyFd(src, dst):
+    """
+    Copy everything from the pipe src to dst. os.splice moves the data
+    inside the kernel, file descriptors it does not support (and platforms
+    without it) fall back to large reads and writes.
+    """
+    splice = getattr(os, "splice", None)
+    if splice is not None:
+        try:
+            while splice(src, dst, gPipeSize):
+                pass
+            return
+        except OSError:
+            # EINVAL: dst does not support splicing. Nothing has been
+            # consumed from src by the failed call.
+            pass
+
+    while True:
+        data = os.read(src, gPipeSize)
+        if not data:
+            return
+        view = memoryview(data)
+        while view:
+            view = view[os.write(dst, view):]
+
+
+class Process:
+    def __init__(self, argv, input=None, env=None, executable=None):
+        self.argv = argv
+        self.executable = executable
+        self.input = input
+        self.env = env
+        self.encoding = None
+        self.popen = None
+        # The Process whose standard output is connected to our input
+        self.upstream = None
+        self.feeder = None
+        self.lines = None
+        self.done = False
+        # Whether finish() reports the programs which failed, see collect()
+        self.report = True
+        self.errors = []
+
+    def start(self, piped=False):
+        """
+        Start the program. If piped is True its output will be read by
+        another process instead of by iterating over it.
+        """
+        # subprocess and locale take a noticeable part of startup time to
+        # import, most sessions never run an external command.
+        import locale
+        import subprocess
+
+        self.encoding = locale.getpreferredencoding(False)
+
+        stdin = subprocess.DEVNULL
+        if isinstance(self.input, Process) and self.input.popen is None and not self.input.done:
+            upstream = self.input
+            upstream.start(piped=True)
+            if upstream.popen is not None:
+                self.upstream = upstream
+                stdin = upstream.popen.stdout
+        elif self.input is not None:
+            stdin = subprocess.PIPE
+
+        try:
+            self.popen = subprocess.Popen(self.argv, executable=self.executable, stdin=stdin,
+                                          stdout=subprocess.PIPE, env=self.env)
+        except OSError as e:
+            self.done = True
+            reportError(e)
+            self.closeUpstream()
+            return
+        finally:
+            if self.upstream is not None:
+                # Only the child holds the read end of the pipe now, so the
+                # upstream program gets SIGPIPE if it exits.
+                self.upstream.popen.stdout.close()
+
+        growPipe(self.popen.stdout.fileno())
+
+        if stdin is subprocess.PIPE:
+            self.feeder = threading.Thread(target=self.feed, daemon=True)
+            self.feeder.start()
+        if piped:
+            # Finished as far as we are concerned, the downstream Process
+            # waits for it.
+            self.done = True
+
+    def feed(self):
+        stdin = self.popen.stdin
+        items = iter(self.input)
+        try:
+            while True:
+                batch = list(itertools.islice(items, gWriteBatch))
+                if not batch:
+                    break
+                batch.append("")
+                stdin.write("\n".join(map(str, batch)).encode(self.encoding, "replace"))
+        except (BrokenPipeError, ValueError):
+            pass  # The program exited (or was stopped) without reading it all
+        except Exception as e:
+            reportError(e)
+        finally:
+            try:
+                stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def readBlocks(self):
+        """
+        Start the program if needed and yield its output as lists of lines
+        (without line endings), decoding a block of whole lines at a time.
+        """
+        if self.popen is None and not self.done:
+            self.start()
+        if self.done:
+            return
+
+        fd = self.popen.stdout.fileno()
+        encoding = self.encoding
+        tail = b""
+        while True:
+            data = os.read(fd, gBlockSize)
+            if not data:
+                break
+            end = data.rfind(b"\n")
+            if end < 0:
+                tail += data
+                continue
+            block = tail + data[:end] if tail else data[:end]
+            tail = data[end + 1:]
+            yield block.decode(encoding, "replace").split("\n")
+        if tail:
+            yield [tail.decode(encoding, "replace")]
+
+        self.finish()
+
+    def __iter__(self):
+        # Lines are handed out by itertools.chain so that going through them
+        # runs no Python code per line.
+        if self.lines is None:
+            self.lines = itertools.chain.from_iterable(self.readBlocks())
+        return self.lines
+
+    def __next__(self):
+        return next(iter(self))
+
+    def copyTo(self, fd):
+        """
+        Write the program's output to the file descriptor fd unchanged,
+        instead of iterating over its lines (so, as in bash, output which
+        does not end with a newline is not given one).
+        """
+        if self.popen is None and not self.done:
+            self.start()
+        if self.done:
+            return
+        copyFd(self.popen.stdout.fileno(), fd)
+        self.finish()
+
+    def finish(self):
+        self.done = True
+        self.popen.stdout.close()
+        self.popen.wait()
+        self.errors = self.exitErrors()
+        if self.report:
+            for e in self.errors:
+                print("ERROR: (BadExit) {}".format(e.msg), file=sys.stderr)
+
+    def collect(self):
+        """
+        Run the program to the end and return its lines of output and
+        exitErrors(), which are returned instead of being reported.
+        """
+        self.report = False
+        return list(self), self.errors
+
+    def exitErrors(self):
+        """
+        Wait for the program and the programs before it in the pipeline to
+        exit and return a BadExit for every one which failed. Programs
+        killed by SIGPIPE because the next one stopped reading did not fail.
+        """
+        import signal
+
+        errors = []
+        processes = []
+        process = self
+        while process is not None:
+            processes.append(process)
+            process = process.upstream
+
+        # Programs earlier in the pipeline are reported first
+        for process in processes[1:] + processes[:1]:
+            exitCode = process.popen.wait()
+            if process.feeder is not None:
+                process.feeder.join()
+            if exitCode != 0 and (process is self or exitCode != -signal.SIGPIPE):
+                errors.append(BadExit(exitCode, "{} exited with status {}".format(process.argv[0], exitCode)))
+        return errors
+
+    async def communicate(self):
+        """
+        Run the program from an asyncio event loop, returning its lines of
+        output and exitErrors(). No thread waits on it while it runs.
+        """
+        import asyncio
+
+        if self.popen is None and not self.done:
+            self.start()
+        if self.done:
+            return [], []
+        self.done = True
+
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=gPipeSize)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), self.popen.stdout)
+        data = await reader.read()
+
+        # Output ends when the programs exit (or close it just before), there
+        # is no child watcher to wait on so poll for their exit.
+        process = self
+        while process is not None:
+            while process.popen.poll() is None:
+                await asyncio.sleep(0.01)
+            process = process.upstream
+
+        text = data.decode(self.encoding, "replace")
+        if text.endswith("\n"):
+            text = text[:-1]
+        return text.split("\n") if text else [], self.exitErrors()
+
+    def close(self):
+        """
+        Stop the program if it is still running, without reporting its exit
+        status.
+        """
+        if self.popen is not None and not self.done:
+            self.done = True
+            self.popen.stdout.close()
+            if self.popen.poll() is None:
+                self.popen.terminate()
+            self.popen.wait()
+            self.closeUpstream()
+
+    def closeUpstream(self):
+        process = self.upstream or (self.input if isinstance(self.input, Process) else None)
+        while process is not None:
+            if process.popen is not None and process.popen.poll() is None:
+                process.popen.terminate()
+                process.popen.wait()
+            process = process.upstream
+
+    def __del__(self):
+        self.close()
+
+    def __repr__(self):
+        return "Process({})".format(self.argv)
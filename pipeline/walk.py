@@ -0,0 +1,169 @@
+"""
+Recursive directory traversal for find and du.
+
+walk() lists directories on a pool of threads sharing a queue of
+directories still to be listed. os.scandir and stat release the GIL while
+they wait on the file system, so on network file systems and SSDs several
+directories are read at the same time.
+"""
+import os
+import queue
+import sys
+import threading
+
+from .objects.FileInfo import ListedFile
+
+
+def defaultWorkers():
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+class _Done:
+    pass
+
+
+class Walk:
+    """
+    The state of one traversal, shared by its worker threads.
+
+    An entry at depth 1 is directly in root. A directory is only descended
+    into if it is shallower than maxDepth and prune(entry) is false.
+    Symbolic links to directories are only followed if followLinks is set,
+    in which case every directory is entered at most once so link loops end.
+    """
+
+    def __init__(self, root, maxDepth=None, prune=None, followLinks=False):
+        self.root = root
+        self.maxDepth = maxDepth
+        self.prune = prune
+        self.followLinks = followLinks
+        self.seen = set()
+        self.seenLock = threading.Lock()
+        if followLinks:
+            st = os.stat(root)
+            self.seen.add((st.st_dev, st.st_ino))
+
+    def descend(self, entry, depth):
+        try:
+            if not entry.is_dir(follow_symlinks=self.followLinks):
+                return False
+        except OSError:
+            return False
+
+        if self.maxDepth is not None and depth >= self.maxDepth:
+            return False
+        if self.prune is not None and self.prune(entry):
+            return False
+
+        if self.followLinks:
+            try:
+                st = entry.stat()
+            except OSError:
+                return False
+            key = (st.st_dev, st.st_ino)
+            with self.seenLock:
+                if key in self.seen:
+                    return False
+                self.seen.add(key)
+
+        return True
+
+    def scan(self, path, depth, visit, enqueue):
+        """
+        List one directory, returning visit(entry) for its entries and
+        passing every directory to descend into to enqueue(path, depth).
+        """
+        batch = []
+        with os.scandir(path) as it:
+            for entry in it:
+                batch.append(visit(entry))
+                if self.descend(entry, depth):
+                    enqueue(entry.path, depth + 1)
+        return batch
+
+
+def reportError(e):
+    print("ERROR: ({}) {}".format(type(e).__name__, e), file=sys.stderr)
+
+
+def walk(root, maxDepth=None, prune=None, followLinks=False, workers=None, visit=ListedFile.fromDirEntry):
+    """
+    Yield visit(entry) for every entry below root. visit runs on the worker
+    threads (e.g. to stat entries in parallel) and defaults to building a
+    ListedFile. With workers=1 the tree is walked on the calling thread.
+
+    Entries come out in no particular order. Directories which cannot be
+    read are reported on stderr and skipped.
+    """
+    state = Walk(root, maxDepth, prune, followLinks)
+
+    if workers == 1:
+        stack = [(root, 1)]
+        while stack:
+            path, depth = stack.pop()
+            try:
+                batch = state.scan(path, depth, visit, lambda p, d: stack.append((p, d)))
+            except OSError as e:
+                reportError(e)
+                continue
+            yield from batch
+        return
+
+    workers = workers or defaultWorkers()
+    tasks = queue.SimpleQueue()
+    # Bounded so a slow consumer (or one which stopped) holds up the workers
+    results = queue.Queue(maxsize=workers * 4)
+    stop = threading.Event()
+    pendingLock = threading.Lock()
+    pending = [1]
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def enqueue(path, depth):
+        with pendingLock:
+            pending[0] += 1
+        tasks.put((path, depth))
+
+    def worker():
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            try:
+                if not stop.is_set():
+                    put(state.scan(task[0], task[1], visit, enqueue))
+            except Exception as e:
+                put(e)
+            finally:
+                with pendingLock:
+                    pending[0] -= 1
+                    done = pending[0] == 0
+                if done:
+                    put(_Done)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    tasks.put((root, 1))
+
+    try:
+        while True:
+            batch = results.get()
+            if batch is _Done:
+                break
+            if isinstance(batch, Exception):
+                if not isinstance(batch, OSError):
+                    raise batch
+                reportError(batch)
+                continue
+            yield from batch
+    finally:
+        stop.set()
+        for _ in threads:
+            tasks.put(None)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""runtests
+
+Run the scripts in tests/ and compare their output (stdout and stderr
+together) with tests/reference_output/<script>.txt.
+
+The interpreter is initialised once, here. Every *.ush script then runs in
+a child forked from it, which starts from a copy of the warm interpreter
+and context the way a request to unishell --server does; *.sh scripts are
+executed as they are. Up to JOBS scripts run at the same time. Outputs are
+compared in memory, the output of a failed script is also written to
+tests/output/<script>.txt. A script without a reference file has its
+output copied there. The scripts use tests/output/cache as their cache
+directory (XDG_CACHE_HOME), so they neither use nor replace the user's
+parse cache and context snapshot.
+
+With --repeat the suite is run N times and the median and fastest wall
+time of every script are reported, which makes it a regression benchmark.
+
+Usage:
+  runtests [--jobs=JOBS] [--repeat=N] [TEST ...]
+  runtests (-h | --help)
+
+Options:
+  --jobs=JOBS        Scripts run at the same time (default: number of CPUs)
+  --repeat=N         Run the suite N times [default: 1]
+  -h --help          Show this screen.
+  TEST               Scripts to run, by name (default: all of them)
+"""
+
+import difflib
+import os
+import statistics
+import sys
+import tempfile
+import time
+from os import path
+
+from docopt import docopt
+
+import unishell
+
+gRoot = path.dirname(path.abspath(__file__))
+gTestsDir = path.join(gRoot, "tests")
+gRefDir = path.join(gTestsDir, "reference_output")
+gOutputDir = path.join(gTestsDir, "output")
+
+
+def findTests(names):
+    if names:
+        return [path.basename(name) for name in names]
+    return sorted(name for name in os.listdir(gTestsDir) if name.endswith((".ush", ".sh")))
+
+
+def runScript(name):
+    """
+    Run the test script name in this (forked) process, which never returns.
+    """
+    status = 1
+    try:
+        if name.endswith(".sh"):
+            os.execv(path.join(gTestsDir, name), [name])
+
+        try:
+            status = unishell.serveRequest([name])
+        except SystemExit as e:
+            if isinstance(e.code, str):
+                print(e.code, file=sys.stderr)
+                status = 1
+            else:
+                status = e.code or 0
+    except Exception as e:
+        print("ERROR: ({}) {}".format(type(e).__name__, e), file=sys.stderr)
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # Do not run our exit handlers (or flush the runner's buffers)
+        os._exit(status & 0xFF)
+
+
+def start(name):
+    """
+    Fork a child running the test script name with its output going to a
+    temporary file. Returns the child's pid and the file.
+    """
+    output = tempfile.TemporaryFile()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            devNull = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(devNull, 0)
+            os.dup2(output.fileno(), 1)
+            os.dup2(output.fileno(), 2)
+            sys.stdin = open(0, "r", closefd=False)
+            sys.stdout = open(1, "w", closefd=False)
+            sys.stderr = open(2, "w", buffering=1, closefd=False)
+        except BaseException:
+            os._exit(1)
+        runScript(name)
+    return pid, output
+
+
+def runSuite(names, jobs):
+    """
+    Run the scripts names, at most jobs at a time, and return their
+    outputs and wall times by name.
+    """
+    pending = list(reversed(names))
+    running = {}
+    outputs = {}
+    times = {}
+
+    while pending or running:
+        while pending and len(running) < jobs:
+            name = pending.pop()
+            pid, output = start(name)
+            running[pid] = (name, output, time.perf_counter())
+
+        pid, _ = os.wait()
+        if pid not in running:
+            continue
+        name, output, started = running.pop(pid)
+        times[name] = time.perf_counter() - started
+        output.seek(0)
+        outputs[name] = output.read().decode("utf-8", "replace")
+        output.close()
+
+    return outputs, times
+
+
+def check(name, output):
+    """
+    Compare output with the reference output of name, returning None when
+    they are the same (or there is no reference yet) or the unified diff.
+    """
+    refPath = path.join(gRefDir, name + ".txt")
+    try:
+        with open(refPath, "r", encoding="utf-8") as f:
+            reference = f.read()
+    except FileNotFoundError:
+        print("Reference file for test {} does not exist, copying current output to the {} folder."
+              .format(name, path.relpath(gRefDir)))
+        with open(refPath, "w", encoding="utf-8") as f:
+            f.write(output)
+        return None
+
+    if output == reference:
+        return None
+
+    outputPath = path.join(gOutputDir, name + ".txt")
+    with open(outputPath, "w", encoding="utf-8") as f:
+        f.write(output)
+    return "".join(difflib.unified_diff(reference.splitlines(True), output.splitlines(True),
+                                        path.relpath(refPath), path.relpath(outputPath)))
+
+
+def main(args):
+    jobs = int(args['--jobs'] or os.cpu_count() or 1)
+    repeat = int(args['--repeat'])
+    names = findTests(args['TEST'])
+
+    os.chdir(gTestsDir)
+    os.environ["PATH"] = os.environ.get("PATH", "") + os.pathsep + gRoot
+    os.environ["XDG_CACHE_HOME"] = path.join(gOutputDir, "cache")
+    os.makedirs(gOutputDir, exist_ok=True)
+    os.makedirs(gRefDir, exist_ok=True)
+
+    start = time.perf_counter()
+    unishell.initContext()
+    print("Initialised the interpreter in {:.1f} ms".format((time.perf_counter() - start) * 1000))
+
+    outputs = {}
+    times = {name: [] for name in names}
+    roundTimes = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        outputs, roundResult = runSuite(names, jobs)
+        roundTimes.append(time.perf_counter() - start)
+        for name, seconds in roundResult.items():
+            times[name].append(seconds)
+
+    # Outputs of the last round are checked
+    failed = 0
+    for name in names:
+        diff = check(name, outputs[name])
+        median = statistics.median(times[name]) * 1000
+        if repeat > 1:
+            timing = "median {:8.1f} ms  min {:8.1f} ms".format(median, min(times[name]) * 1000)
+        else:
+            timing = "{:8.1f} ms".format(median)
+        print("{:<4} {:<28} {}".format("PASS" if diff is None else "FAIL", name, timing))
+        if diff is not None:
+            failed += 1
+            print(diff, end="")
+
+    print("{} tests, {} failed, {} jobs, suite median {:.2f} s".format(len(names), failed, jobs,
+                                                                      statistics.median(roundTimes)))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(docopt(__doc__)))
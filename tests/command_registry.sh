@@ -0,0 +1,46 @@
+#!/bin/bash
+
+(cd .. && python3 -m lib.registry --check)
+
+SITE=$(mktemp -d)
+cat > "$SITE/sitecommands.py" <<'PY'
+print("sitecommands imported")
+
+
+def cmdGreet(args, flags, context):
+    """
+    Greet someone. Declared in a site manifest.
+    """
+    return "Hello " + " ".join(map(str, args))
+PY
+cat > "$SITE/site.manifest" <<'MANIFEST'
+# Site commands
+greet  sitecommands:cmdGreet  Greet someone.
+MANIFEST
+
+export PYTHONPATH=$SITE
+export UNISHELL_COMMANDS=$SITE/site.manifest
+
+# Site commands are listed without importing them and imported when called
+unishell --no-cache -c help | grep "greet\|imported"
+unishell --no-cache -c 'greet world' -c 'greet again'
+
+# Broken manifests are reported and skipped
+echo "broken" > "$SITE/broken.manifest"
+UNISHELL_COMMANDS=$SITE/broken.manifest:$SITE/missing.manifest:$SITE/site.manifest unishell --no-cache -c 'greet anyway' 2>&1 | sed "s#$SITE#SITE#g"
+
+# With the context snapshot on too, a missing manifest is skipped and a
+# manifest which appears later is picked up
+export XDG_CACHE_HOME=$(mktemp -d)
+UNISHELL_COMMANDS=$SITE/missing.manifest unishell -c 'echo cached' 2>&1 | sed "s#$SITE#SITE#g"
+UNISHELL_COMMANDS=$SITE/missing.manifest unishell -c 'echo cached again' 2>&1 | sed "s#$SITE#SITE#g"
+cp "$SITE/site.manifest" "$SITE/missing.manifest"
+UNISHELL_COMMANDS=$SITE/missing.manifest unishell -c 'greet cache' 2>&1
+
+# The snapshot is made again when a module of the commands changes
+UNISHELL_COMMANDS=$SITE/site.manifest unishell --startup-profile -c 'greet unchanged' 2>&1 | grep -o "^getCommands\|^snapshot\|^Hello.*"
+echo "# edited" >> "$SITE/sitecommands.py"
+UNISHELL_COMMANDS=$SITE/site.manifest unishell --startup-profile -c 'greet edited' 2>&1 | grep -o "^getCommands\|^snapshot\|^Hello.*"
+rm -rf "$XDG_CACHE_HOME"
+
+rm -rf "$SITE"
@@ -0,0 +1,31 @@
+#!/bin/bash
+
+export XDG_CACHE_HOME=$(mktemp -d)
+SNAPSHOT=$XDG_CACHE_HOME/unishell/context.pickle
+
+phases() {
+    unishell --parser=rd --startup-profile "$@" 2>&1 | grep -o "^getCommands\|^prologue\|^snapshot\|^save\|^ran.*"
+}
+
+# The first start builds the context and saves it, later ones restore it
+phases -c 'echo ran first'
+phases -c 'echo ran second'
+
+# --no-cache neither reads nor writes the snapshot
+phases --no-cache -c 'echo ran without cache'
+
+# Snapshots of something else and unreadable ones are replaced
+python3 -c "import pickle, sys; pickle.dump(('stale', {}), open(sys.argv[1], 'wb'))" "$SNAPSHOT"
+phases -c 'echo ran stale'
+echo garbage > "$SNAPSHOT"
+phases -c 'echo ran garbage'
+phases -c 'echo ran again'
+
+# The snapshot written when unishell.py runs as a script is restored when it
+# is imported (runtests.py, the server) and the other way around
+(cd .. && python3 -c "import unishell; print('restored on import:', unishell.init())")
+rm "$SNAPSHOT"
+(cd .. && python3 -c "import unishell; unishell.initContext()")
+phases -c 'echo ran after import'
+
+rm -rf "$XDG_CACHE_HOME"
@@ -0,0 +1,35 @@
+#!/bin/bash
+
+# The second listing and the stat data read through it come from the cache
+unishell -c 'ls data/tree | filter "*.*" | select baseName size | sort baseName' \
+         -c 'ls data/tree | filter "*.*" | select baseName size | sort baseName' \
+         -c 'cache stats' | grep -v "^parse\.\|^path\."
+unishell -c 'ls data/tree | head 1' -c 'cache stats' | grep "^dir\.size"
+
+# Changes drop what was cached: a file's stat, a listing and the stat of a
+# directory (whose times change when something inside it does)
+rm -rf output/dircache && mkdir -p output/dircache/sub && echo 12345 > output/dircache/f.txt && touch output/dircache/sub/old.txt
+unishell -c 'stat output/dircache/f.txt | select baseName size' \
+         -c '!sh -c "echo more >> output/dircache/f.txt"' \
+         -c 'stat output/dircache/f.txt | select baseName size' \
+         -c 'ls output/dircache/sub | select baseName | sort baseName' \
+         -c '!touch output/dircache/sub/new.txt' \
+         -c 'ls output/dircache/sub | select baseName | sort baseName' \
+         -c 'cache stats' | grep "^baseName\|^f.txt\|^old.txt\|^new.txt\|^dir\.stat_misses"
+(cd .. && python3 -c "
+import os, sys, time
+from lib.dircache import DirCache
+cache = DirCache()
+before = cache.stat(sys.argv[1]).st_mtime_ns
+time.sleep(0.05)
+open(os.path.join(sys.argv[1], 'other.txt'), 'w').close()
+print('directory stat refreshed:', cache.stat(sys.argv[1]).st_mtime_ns != before)
+" tests/output/dircache/sub)
+rm -rf output/dircache
+
+# stat of a single file prints every field (those which depend on the file
+# system or the time the test runs are left out)
+mkdir -p output/statfile && printf "12345" > output/statfile/f.txt && chmod 644 output/statfile/f.txt
+touch -d "2020-01-02 03:04:05" output/statfile/f.txt
+unishell -c 'stat output/statfile/f.txt' | grep -v "^Access time\|^Creation time\|^Inode number\|^Dir name"
+rm -rf output/statfile
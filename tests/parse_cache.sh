@@ -0,0 +1,4 @@
+#!/bin/bash
+
+unishell --no-cache -c 'echo a' -c 'echo a' -c 'cache stats'
+unishell --no-cache -c 'cache clear' -c 'cache stats'
@@ -0,0 +1,4 @@
+#!/bin/bash
+
+cd "$(dirname $0)/.."
+python3 -m lib.compare_parsers --fuzz 2000 tests/*.ush
@@ -0,0 +1,19 @@
+#!/bin/bash
+
+# PATH is searched once per command name. Adding a program to a directory
+# searched before the one it was found in invalidates the remembered location.
+rm -rf output/pathbin && mkdir -p output/pathbin
+PATH=output/pathbin:data/bin:$PATH unishell -c '!say' -c '!say' \
+    -c '!cp data/shadow/say output/pathbin/say' \
+    -c '!say' -c 'hash say' -c 'cache stats' | grep -v "^cp:\|^parse\.\|^dir\."
+rm -rf output/pathbin
+
+# The same with absolute directories, which are watched instead of checked
+# on every hit
+mkdir -p output/pathbin
+PATH=$PWD/output/pathbin:$PWD/data/bin:$PATH unishell -c '!say' -c '!say' \
+    -c '!cp data/shadow/say output/pathbin/say' \
+    -c '!say' -c 'cache stats' | grep -v "^cp:\|^parse\.\|^dir\."
+rm -rf output/pathbin
+
+unishell -c 'hash -r' -c 'hash no_such_program'
@@ -0,0 +1,19 @@
+#!/bin/bash
+
+# Times and allocations vary, only what was profiled is compared
+unishell --no-cache -c 'profile --collapsed -f data/profile.ush' | sed "s/ [0-9]*$//"
+unishell --no-cache -c 'profile -f data/profile.ush output/profile.txt' -c 'profile' -c 'profile "echo $("'
+grep -c "data/profile.ush:" output/profile.txt
+
+unishell --no-cache --profile --profile-format=json --profile-output=output/profile.json data/profile.ush
+python3 -c "
+import json, sys
+profile = json.load(open(sys.argv[1]))
+for kind in ('statements', 'commands'):
+    for row in sorted(profile[kind], key=lambda row: row['name']):
+        print(kind, row['calls'], row['name'])
+" output/profile.json
+
+unishell --no-cache --stream --profile --profile-format=collapsed data/profile.ush 2>&1 >/dev/null | sed "s/ [0-9]*$//"
+unishell --profile --profile-format=xml -c 'echo never'
+rm -f output/profile.txt output/profile.json
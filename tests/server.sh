@@ -0,0 +1,49 @@
+#!/bin/bash
+
+export UNISHELL_SOCKET=$(mktemp -u /tmp/unishell-test.XXXXXX)
+unishell --server --no-cache 2>/dev/null &
+SERVER=$!
+while [ ! -S "$UNISHELL_SOCKET" ]; do sleep 0.05; done
+
+unishellc --no-cache -c 'echo warm'
+unishellc --no-cache -c 'exit 3'
+echo "exit status $?"
+(cd data/tree && unishellc --no-cache -c '!ls')
+FOO=bar unishellc --no-cache -c '!printenv FOO'
+echo 'echo from stdin' | unishellc --no-cache /dev/stdin
+
+# Every request starts from the server's context
+unishellc --no-cache -c 'set x 1' -c '$x'
+unishellc --no-cache -c '$x'
+
+# Different settings initialise a new interpreter
+unishellc --parser=rd -c 'echo rd'
+unishellc --server
+
+# Usage errors, --help and --version are handled by docopt in the request
+unishellc --no-such-switch 2>&1 | head -1
+unishellc --version
+
+kill $SERVER
+wait $SERVER
+
+# Without a server unishell starts as usual
+unishellc --no-cache -c 'echo cold'
+
+# Without $UNISHELL_SOCKET and $XDG_RUNTIME_DIR the socket is in a private
+# directory, one which others could use is refused
+PRIVATE=$(mktemp -d)
+(cd .. && python3 -c "
+import os, sys
+from lib.server import privateDir
+os.rmdir(sys.argv[1])
+print(oct(os.stat(privateDir(sys.argv[1])).st_mode & 0o777))
+os.chmod(sys.argv[1], 0o755)
+try:
+    privateDir(sys.argv[1])
+except PermissionError as e:
+    print('PermissionError')
+" "$PRIVATE")
+rm -rf "$PRIVATE"
+(unset UNISHELL_SOCKET XDG_RUNTIME_DIR; cd .. && python3 -c "from lib.server import defaultSocketPath; print(defaultSocketPath())") \
+    | sed "s#/tmp/unishell-$(id -u)/#/tmp/unishell-UID/#"
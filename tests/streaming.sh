@@ -0,0 +1,12 @@
+#!/bin/bash
+
+unishell --stream var_subst.ush cmd_subst.ush string_escapes.ush multiline_string.ush
+unishell --stream -s multiline_string.ush
+unishell --stream bad_input.ush
+
+# A quote left open is reported where its statement starts, without parsing
+# the statement again for every line read after it
+UNTERMINATED=$(mktemp)
+{ echo 'echo before'; echo 'echo "never closed'; seq 1 20000; } > "$UNTERMINATED"
+timeout 10 unishell --stream "$UNTERMINATED"
+rm -f "$UNTERMINATED"
@@ -0,0 +1,32 @@
+#!/bin/bash
+
+# Tables use NumPy arrays when NumPy is installed and array.array otherwise,
+# both give the same results. Without NumPy both runs use array.array.
+(cd .. && python3 -c "
+import sys
+from pipeline.objects import Table as tableModule
+from pipeline.objects.FileInfo import scanDir
+
+def queries():
+    table = tableModule.Table.fromObjects(entry for entry in scanDir(sys.argv[1]) if '.' in entry.baseName)
+    empty = table.filter('size', 'gt', 100)
+    return [
+        ('sort', list(table.sort('size', reverse=True).project(['baseName', 'size']).rows())),
+        ('where', list(table.filter('size', 'le', 12).project(['baseName']).sort('baseName').rows())),
+        ('like', list(table.filter('baseName', 'like', '*.txt').project(['size']).sort('size').rows())),
+        ('sum', table.aggregate('sum', 'size')),
+        ('min', table.aggregate('min', 'size')),
+        ('mean', table.aggregate('mean', 'size')),
+        ('count', table.aggregate('count', 'size')),
+        ('empty max', empty.aggregate('max', 'size')),
+        ('empty rows', list(empty.sort('size').rows())),
+        ('no input', tableModule.Table.fromObjects([]).filter('size', 'gt', 1).aggregate('sum', 'size')),
+    ]
+
+results = {}
+for backend, numpy in (('numpy', None), ('array', False)):
+    tableModule.gNumpy = numpy
+    results[backend] = queries()
+for (name, withNumpy), (_, withArray) in zip(results['numpy'], results['array']):
+    print(name, withArray, 'same' if withNumpy == withArray else 'differs: {!r}'.format(withNumpy))
+" tests/data/tree)
@@ -6,4 +6,6 @@ unishell -c 'set msg "Hello C"; $msg'
 unishell -i  --no-banner -c 'exit'
 unishell -c 'exit 1'
 unishell -c 'exit 2'
-unishell -s -c 'echo ===='
\ No newline at end of file
+unishell -s -c 'echo ===='
+unishell --trace-only=parse,bogus -c 'echo not run'; echo "exit status $?"
+unishell --parser=bogus -c 'echo not run'; echo "exit status $?"
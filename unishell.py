@@ -2,7 +2,8 @@
 """UniShell
 
 Usage:
-  unishell [(-t | --trace)] [(-i | --interactive) [--no-banner]] [-s | --syntax] [(-c COMMAND) ...] [FILE ...]
+  unishell [(-t | --trace) | --trace-only=CATEGORIES] [(-i | --interactive) [--no-banner]] [-s | --syntax] [--no-cache] [--parser=BACKEND] [--startup-profile] [--stream] [--profile [--profile-format=FORMAT] [--profile-output=FILE]] [(-c COMMAND) ...] [FILE ...]
+  unishell --server [--socket=PATH] [--no-cache] [--parser=BACKEND]
   unishell (-h | --help)
   unishell --version
 
@@ -11,26 +12,56 @@ Options:
   -s --syntax        Check syntax but do not run anything
   -i --interactive   Start interactive shell
   -t --trace         Print debug trace messages.
+  --trace-only=CATEGORIES  Only trace the given comma separated categories
+                     (init, parse, eval, cache)
   --no-banner        Suppress unishell banner
+  --no-cache         Do not read or write cached script parses and the
+                     context snapshot on disk
+  --parser=BACKEND   Parser backend, peg or rd (faster) [default: peg]
+  --startup-profile  Print how long each startup phase took to stderr
+  --stream           Read, parse and run script files one statement at a
+                     time (uses the rd parser, keeps memory use flat)
+  --profile          Profile the statements and commands run (not the
+                     prologue), see lib.profiler. The profile is printed
+                     to stderr at exit unless --profile-output is given
+  --profile-format=FORMAT  report, json or collapsed (for flame graphs)
+                     [default: report]
+  --profile-output=FILE  Write the profile to FILE
+  --server           Keep an initialised interpreter running and run the
+                     command lines sent by unishellc on it
+  --socket=PATH      Unix socket of the server (default: $UNISHELL_SOCKET
+                     or a per user path)
   -h --help          Show this screen.
   --version          Show version.
   FILE               UniShell Script file (usually *.ush)
 """
 
+from time import perf_counter
+
+gStartTime = perf_counter()
+
+import os
+import sys
 # noinspection PyUnresolvedReferences
 import readline
 from os import path
-from inspect import getmembers
 
 from docopt import docopt
 from arpeggio import NoMatch
 
-from commands import *
 from formatters import printDict, printList, printObject
-from lib.logger import setDebugLevel, dbg
-from interpreter import Interpreter
-from lib.prologue import prologue
-
+from lib.exceptions import BadSyntax
+from pipeline import isStream, materialize
+from pipeline.jobs import gJobs
+from pipeline.process import Process
+from lib.dircache import gDirCache
+from lib.pathhash import gPathHash
+from lib.logger import gCategories, setDebugLevel, trace
+from interpreter import Interpreter, Environment, version, gBackends
+from lib.prologue import prologue, defaultPrompt
+from lib import registry, snapshot
+
+gImportTime = perf_counter() - gStartTime
 
 gBanner = """\
  _    _       _  _____ _          _ _
@@ -41,31 +72,52 @@ gBanner = """\
  \____/|_| |_|_|_____/|_| |_|\___|_|_|
 """
 
-version = "0.0.1"
-
 gInitDir = None
 gContext = None
 gOptions = None
 gCheckSyntax = False
 gInterpreter = None
+# The (diskCache, backend) gInterpreter was made with
+gSettings = None
+# The Profiler of a --profile run
+gProfiler = None
+gStartupPhases = [("imports", gImportTime)]
 
 
 def getCommands():
-    import commands
+    # Commands are only imported when first called, see lib.registry
+    return registry.loadCommands()
+
+
+def contextKey():
+    """
+    Return the key of snapshots of the context as it is after init() and
+    the prologue, see lib.snapshot.
+    """
+    modulePaths = registry.manifestPaths() + registry.modulePaths()
+    modulePaths.append(path.realpath(__file__))
+    modulePaths.append(path.realpath(defaultPrompt.__code__.co_filename))
+    return snapshot.snapshotKey(gInterpreter.cache.tag, prologue, modulePaths)
 
-    members = getmembers(commands)
-    c = filter(lambda x: x[0].startswith("cmd"), members)
-    c = map(lambda x: (x[0][3:].lower(), x[1]), c)
-    return dict(list(c))
 
+def saveSnapshot():
+    state = {name: value for name, value in gContext.items() if name != "caches"}
+    snapshot.save(contextKey(), state)
 
-def init():
+
+def init(diskCache=True, backend="peg"):
+    """
+    Create the interpreter and the context, restoring the context from a
+    snapshot if diskCache is True and there is a current one. Returns True
+    if it was restored, the prologue has been run on it already.
+    """
     global gInitDir
     global gContext
     global gCheckSyntax
     global gInterpreter
+    global gSettings
 
-    dbg("Init called")
+    trace("init", "Init called")
 
     gCheckSyntax = False
 
@@ -74,24 +126,45 @@ def init():
     else:
         os.chdir(gInitDir)
 
-    gInterpreter = Interpreter()
-
-    commands = getCommands()
-
-    gContext = {
-        "vars": commands,
-        "exported_vars": {
+    start = perf_counter()
+    gInterpreter = Interpreter(diskCache=diskCache, backend=backend)
+    gSettings = (diskCache, backend)
+    gStartupPhases.append(("interpreter", perf_counter() - start))
 
-        },
-        "options": {
-            "prompt": [lambda a, f, ctx: os.getcwd() + "> "]
-            , "echo": [False]
-            , "autoprint": [True]
+    start = perf_counter()
+    state = snapshot.load(contextKey()) if diskCache else None
+    restored = state is not None
+    if restored:
+        gStartupPhases.append(("snapshot", perf_counter() - start))
+    else:
+        start = perf_counter()
+        commands = getCommands()
+        gStartupPhases.append(("getCommands", perf_counter() - start))
+
+        state = {
+            "vars": Environment(commands),
+            "exported_vars": {
+
+            },
+            "options": {
+                "prompt": [defaultPrompt]
+                , "echo": [False]
+                , "autoprint": [True]
+            }
         }
+
+    gContext = dict(state)
+    gContext["caches"] = {
+        "parse": gInterpreter.cache,
+        "dir": gDirCache,
+        "path": gPathHash
     }
 
     gContext["vars"]["INIT_DIR"] = gInitDir
 
+    # Otherwise the prologue still has to be run
+    return restored
+
 
 def printBanner():
     print(gBanner)
@@ -112,37 +185,94 @@ def getOption(name):
     return gContext["options"][name][-1]
 
 
-def execute(source, context):
+def emitResult(result):
+    """
+    Print the result of a statement as soon as it has run, so a stream (or
+    the output of a program) is printed as it is produced rather than first
+    collected in memory. Without autoprint it is only drained.
+    """
+    trace("eval", "RESULT: {!r}", result)
+    if getOption("autoprint"):
+        printResult(result)
+    else:
+        materialize(result)
+
+
+def execute(source, context, scriptPath=None):
     try:
-        dbg("----------PARSING---------")
-        program = gInterpreter.parse(source)
+        trace("parse", "----------PARSING---------")
+        program = gInterpreter.parse(source, scriptPath)
 
         if not gCheckSyntax:
-            dbg("----------RUNNING---------")
-            result = program(context)
-
-            dbg("RESULT:", repr(result))
-            autoPrint = getOption("autoprint")
-
-            if result and autoPrint:
-                for r in result:
-                    if issubclass(type(r), list):
-                        printList(r)
-                    elif issubclass(type(r), dict):
-                        printDict(r)
-                    elif r is not None:
-                        printObject(r)
-    except NoMatch as e:
+            if gProfiler is not None:
+                gProfiler.addSource(program, source, path.basename(scriptPath) if scriptPath else "-c")
+            trace("eval", "----------RUNNING---------")
+            gInterpreter.compile(program, gProfiler)(context, emitResult)
+    except (NoMatch, BadSyntax) as e:
+        print("SYNTAX ERROR: ", e)
+    else:
+        if gCheckSyntax:
+            print("Syntax OK.")
+
+
+def executeStream(lines, context, name="-"):
+    """
+    Run a script statement by statement as it is read from lines. Nothing but
+    the current statement and its result is kept in memory.
+    """
+    try:
+        for i, expr in enumerate(gInterpreter.iterStatements(lines)):
+            if gCheckSyntax:
+                continue
+
+            # Only the statement's number is known when profiling
+            emitResult(gInterpreter.compileStatement(expr, gProfiler, "{}:#{}".format(name, i + 1))(context))
+    except BadSyntax as e:
         print("SYNTAX ERROR: ", e)
     else:
         if gCheckSyntax:
             print("Syntax OK.")
 
 
+def printResult(r):
+    if issubclass(type(r), list):
+        printList(r)
+    elif isinstance(r, Process):
+        # Output which is only printed is copied without decoding it
+        sys.stdout.flush()
+        r.copyTo(sys.stdout.fileno())
+    elif isStream(r):
+        # Print items as they are produced
+        for elem in r:
+            printObject(elem)
+    elif issubclass(type(r), dict):
+        printDict(r)
+    elif r is not None:
+        printObject(r)
+
+
+def reportFinishedJobs(wait=False):
+    """
+    Print the background jobs which have finished (and not been collected
+    with fg or wait) along with their output. If wait is True wait for all
+    jobs to finish first.
+    """
+    if wait:
+        for job in gJobs.list():
+            job.wait()
+
+    for job in gJobs.takeFinished():
+        print(job.status())
+        if getOption("autoprint"):
+            printResult(job.result)
+        job.reportErrors()
+
+
 def startRepl(noBanner):
     if not noBanner:
         printBanner()
     while True:
+        reportFinishedJobs()
         try:
             prompt = getOption("prompt")
             if callable(prompt):
@@ -159,21 +289,92 @@ def startRepl(noBanner):
 
 
 def evalPrologue():
-    dbg("Evaluating prologue")
+    """
+    Run the prologue on the context, returning False if it has a syntax
+    error.
+    """
+    trace("init", "Evaluating prologue")
+    start = perf_counter()
+    loadTime = gInterpreter.parserLoadTime
+    ok = True
     try:
         gInterpreter.evaluate(prologue, getCtx())
-    except NoMatch as e:
+    except (NoMatch, BadSyntax) as e:
         print("SYNTAX ERROR IN PROLOGUE! ", e)
+        ok = False
+
+    # The grammar is loaded lazily by the first parse, report it separately
+    grammarTime = gInterpreter.parserLoadTime - loadTime
+    gStartupPhases.append(("grammar", grammarTime))
+    gStartupPhases.append(("prologue", perf_counter() - start - grammarTime))
+    return ok
+
+
+def initContext(diskCache=True, backend="peg"):
+    """
+    init() and run the prologue, unless the context was restored from a
+    snapshot. A context built from scratch is saved as the new snapshot.
+    """
+    if init(diskCache=diskCache, backend=backend):
+        return
+    if evalPrologue() and diskCache:
+        start = perf_counter()
+        saveSnapshot()
+        gStartupPhases.append(("save", perf_counter() - start))
+
+
+def printStartupProfile():
+    print("Startup profile", file=sys.stderr)
+    print("===============", file=sys.stderr)
+    for phase, seconds in gStartupPhases:
+        print("{:<12} {:8.2f} ms".format(phase, seconds * 1000), file=sys.stderr)
+    print("{:<12} {:8.2f} ms".format("total", (perf_counter() - gStartTime) * 1000), file=sys.stderr)
+
+
+def startProfile(args):
+    global gProfiler
+    from lib.profiler import Profiler, gFormats
+
+    if args['--profile-format'] not in gFormats:
+        print("ERROR: Unknown profile format {}, expected one of {}".format(args['--profile-format'],
+                                                                            ", ".join(gFormats)), file=sys.stderr)
+        sys.exit(2)
+    gProfiler = Profiler()
+    gProfiler.start()
+
+
+def stopProfile(args):
+    global gProfiler
+
+    profiler, gProfiler = gProfiler, None
+    profiler.stop()
+    text = profiler.format(args['--profile-format'])
+    if args['--profile-output']:
+        try:
+            with open(args['--profile-output'], "w") as f:
+                f.write(text)
+        except OSError as e:
+            print("ERROR: {}".format(e), file=sys.stderr)
+    else:
+        sys.stdout.flush()
+        print(text, end="", file=sys.stderr)
 
 
 def main(args):
-    init()
     global gCheckSyntax
 
+    # A server's children start out initialised (see serveRequest)
+    if gContext is None or gSettings != (not args['--no-cache'], args['--parser']):
+        initContext(diskCache=not args['--no-cache'], backend=args['--parser'])
+
     if args['--syntax']:
         gCheckSyntax = True
 
-    evalPrologue()
+    if args['--startup-profile']:
+        printStartupProfile()
+
+    if args['--profile']:
+        startProfile(args)
 
     doRepl = True
     if args['-c']:
@@ -193,8 +394,10 @@ def main(args):
             getVars()["SCRIPT_NAME"] = scriptName
 
             with open(arg, "r") as f:
-                source = f.read()
-                execute(source, getCtx())
+                if args['--stream']:
+                    executeStream(f, getCtx(), scriptName)
+                else:
+                    execute(f.read(), getCtx(), scriptPath)
         except FileNotFoundError as e:
             print("ERROR: {}".format(e), file=sys.stderr)
         finally:
@@ -205,11 +408,73 @@ def main(args):
     if doRepl or args['--interactive']:
         startRepl(args['--no-banner'])
 
+    # Jobs run on daemon threads, do not exit from under them
+    reportFinishedJobs(wait=True)
 
-if __name__ == '__main__':
-    cmdLineArgs = docopt(__doc__, version=version)
-    if cmdLineArgs['--trace']:
+    if gProfiler is not None:
+        stopProfile(args)
+
+
+def parseArgs(argv=None):
+    start = perf_counter()
+    args = docopt(__doc__, argv=argv, version=version)
+    gStartupPhases.append(("args", perf_counter() - start))
+    if args['--trace']:
         setDebugLevel(1)
-    dbg("Docopt args:{}".format(repr(cmdLineArgs)))
-    main(cmdLineArgs)
+    elif args['--trace-only']:
+        try:
+            setDebugLevel(1, args['--trace-only'].split(","))
+        except ValueError as e:
+            print("ERROR: {}, expected a comma separated list of {}".format(e, ", ".join(gCategories)),
+                  file=sys.stderr)
+            sys.exit(2)
+    if args['--parser'] not in gBackends:
+        print("ERROR: Unknown parser backend {!r}, expected one of {}".format(args['--parser'], ", ".join(gBackends)),
+              file=sys.stderr)
+        sys.exit(2)
+    trace("init", "Docopt args:{!r}", args)
+    return args
+
+
+def serveRequest(argv):
+    """
+    Run a command line sent by unishellc, in a process forked from the
+    server with the client's directory, environment and standard files.
+    The process has its own copy of the initialised interpreter and
+    context, so only what differs from a cold start is redone here.
+    """
+    global gStartTime
+    global gStartupPhases
+    global gInitDir
+
+    gStartTime = perf_counter()
+    gStartupPhases = []
+    args = parseArgs(argv)
+    if args['--server']:
+        print("ERROR: Cannot start a server from a server", file=sys.stderr)
+        return 2
+
+    gInitDir = os.getcwd()
+    getVars()["INIT_DIR"] = gInitDir
+    main(args)
+    return 0
+
+
+def serve(args):
+    from lib import server
+
+    initContext(diskCache=not args['--no-cache'], backend=args['--parser'])
+    try:
+        server.serve(args['--socket'] or server.defaultSocketPath(), serveRequest)
+    except OSError as e:
+        print("ERROR: {}".format(e), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    cmdLineArgs = parseArgs()
+    if cmdLineArgs['--server']:
+        serve(cmdLineArgs)
+    else:
+        main(cmdLineArgs)
 